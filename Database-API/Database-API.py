@@ -1,28 +1,47 @@
-from fastapi import FastAPI, File, UploadFile, Form, Depends, HTTPException, Query, Path, Body
+from fastapi import FastAPI, File, UploadFile, Form, Depends, HTTPException, Query, Path, Body, BackgroundTasks, Request, Response, Header
+from fastapi.concurrency import run_in_threadpool
 from typing import List, Optional
 import os
+import asyncio
+import time
 import uuid
 from uuid import UUID
 from PIL import Image
+from sqlalchemy import select, update, func, bindparam
 from sqlalchemy.orm import Session
-from database import engine, Base, get_db
+from sqlalchemy.exc import IntegrityError
+from contextlib import asynccontextmanager
+from datetime import datetime
+from database import engine, Base, get_db, SessionLocal
 import models
+import annotations
+import propagation
+import blob_store
+import ingest
+import renditions
+import video_frames
+import stats
+import frame_cache
+import jobs
+import auto_label
+import export
+import manage
+import offload
 import json
 import bcrypt
-import zipfile
 import io
 import base64
-import requests
-import shutil
-import tempfile
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from sklearn.model_selection import train_test_split
-import yaml
-from fastapi.responses import StreamingResponse
-import cv2
+from fastapi.responses import StreamingResponse, FileResponse
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    stop = jobs.start()
+    yield
+    jobs.stop_workers(stop)
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -33,6 +52,13 @@ app.add_middleware(
 )
 
 Base.metadata.create_all(bind=engine)
+# create_all no añade columnas ni índices nuevos a tablas que ya existían.
+manage.add_missing_columns()
+manage.migrate_members()
+manage.backfill_boxes()
+manage.reconcile_stats(only_missing=True)
+for index in models.ImageEntry.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
 
 class RenameProjectRequest(BaseModel):
     name: str
@@ -41,16 +67,155 @@ class AnnotationUpdate(BaseModel):
     annotations: List[str]
     finished: bool = False
 
-@app.post("/upload")
-async def upload_project(
-    project_name: str = Form(...),
-    project_owner: str = Form(...),
-    labels: List[str] = Form(...),
-    colors: List[str] = Form(...),
-    folder: UploadFile = File(...),
-    db: Session = Depends(get_db)
-):
-    user = db.query(models.User).filter(models.User.email == project_owner).first()
+class BulkAnnotationItem(BaseModel):
+    image_id: Optional[int] = None
+    frame_number: Optional[int] = None
+    annotations: List[str]
+    finished: bool = False
+
+class BulkAnnotationUpdate(BaseModel):
+    items: List[BulkAnnotationItem]
+    # Si alguna entrada falla no se guarda ninguna.
+    atomic: bool = False
+
+class PropagationRequest(BaseModel):
+    frames: int = 10
+
+class JobProgress(BaseModel):
+    epoch: Optional[int] = None
+    epochs: Optional[int] = None
+    predicted_frames: Optional[int] = None
+    frames_to_predict: Optional[int] = None
+
+JOB_EVENTS_INTERVAL = float(os.getenv("JOB_EVENTS_INTERVAL", 1))
+
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+IMAGE_MODES = ["inline", "url"]
+FRAME_RANGE_MAX = int(os.getenv("FRAME_RANGE_MAX", 200))
+BULK_ANNOTATIONS_MAX_ITEMS = int(os.getenv("BULK_ANNOTATIONS_MAX_ITEMS", 20000))
+PROPAGATION_MAX_FRAMES = int(os.getenv("PROPAGATION_MAX_FRAMES", 100))
+
+def image_etag(image: models.ImageEntry, size: str = "original") -> str:
+    if size == "original":
+        return f'"{image.image_hash}"'
+    return f'"{image.image_hash}-{size}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+def raw_image_response(image: models.ImageEntry, request: Request, size: str = "original"):
+    """
+    Sirve los bytes de la imagen (o de una de sus versiones reducidas) desde el almacén de
+    blobs con ETag fuerte, caché inmutable y soporte de Range. Si el cliente ya la tiene devuelve 304.
+    """
+    validate_size(size)
+    etag = image_etag(image, size)
+    headers = {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(
+        renditions.ensure(image.image_hash, size),
+        media_type=image.mime_type if size == "original" else renditions.MIME_TYPE,
+        headers=headers
+    )
+
+def image_payload(image_id: int, image_hash: str, request: Request, image_mode: str, size: str = "original") -> dict:
+    if image_mode == "url":
+        url = request.url_for("get_raw_image", image_id=image_id)
+        if size != "original":
+            url = url.include_query_params(size=size)
+        return {"image_url": str(url)}
+    if size == "original":
+        return {"image": base64.b64encode(cached_image_bytes(image_hash)).decode("utf-8")}
+    with open(renditions.ensure(image_hash, size), "rb") as f:
+        return {"image": base64.b64encode(f.read()).decode("utf-8")}
+
+def cached_image_bytes(image_hash: str) -> bytes:
+    data = frame_cache.images.get(image_hash)
+    if data is None:
+        data = blob_store.read(image_hash)
+        frame_cache.images.put(image_hash, data)
+    return data
+
+def load_project_metadata(db: Session, project_id: UUID) -> Optional[dict]:
+    """
+    Etiquetas y colores del proyecto, desde la caché si ya se pidieron antes.
+    """
+    metadata = frame_cache.projects.get(project_id)
+    if metadata is None:
+        token = frame_cache.projects.token(project_id)
+        project = db.query(models.Project.labels, models.Project.colors).filter(models.Project.id == project_id).first()
+        if not project:
+            return None
+        metadata = {"labels": json.loads(project.labels), "colors": json.loads(project.colors)}
+        frame_cache.projects.put(project_id, metadata, token)
+    return metadata
+
+def frame_record(image: models.ImageEntry) -> dict:
+    _, ext = os.path.splitext(image.image_name)
+    return {
+        "image_id": image.id,
+        "image_name": image.image_name,
+        "frame_number": image.frame_number,
+        "yolo": image.yolo,
+        "finished": image.finished,
+        "image_hash": image.image_hash,
+        "format": ext[1:].lower(),
+        "source_timestamp": image.source_timestamp
+    }
+
+def load_frames(db: Session, project_id: UUID, frame_numbers: List[int]) -> dict:
+    """
+    Devuelve {frame_number: registro} para los frames pedidos que existan. Los que no están en
+    caché se leen con una única consulta por rango sobre ix_project_frame.
+    """
+    found = {}
+    missing = {}
+    for frame_number in frame_numbers:
+        record = frame_cache.frames.get((project_id, frame_number))
+        if record is None:
+            missing[frame_number] = frame_cache.frames.token((project_id, frame_number))
+        else:
+            found[frame_number] = record
+
+    if missing:
+        images = db.query(models.ImageEntry).filter(
+            models.ImageEntry.project_id == project_id,
+            models.ImageEntry.frame_number >= min(missing),
+            models.ImageEntry.frame_number <= max(missing)
+        ).all()
+        for image in images:
+            if image.frame_number in missing:
+                record = frame_record(image)
+                frame_cache.frames.put((project_id, image.frame_number), record, missing[image.frame_number])
+                found[image.frame_number] = record
+
+    return found
+
+def validate_image_mode(image_mode: str) -> None:
+    if image_mode not in IMAGE_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid image_mode, expected one of: {', '.join(IMAGE_MODES)}")
+
+def validate_size(size: str) -> None:
+    if size not in renditions.SIZES:
+        raise HTTPException(status_code=400, detail=f"Invalid size, expected one of: {', '.join(renditions.SIZES)}")
+
+def require_project(db: Session, project_id: UUID) -> None:
+    if not db.query(models.Project.id).filter(models.Project.id == project_id).first():
+        raise HTTPException(status_code=404, detail="Project not found")
+
+def create_upload_job(db: Session, project_name: str, project_owner: str, labels: list, colors: list) -> tuple:
+    """
+    Crea el proyecto, con su propietario y sus contadores, y el job que procesará la subida.
+    Devuelve (project_id, job_id).
+    """
+    if not db.query(models.User).filter(models.User.email == project_owner).first():
+        raise HTTPException(status_code=404, detail="User not found")
 
     project_id = uuid.uuid4()
     project = models.Project(
@@ -62,85 +227,63 @@ async def upload_project(
         colors=json.dumps(colors)
     )
     db.add(project)
+    db.add(models.ProjectMember(project_id=project_id, user_email=project_owner, role="owner"))
+    stats.create(db, project_id)
     db.commit()
-    db.refresh(project)
-
-    if user.projects:
-        project_list = json.loads(user.projects)
-        project_list.append(str(project_id))
-    else:
-        project_list = [str(project_id)]
 
-    user.projects = json.dumps(project_list)
+    # La subida se procesa en este proceso, que es el único que puede recuperarla.
+    job = models.Job(project_id=project_id, kind="upload", owner=jobs.INSTANCE_ID)
+    db.add(job)
     db.commit()
+    return project_id, job.id
 
-    zip_data = await folder.read()
-    temp_path = f"temp/{project_id}"
-    os.makedirs(temp_path, exist_ok=True)
-
-    with zipfile.ZipFile(io.BytesIO(zip_data), 'r') as zip_ref:
-        zip_ref.extractall(temp_path)
-
-    frame_counter = 1
-    for root, _, files in os.walk(temp_path):
-        for file in sorted(files):
-            file_path = os.path.join(root, file)
-            file_ext = file.lower().split('.')[-1]
-
-            if file_ext in ["jpg", "png"]:
-                img = Image.open(file_path)
-                width, height = img.size
-                extension = os.path.splitext(file)[1].lower()
-                unique_name = f"frame_{frame_counter:06d}{extension}"
-
-                with open(file_path, "rb") as image_file:
-                    img_bytes = image_file.read()
-
-                yolo_data = None
-                txt_file = os.path.splitext(file_path)[0] + ".txt"
-                if os.path.exists(txt_file):
-                    with open(txt_file, "r") as f:
-                        yolo_data = f.read()
-
-                db.add(models.ImageEntry(
-                    project_id=project.id,
-                    image_name=unique_name,
-                    image=img_bytes,
-                    yolo=yolo_data if yolo_data else None,
-                    frame_number=frame_counter
-                ))
-                frame_counter += 1
-
-            elif file_ext in ["mp4", "avi", "mov", "mkv"]:
-                cap = cv2.VideoCapture(file_path)
-                fps = cap.get(cv2.CAP_PROP_FPS)
-                if not fps or fps <= 0:
-                    fps = 30
-                frame_interval = int(fps / 10) if fps >= 10 else 1
-
-                frame_idx = 0
-                while True:
-                    ret, frame = cap.read()
-                    if not ret:
-                        break
-                    if frame_idx % frame_interval == 0:
-                        _, buffer = cv2.imencode('.jpg', frame)
-                        img_bytes = buffer.tobytes()
-                        unique_name = f"frame_{frame_counter:06d}.jpg"
-
-                        db.add(models.ImageEntry(
-                            project_id=project.id,
-                            image_name=unique_name,
-                            image=img_bytes,
-                            yolo=None,
-                            frame_number=frame_counter
-                        ))
-                        frame_counter += 1
-                    frame_idx += 1
-                cap.release()
+@app.post("/upload")
+async def upload_project(
+    background_tasks: BackgroundTasks,
+    project_name: str = Form(...),
+    project_owner: str = Form(...),
+    labels: List[str] = Form(...),
+    colors: List[str] = Form(...),
+    folder: UploadFile = File(...),
+    video_sampling: str = Form(video_frames.VIDEO_SAMPLING)
+):
+    """
+    Crea el proyecto y procesa el ZIP en segundo plano. Los vídeos se muestrean con
+    video_sampling: "interval" (uno de cada fps/10 frames) o "scene" (solo los frames que
+    cambian respecto al último conservado).
+    """
+    if video_sampling not in video_frames.SAMPLING_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid video_sampling, expected one of: {', '.join(video_frames.SAMPLING_MODES)}")
 
-    db.commit()
-    return {"message": "Project uploaded and processed successfully", "project_id": str(project.id)}
+    # El ZIP se valida antes de crear nada, así una subida inválida no deja un proyecto vacío.
+    upload_path = ingest.spool_path(uuid.uuid4())
+    if not await offload.run("files", ingest.spool_upload, folder.file, upload_path):
+        os.remove(upload_path)
+        raise HTTPException(status_code=400, detail="Uploaded file is not a valid ZIP archive")
+
+    try:
+        project_id, job_id = await offload.run_db(create_upload_job, project_name, project_owner, labels, colors)
+    except Exception:
+        os.remove(upload_path)
+        raise
+    zip_path = ingest.spool_path(job_id)
+    os.replace(upload_path, zip_path)
+
+    # La ingesta tiene su propio límite de hilos: varias subidas a la vez se procesan por turnos.
+    background_tasks.add_task(offload.run, "ingest", ingest.ingest_archive, job_id, project_id, zip_path, video_sampling)
+
+    return {"message": "Project uploaded, processing frames", "project_id": str(project_id), "job_id": str(job_id)}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: UUID, db: Session = Depends(get_db)):
+    """
+    Devuelve el estado y progreso de un trabajo en segundo plano (procesado de /upload o autoetiquetado).
+    """
+    job = db.query(models.Job).filter(models.Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return jobs.serialize(job)
 
 @app.delete("/project/{project_id}")
 def delete_project(project_id: UUID, db: Session = Depends(get_db)):
@@ -148,14 +291,21 @@ def delete_project(project_id: UUID, db: Session = Depends(get_db)):
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
+    db.query(models.Box).filter(models.Box.project_id == project_id).delete()
     db.query(models.ImageEntry).filter(models.ImageEntry.project_id == project_id).delete()
+    db.query(models.Job).filter(models.Job.project_id == project_id).delete()
+    db.query(models.SyntheticDraft).filter(models.SyntheticDraft.project_id == project_id).delete()
+    db.query(models.ProjectMember).filter(models.ProjectMember.project_id == project_id).delete()
+    db.query(models.ProjectClassStats).filter(models.ProjectClassStats.project_id == project_id).delete()
+    db.query(models.ProjectStats).filter(models.ProjectStats.project_id == project_id).delete()
     db.delete(project)
     db.commit()
+    frame_cache.invalidate_project(project_id)
     
     return {"message": "Project and associated images deleted successfully"}
 
 @app.put("/project/{project_id}/labels")
-async def update_labels_form(
+def update_labels_form(
     project_id: UUID,
     labels: List[str] = Form(...),
     colors: List[str] = Form(...),
@@ -168,6 +318,7 @@ async def update_labels_form(
     project.labels = json.dumps(labels)
     project.colors = json.dumps(colors)
     db.commit()
+    frame_cache.projects.invalidate(project_id)
 
     return {"message": "Project labels and colors updated successfully"}
 
@@ -189,8 +340,7 @@ def register_user(
     
     new_user = models.User(
         email=email,
-        password=password_hash.decode(),
-        projects=json.dumps([])
+        password=password_hash.decode()
     )
     
     db.add(new_user)
@@ -203,19 +353,17 @@ def register_user(
 def get_projects_by_email(
     email: str,
     states: Optional[List[str]] = Query(None),
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, description="Sin límite si no se indica"),
     db: Session = Depends(get_db)
 ):
     """
-    Devuelve los proyectos asociados a un usuario dado su correo, con la opción de filtrar por estado.
+    Devuelve los proyectos asociados a un usuario dado su correo, con la opción de filtrar por
+    estado y paginar con 'skip'/'limit'. Los proyectos salen en el orden en que se le dio acceso.
     """
-    user = db.query(models.User).filter(models.User.email == email).first()
-    
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    project_ids = json.loads(user.projects)
-    project_ids = [UUID(project_id) for project_id in project_ids]
-    query = db.query(models.Project).filter(models.Project.id.in_(project_ids))
+    query = db.query(models.Project, models.ProjectMember.role).join(
+        models.ProjectMember, models.ProjectMember.project_id == models.Project.id
+    ).filter(models.ProjectMember.user_email == email)
     
     if states:
         valid_states = ["Finished", "In Progress", "Not Started"]
@@ -226,18 +374,21 @@ def get_projects_by_email(
         
         query = query.filter(models.Project.status.in_(states))
     
-    projects = query.all()
+    projects = query.order_by(models.ProjectMember.created_at, models.Project.id).offset(skip).limit(limit).all()
     
     if not projects:
+        if not db.query(models.User).filter(models.User.email == email).first():
+            raise HTTPException(status_code=404, detail="User not found")
         raise HTTPException(status_code=404, detail="No projects found for this user")
     
     project_data = []
-    for project in projects:
+    for project, role in projects:
         project_data.append({
             "project_id": str(project.id),
             "name": project.name,
             "status": project.status,
             "owner": project.owner,
+            "role": role,
             "labels": json.loads(project.labels),
             "colors": json.loads(project.colors)
         })
@@ -282,15 +433,27 @@ def rename_project(
 @app.get("/project/{project_id}/images")
 def get_images_by_project(
     project_id: UUID,
+    request: Request,
     finished: bool = None,
     synthetic: bool = None,
     skip: int = 0,
     limit: int = 6,
+    after: Optional[int] = Query(None, description="Cursor: devuelve los frames posteriores a este frame_number"),
+    before: Optional[int] = Query(None, description="Cursor: devuelve los frames anteriores a este frame_number"),
+    include_total: bool = False,
+    image_mode: str = Query("inline", description="'inline' para la imagen en base64, 'url' para devolver su URL"),
+    size: str = Query("original", description="original, thumb o preview"),
     db: Session = Depends(get_db)
 ):
     """
-    Devuelve las imágenes y anotaciones de un proyecto dado su ID, con soporte para paginación y filtrado por 'finished' y 'synthetic'.
+    Devuelve las imágenes y anotaciones de un proyecto dado su ID, ordenadas por frame_number, con
+    filtrado por 'finished' y 'synthetic' y paginación por cursor ('after'/'before', usando
+    'next_cursor'/'prev_cursor' de la respuesta anterior). 'skip' se mantiene por compatibilidad.
     """
+    validate_image_mode(image_mode)
+    validate_size(size)
+    if after is not None and before is not None:
+        raise HTTPException(status_code=400, detail="Use either 'after' or 'before', not both")
     project = db.query(models.Project).filter(models.Project.id == project_id).first()
 
     if not project:
@@ -304,14 +467,23 @@ def get_images_by_project(
     if synthetic is not None:
         query = query.filter(models.ImageEntry.synthetic == synthetic)
 
-    images = query.offset(skip).limit(limit).all()
+    frame = models.ImageEntry.frame_number
+    if before is not None:
+        images = query.filter(frame < before).order_by(frame.desc()).limit(limit).all()
+        images.reverse()
+    elif after is not None:
+        images = query.filter(frame > after).order_by(frame).limit(limit).all()
+    else:
+        images = query.order_by(frame).offset(skip).limit(limit).all()
     
     if not images:
         raise HTTPException(status_code=404, detail="No images found for this project")
 
+    has_next = db.query(query.filter(frame > images[-1].frame_number).exists()).scalar()
+    has_prev = db.query(query.filter(frame < images[0].frame_number).exists()).scalar()
+
     image_data = []
     for image in images:
-        encoded_image = base64.b64encode(image.image).decode('utf-8')
         yolo_data = image.yolo.splitlines() if image.yolo else []
         image_data.append({
             "image_name": image.image_name,
@@ -320,66 +492,519 @@ def get_images_by_project(
             "synthetic": image.synthetic,
             "finished": image.finished,
             "frame_number": image.frame_number,
-            "image": encoded_image
+            **image_payload(image.id, image.image_hash, request, image_mode, size)
         })
 
-    return {"images": image_data}
+    response = {
+        "images": image_data,
+        "next_cursor": images[-1].frame_number if has_next else None,
+        "prev_cursor": images[0].frame_number if has_prev else None
+    }
+    if include_total:
+        response["total"] = filtered_total(db, project_id, finished, synthetic)
+
+    return response
+
+def filtered_total(db: Session, project_id: UUID, finished: Optional[bool], synthetic: Optional[bool]) -> int:
+    """
+    Total de imágenes para los filtros dados a partir de los contadores del proyecto.
+    Solo la combinación de ambos filtros necesita contar, y lo hace sobre el índice compuesto.
+    """
+    if finished is not None and synthetic is not None:
+        return db.query(models.ImageEntry).filter(
+            models.ImageEntry.project_id == project_id,
+            models.ImageEntry.finished == finished,
+            models.ImageEntry.synthetic == synthetic
+        ).count()
+
+    counters = stats.get(db, project_id)
+    if finished is not None:
+        return counters.finished_images if finished else counters.total_images - counters.finished_images
+    if synthetic is not None:
+        return counters.synthetic_images if synthetic else counters.total_images - counters.synthetic_images
+    return counters.total_images
+
+def resolve_class_id(project: models.Project, class_id: Optional[int], label: Optional[str]) -> int:
+    if label is not None:
+        names = annotations.label_names(project.labels)
+        if label not in names:
+            raise HTTPException(status_code=404, detail="Label not found")
+        return names.index(label)
+    if class_id is None:
+        raise HTTPException(status_code=400, detail="Use either 'class_id' or 'label'")
+    return class_id
+
+@app.get("/project/{project_id}/stats")
+def get_project_stats(project_id: UUID, db: Session = Depends(get_db)):
+    """
+    Contadores del proyecto, que se mantienen en la misma transacción que cada escritura:
+    responder solo lee su fila y una por clase, sin contar imágenes ni cajas.
+    """
+    project = db.query(models.Project).filter(models.Project.id == project_id).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    counters = stats.get(db, project_id)
+    names = annotations.label_names(project.labels)
+    classes = db.query(models.ProjectClassStats).filter(
+        models.ProjectClassStats.project_id == project_id
+    ).order_by(models.ProjectClassStats.class_id).all()
+
+    return {
+        "project_id": str(project_id),
+        "status": project.status,
+        **{name: getattr(counters, name) for name in stats.COUNTERS},
+        "classes": [
+            {
+                "class_id": row.class_id,
+                "label": names[row.class_id] if row.class_id < len(names) else None,
+                "boxes": row.boxes,
+                "frames": row.frames
+            }
+            for row in classes if row.boxes or row.frames
+        ]
+    }
+
+@app.get("/project/{project_id}/annotations/frames")
+def get_frames_by_class(
+    project_id: UUID,
+    class_id: Optional[int] = Query(None, ge=0),
+    label: Optional[str] = Query(None, description="Nombre de la clase, en lugar de 'class_id'"),
+    min_boxes: Optional[int] = Query(None, ge=0, description="Por defecto 1 (frames que contienen la clase)"),
+    max_boxes: Optional[int] = Query(None, ge=0, description="0 para los frames sin ninguna caja de la clase"),
+    after: Optional[int] = Query(None, description="Cursor: devuelve los frames posteriores a este frame_number"),
+    limit: int = Query(50, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    """
+    Frames del proyecto con entre min_boxes y max_boxes cajas de una clase, en orden de frame y
+    paginados con 'after'/'next_cursor'. Recorre ix_project_frame y cuenta las cajas de cada
+    frame sobre el índice de boxes, así que para en cuanto completa la página.
+    """
+    project = db.query(models.Project).filter(models.Project.id == project_id).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    class_id = resolve_class_id(project, class_id, label)
+    if min_boxes is None:
+        min_boxes = 0 if max_boxes is not None else 1
+    if max_boxes is not None and max_boxes < min_boxes:
+        raise HTTPException(status_code=400, detail="'max_boxes' must be greater than or equal to 'min_boxes'")
+
+    images = models.ImageEntry
+    boxes_in_frame = select(func.count(models.Box.id)).where(
+        models.Box.project_id == project_id,
+        models.Box.class_id == class_id,
+        models.Box.image_id == images.id
+    ).scalar_subquery()
+
+    query = db.query(images.id, images.frame_number, boxes_in_frame.label("boxes")).filter(
+        images.project_id == project_id
+    )
+    if min_boxes > 0:
+        query = query.filter(boxes_in_frame >= min_boxes)
+    if max_boxes is not None:
+        query = query.filter(boxes_in_frame <= max_boxes)
+    if after is not None:
+        query = query.filter(images.frame_number > after)
+
+    rows = query.order_by(images.frame_number).limit(limit + 1).all()
+    frames = rows[:limit]
+
+    return {
+        "class_id": class_id,
+        "frames": [
+            {"image_id": image_id, "frame_number": frame_number, "boxes": boxes}
+            for image_id, frame_number, boxes in frames
+        ],
+        "next_cursor": frames[-1].frame_number if len(rows) > limit else None
+    }
 
 @app.put("/update_annotations/{image_id}")
-async def update_annotations(
+def update_annotations(
     image_id: int,
     payload: AnnotationUpdate,
     db: Session = Depends(get_db)
 ):
-    image_entry = db.query(models.ImageEntry).filter(models.ImageEntry.id == image_id).first()
+    image_entry = db.query(models.ImageEntry).filter(models.ImageEntry.id == image_id).with_for_update().first()
     if not image_entry:
         raise HTTPException(status_code=404, detail="Image not found")
 
-    cleaned_annotations = [a.strip() for a in payload.annotations if a.strip() != ""]
-
-    if not cleaned_annotations:
-        image_entry.yolo = None
-    else:
-        image_entry.yolo = "\n".join(cleaned_annotations)
-
-    image_entry.finished = payload.finished
+    # Las clases se validan como en el endpoint por lotes; las cajas del editor que se salen de la
+    # imagen o no tienen área se recortan o descartan en lugar de impedir el guardado.
+    labels = db.query(models.Project.labels).filter(models.Project.id == image_entry.project_id).scalar()
+    [boxes], [error] = annotations.parse_batch([payload.annotations], len(annotations.label_names(labels)), clip=True)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+
+    # El contador de terminados se ajusta con lo que cambia el propio UPDATE, no con el valor
+    # leído antes, para que dos guardados simultáneos del mismo frame no lo cuenten dos veces.
+    changed = db.query(models.ImageEntry).filter(
+        models.ImageEntry.id == image_id,
+        func.coalesce(models.ImageEntry.finished, False) != payload.finished
+    ).update({"finished": payload.finished}, synchronize_session=False)
+    stats.adjust(db, image_entry.project_id, finished_images=changed if payload.finished else -changed)
+
+    image_entry.yolo = annotations.format_yolo(boxes)
+    annotations.replace_boxes(db, image_entry.project_id, {image_entry.id: boxes})
+    image_entry.revision = models.ImageEntry.revision + 1
     db.commit()
+    frame_cache.invalidate_frame(image_entry.project_id, image_entry.frame_number)
 
     return {"message": "Annotations updated successfully"}
 
-@app.post("/synthetic")
-async def upload_synthetic_image(
-    project_id: UUID,
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db)
-):
+def find_images(db: Session, project_id: UUID, column, values: list) -> dict:
+    """
+    (image_id, frame_number) de las imágenes del proyecto cuyo column está en values, por valor.
+    """
+    values = list(set(values))
+    found = {}
+    for start in range(0, len(values), annotations.ID_BATCH_SIZE):
+        for image_id, frame_number, value in db.query(
+            models.ImageEntry.id, models.ImageEntry.frame_number, column
+        ).filter(
+            models.ImageEntry.project_id == project_id,
+            column.in_(values[start:start + annotations.ID_BATCH_SIZE])
+        ):
+            found[value] = (image_id, frame_number)
+    return found
+
+@app.put("/project/{project_id}/annotations")
+def update_annotations_bulk(project_id: UUID, payload: BulkAnnotationUpdate, db: Session = Depends(get_db)):
+    """
+    Guarda las anotaciones de muchos frames (por image_id o frame_number) en una sola transacción:
+    se validan todas a la vez contra el número de clases del proyecto y se escriben con UPDATE
+    por lotes (executemany). Devuelve el resultado de cada entrada, en el mismo orden.
+    """
+    if len(payload.items) > BULK_ANNOTATIONS_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_ANNOTATIONS_MAX_ITEMS} items can be updated at once")
+
     project = db.query(models.Project).filter(models.Project.id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
-    image_count = db.query(models.ImageEntry).filter(models.ImageEntry.project_id == project_id).count()
-    frame_counter = image_count + 1
+    boxes, errors = annotations.parse_batch(
+        [item.annotations for item in payload.items],
+        len(annotations.label_names(project.labels))
+    )
+
+    images = models.ImageEntry
+    by_id = find_images(db, project_id, images.id, [item.image_id for item in payload.items if item.image_id is not None])
+    by_frame = find_images(db, project_id, images.frame_number, [
+        item.frame_number for item in payload.items if item.image_id is None and item.frame_number is not None
+    ])
+
+    results, targets = [], {}
+    for index, item in enumerate(payload.items):
+        if item.image_id is not None:
+            target = by_id.get(item.image_id)
+        elif item.frame_number is not None:
+            target = by_frame.get(item.frame_number)
+        else:
+            results.append({"index": index, "status": "invalid", "detail": "Use either 'image_id' or 'frame_number'"})
+            continue
+
+        if target is None:
+            results.append({"index": index, "status": "not_found", "detail": "Image not found"})
+        elif errors[index]:
+            results.append({"index": index, "image_id": target[0], "frame_number": target[1], "status": "invalid", "detail": errors[index]})
+        elif target[0] in targets:
+            results.append({"index": index, "image_id": target[0], "frame_number": target[1], "status": "invalid", "detail": "Image appears more than once"})
+        else:
+            targets[target[0]] = index
+            results.append({"index": index, "image_id": target[0], "frame_number": target[1], "status": "updated"})
+
+    failed = len(payload.items) - len(targets)
+    if payload.atomic and failed:
+        for result in results:
+            if result["status"] == "updated":
+                result["status"] = "skipped"
+        return {"updated": 0, "failed": failed, "results": results}
+
+    if targets:
+        table = images.__table__
+        # Terminados: el rowcount de cada UPDATE condicional es el cambio del contador.
+        finished_delta = 0
+        for finished in (True, False):
+            rows = [{"b_id": image_id} for image_id, index in targets.items() if payload.items[index].finished == finished]
+            if rows:
+                changed = db.execute(
+                    update(table)
+                    .where(table.c.id == bindparam("b_id"), func.coalesce(table.c.finished, False) != finished)
+                    .values(finished=finished),
+                    rows
+                ).rowcount
+                finished_delta += changed if finished else -changed
+        stats.adjust(db, project_id, finished_images=finished_delta)
+
+        db.execute(
+            update(table)
+            .where(table.c.id == bindparam("b_id"))
+            .values(yolo=bindparam("b_yolo"), revision=table.c.revision + 1),
+            [{"b_id": image_id, "b_yolo": annotations.format_yolo(boxes[index])} for image_id, index in targets.items()]
+        )
+        annotations.replace_boxes(db, project_id, {image_id: boxes[index] for image_id, index in targets.items()})
+        db.commit()
+        frame_cache.invalidate_project(project_id)
 
-    extension = os.path.splitext(file.filename)[1].lower()
-    unique_name = f"frame_{frame_counter:06d}{extension}"
+    return {"updated": len(targets), "failed": failed, "results": results}
 
-    img_bytes = await file.read()
+@app.post("/project/{project_id}/image/{frame_number}/propagate")
+def propagate_annotations(
+    project_id: UUID,
+    frame_number: int,
+    payload: PropagationRequest,
+    db: Session = Depends(get_db)
+):
+    """
+    Propaga las cajas del frame a los payload.frames siguientes siguiéndolas con flujo óptico,
+    sin entrenar ningún modelo. Se guardan como sugerencias sin terminar, como las del
+    autoetiquetado; se detiene en el primer frame terminado o sintético, o cuando se han
+    perdido todas las cajas.
+    """
+    if not 1 <= payload.frames <= PROPAGATION_MAX_FRAMES:
+        raise HTTPException(status_code=400, detail=f"'frames' must be between 1 and {PROPAGATION_MAX_FRAMES}")
+
+    images = db.query(models.ImageEntry).filter(
+        models.ImageEntry.project_id == project_id,
+        models.ImageEntry.frame_number >= frame_number,
+        models.ImageEntry.frame_number <= frame_number + payload.frames
+    ).order_by(models.ImageEntry.frame_number).all()
+    if not images or images[0].frame_number != frame_number:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    source = images[0]
+    boxes = annotations.parse_yolo(source.yolo)
+    if not boxes:
+        raise HTTPException(status_code=400, detail="The frame has no annotations to propagate")
+
+    targets = []
+    for image in images[1:]:
+        if image.frame_number != frame_number + len(targets) + 1 or image.finished or image.synthetic:
+            break
+        targets.append(image)
+
+    started = time.perf_counter()
+    predicted = list(zip(targets, propagation.propagate(source, targets, boxes)))
+    elapsed = time.perf_counter() - started
+
+    updated = set()
+    if predicted:
+        table = models.ImageEntry.__table__
+        # Igual que el autoetiquetado: no se pisan frames editados o terminados mientras tanto, y
+        # las etiquetas dejan de ser de un modelo para que el próximo autoetiquetado las prediga.
+        db.execute(
+            update(table)
+            .where(
+                table.c.id == bindparam("b_id"),
+                table.c.revision == bindparam("b_revision"),
+                func.coalesce(table.c.finished, False) == False
+            )
+            .values(yolo=bindparam("b_yolo"), label_model_version=None),
+            [
+                {"b_id": image.id, "b_revision": image.revision, "b_yolo": annotations.format_yolo(frame_boxes)}
+                for image, frame_boxes in predicted
+            ]
+        )
+        revisions = {image.id: image.revision for image, _ in predicted}
+        updated = {
+            image_id for image_id, revision, finished in db.execute(
+                select(table.c.id, table.c.revision, table.c.finished).where(table.c.id.in_(list(revisions)))
+            )
+            if revision == revisions[image_id] and not finished
+        }
+        annotations.replace_boxes(db, project_id, {
+            image.id: frame_boxes for image, frame_boxes in predicted if image.id in updated
+        })
+        db.commit()
+        for image, _ in predicted:
+            frame_cache.invalidate_frame(project_id, image.frame_number)
+
+    return {
+        "source_frame": frame_number,
+        "frames": [
+            {
+                "image_id": image.id,
+                "frame_number": image.frame_number,
+                "boxes": len(frame_boxes),
+                "yolo": annotations.format_yolo(frame_boxes)
+            }
+            for image, frame_boxes in predicted if image.id in updated
+        ],
+        "skipped": len(predicted) - len(updated),
+        "elapsed_ms": round(elapsed * 1000, 1)
+    }
+
+def store_uploaded_image(img_bytes: bytes, filename: str) -> dict:
+    """
+    Guarda una imagen subida en el almacén de blobs junto con sus versiones reducidas. Decodifica
+    y redimensiona la imagen, así que los endpoints async la ejecutan con offload.
+    """
     try:
         Image.open(io.BytesIO(img_bytes))
+        return ingest.store_image_with_renditions(img_bytes, filename)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid image file")
 
-    db.add(models.ImageEntry(
-        project_id=project.id,
-        image_name=unique_name,
-        image=img_bytes,
+@app.post("/synthetic")
+async def upload_synthetic_image(
+    project_id: UUID,
+    file: UploadFile = File(...)
+):
+    await offload.run_db(require_project, project_id)
+
+    extension = os.path.splitext(file.filename)[1].lower()
+
+    img_bytes = await file.read()
+    image_fields = await offload.run("images", store_uploaded_image, img_bytes, file.filename)
+    image_entry = await offload.run_db(add_synthetic_frame, project_id, image_fields, extension)
+
+    return {"message": "Synthetic image uploaded successfully", "image_name": image_entry.image_name}
+
+def insert_synthetic_frame(db: Session, project_id: UUID, image_fields: dict, extension: str, yolo: str = None) -> models.ImageEntry:
+    """
+    Añade un frame sintético al final del proyecto con un número de frame reservado de forma
+    atómica, dentro de la transacción actual.
+    """
+    frame_number = stats.allocate_frames(db, project_id)
+    boxes = annotations.parse_yolo(yolo)
+    image_entry = models.ImageEntry(
+        project_id=project_id,
+        image_name=f"frame_{frame_number:06d}{extension}",
+        **image_fields,
+        yolo=annotations.format_yolo(boxes),
         synthetic=True,
         finished=False,
-        frame_number=frame_counter
-    ))
+        frame_number=frame_number
+    )
+    db.add(image_entry)
+    db.flush()
+    annotations.replace_boxes(db, project_id, {image_entry.id: boxes})
+    stats.adjust(db, project_id, total_images=1, synthetic_images=1)
+    return image_entry
+
+def add_synthetic_frame(db: Session, project_id: UUID, image_fields: dict, extension: str, yolo: str = None) -> models.ImageEntry:
+    image_entry = insert_synthetic_frame(db, project_id, image_fields, extension, yolo)
     db.commit()
+    frame_cache.invalidate_frame(project_id, image_entry.frame_number)
+    return image_entry
 
-    return {"message": "Synthetic image uploaded successfully", "image_name": unique_name}
+def serialize_draft(draft: models.SyntheticDraft) -> dict:
+    # Ruta relativa: el borrador lo crea el servicio de inpainting por la red interna (api:8000),
+    # que no es la dirección con la que el navegador llega a la API.
+    return {
+        "draft_id": str(draft.id),
+        "project_id": str(draft.project_id),
+        "source_image_id": draft.source_image_id,
+        "status": draft.status,
+        "image_id": draft.image_id,
+        "yolo": draft.yolo,
+        "image_url": app.url_path_for("get_synthetic_draft_raw", draft_id=draft.id)
+    }
+
+def get_draft_or_404(db: Session, draft_id: UUID) -> models.SyntheticDraft:
+    draft = db.query(models.SyntheticDraft).filter(models.SyntheticDraft.id == draft_id).first()
+    if not draft:
+        raise HTTPException(status_code=404, detail="Draft not found")
+    return draft
+
+def get_draft_source_yolo(db: Session, project_id: UUID, source_image_id: Optional[int]) -> Optional[str]:
+    require_project(db, project_id)
+    if source_image_id is None:
+        return None
+
+    source = db.query(models.ImageEntry.yolo).filter(
+        models.ImageEntry.id == source_image_id,
+        models.ImageEntry.project_id == project_id
+    ).first()
+    if not source:
+        raise HTTPException(status_code=404, detail="Source image not found")
+    return source.yolo
+
+def add_synthetic_draft(db: Session, **fields) -> models.SyntheticDraft:
+    draft = models.SyntheticDraft(**fields)
+    db.add(draft)
+    db.commit()
+    return draft
+
+@app.post("/project/{project_id}/synthetic-drafts")
+async def create_synthetic_draft(
+    project_id: UUID,
+    file: UploadFile = File(...),
+    source_image_id: Optional[int] = Form(None)
+):
+    """
+    Lo llama el servicio de inpainting para guardar su resultado sin que pase por el navegador.
+    El borrador hereda las anotaciones del frame de origen; aceptarlo o rechazarlo después solo
+    cambia su estado.
+    """
+    yolo = await offload.run_db(get_draft_source_yolo, project_id, source_image_id)
+
+    img_bytes = await file.read()
+    image_fields = await offload.run("images", store_uploaded_image, img_bytes, file.filename)
+    draft = await offload.run_db(
+        add_synthetic_draft, project_id=project_id, source_image_id=source_image_id, yolo=yolo, **image_fields
+    )
+
+    return serialize_draft(draft)
+
+@app.get("/synthetic-drafts/{draft_id}")
+def get_synthetic_draft(draft_id: UUID, db: Session = Depends(get_db)):
+    return serialize_draft(get_draft_or_404(db, draft_id))
+
+@app.get("/synthetic-drafts/{draft_id}/raw")
+def get_synthetic_draft_raw(
+    draft_id: UUID,
+    request: Request,
+    size: str = Query("original", description="original, thumb o preview"),
+    db: Session = Depends(get_db)
+):
+    return raw_image_response(get_draft_or_404(db, draft_id), request, size)
+
+@app.post("/synthetic-drafts/{draft_id}/accept")
+def accept_synthetic_draft(draft_id: UUID, db: Session = Depends(get_db)):
+    """
+    Convierte el borrador en un frame sintético del proyecto (la imagen ya está en el almacén
+    de blobs). Aceptar dos veces el mismo borrador no crea dos frames.
+    """
+    draft = get_draft_or_404(db, draft_id)
+    if draft.status == "rejected":
+        raise HTTPException(status_code=409, detail="Draft was rejected")
+
+    if draft.status == "pending":
+        extension = blob_store.EXTENSIONS.get(draft.mime_type, ".png")
+        image_fields = {
+            field: getattr(draft, field)
+            for field in ("image_hash", "image_size", "width", "height", "mime_type")
+        }
+        # Se marca antes de crear el frame para que una segunda petición concurrente no lo duplique.
+        claimed = db.query(models.SyntheticDraft).filter(
+            models.SyntheticDraft.id == draft_id,
+            models.SyntheticDraft.status == "pending"
+        ).update({"status": "accepted"})
+        if claimed:
+            # El frame y el image_id del borrador se confirman juntos, así quien pierde la carrera
+            # ya ve el image_id al leer el borrador aceptado.
+            image_entry = insert_synthetic_frame(db, draft.project_id, image_fields, extension, draft.yolo)
+            draft.image_id = image_entry.id
+            db.commit()
+            frame_cache.invalidate_frame(draft.project_id, image_entry.frame_number)
+        db.refresh(draft)
+
+    return serialize_draft(draft)
+
+@app.post("/synthetic-drafts/{draft_id}/reject")
+def reject_synthetic_draft(draft_id: UUID, db: Session = Depends(get_db)):
+    """
+    Descarta el borrador; su imagen la borra después manage.py gc-blobs.
+    """
+    draft = get_draft_or_404(db, draft_id)
+    if draft.status == "accepted":
+        raise HTTPException(status_code=409, detail="Draft was already accepted")
+
+    draft.status = "rejected"
+    db.commit()
+    return serialize_draft(draft)
 
 @app.post("/share_project")
 def share_project(
@@ -396,14 +1021,14 @@ def share_project(
     if not recipient:
         raise HTTPException(status_code=404, detail="Recipient user not found")
 
-    recipient_projects = json.loads(recipient.projects) if recipient.projects else []
-    if str(project_id) not in recipient_projects:
-        recipient_projects.append(str(project_id))
-        recipient.projects = json.dumps(recipient_projects)
+    # La clave primaria (proyecto, usuario) hace que compartir dos veces a la vez solo inserte una fila.
+    db.add(models.ProjectMember(project_id=project_id, user_email=recipient_email, role="editor"))
+    try:
         db.commit()
-        return {"message": f"Project {project_id} shared with {recipient_email}"}
-    else:
+    except IntegrityError:
+        db.rollback()
         return {"message": f"User {recipient_email} already has access to project {project_id}"}
+    return {"message": f"Project {project_id} shared with {recipient_email}"}
 
 @app.get("/project/{project_id}/labels")
 def get_project_labels(project_id: UUID, db: Session = Depends(get_db)):
@@ -429,169 +1054,260 @@ def get_project_labels(project_id: UUID, db: Session = Depends(get_db)):
 def get_image_annotations_by_frame(
     project_id: UUID,
     frame_number: int,
+    request: Request,
+    image_mode: str = Query("inline", description="'inline' para la imagen en base64, 'url' para devolver su URL"),
     db: Session = Depends(get_db)
 ):
-    image = db.query(models.ImageEntry).filter(
-        models.ImageEntry.frame_number == frame_number,
-        models.ImageEntry.project_id == project_id
-    ).first()
+    validate_image_mode(image_mode)
+    image = load_frames(db, project_id, [frame_number]).get(frame_number)
 
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
 
-    project = db.query(models.Project).filter(models.Project.id == project_id).first()
+    project = load_project_metadata(db, project_id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
-    _, ext = os.path.splitext(image.image_name)
-    image_format = ext[1:].lower()
-
     return {
-        "image_id": image.id,
-        "image_name": image.image_name,
-        "yolo": image.yolo,
-        "finished": image.finished,
-        "labels": json.loads(project.labels),
-        "colors": json.loads(project.colors),
-        "image": base64.b64encode(image.image).decode("utf-8"),
-        "format": image_format
+        "image_id": image["image_id"],
+        "image_name": image["image_name"],
+        "yolo": image["yolo"],
+        "finished": image["finished"],
+        "source_timestamp": image["source_timestamp"],
+        "labels": project["labels"],
+        "colors": project["colors"],
+        **image_payload(image["image_id"], image["image_hash"], request, image_mode),
+        "format": image["format"]
     }
 
-@app.get("/project/{project_id}/image_count")
-def get_image_count_by_project(
+@app.get("/project/{project_id}/frames")
+def get_frame_range(
     project_id: UUID,
+    request: Request,
+    from_frame: int = Query(..., alias="from", ge=1),
+    to_frame: int = Query(..., alias="to", ge=1),
+    image_mode: str = Query("inline", description="'inline' para la imagen en base64, 'url' para devolver su URL"),
     db: Session = Depends(get_db)
 ):
-    images = db.query(models.ImageEntry).filter(models.ImageEntry.project_id == project_id)
-    count = images.count()
+    """
+    Devuelve en una sola respuesta NDJSON los frames [from, to] con sus anotaciones: una primera
+    línea con las etiquetas y colores del proyecto y después una línea por frame.
+    """
+    validate_image_mode(image_mode)
+    if to_frame < from_frame:
+        raise HTTPException(status_code=400, detail="'to' must be greater than or equal to 'from'")
+    if to_frame - from_frame + 1 > FRAME_RANGE_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {FRAME_RANGE_MAX} frames can be requested at once")
 
-    first_image = images.order_by(models.ImageEntry.id.asc()).first()
-    first_image_id = first_image.id if first_image else None
+    project = load_project_metadata(db, project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
 
-    return {
-        "project_id": str(project_id),
-        "total_images": count,
-        "first_image_id": first_image_id
-    }
+    frames = load_frames(db, project_id, list(range(from_frame, to_frame + 1)))
+
+    def generate():
+        yield json.dumps({"type": "project", **project}) + "\n"
+        for frame_number in sorted(frames):
+            image = frames[frame_number]
+            yield json.dumps({
+                "type": "frame",
+                "image_id": image["image_id"],
+                "image_name": image["image_name"],
+                "frame_number": frame_number,
+                "yolo": image["yolo"],
+                "finished": image["finished"],
+                "source_timestamp": image["source_timestamp"],
+                "format": image["format"],
+                **image_payload(image["image_id"], image["image_hash"], request, image_mode)
+            }) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    """
+    Aciertos, fallos y ocupación de las cachés de proyectos, frames e imágenes.
+    """
+    return frame_cache.stats()
 
-@app.post("/project/{project_id}/generate-dataset")
-def generate_dataset(project_id: UUID, db: Session = Depends(get_db)):
-    temp_dir = tempfile.mkdtemp()
+@app.get("/project/{project_id}/image/{frame_number}/raw")
+def get_raw_image_by_frame(
+    project_id: UUID,
+    frame_number: int,
+    request: Request,
+    size: str = Query("original", description="original, thumb o preview"),
+    db: Session = Depends(get_db)
+):
+    """
+    Devuelve los bytes de la imagen de un frame con su tipo de contenido, sin codificar en JSON.
+    """
+    image = db.query(models.ImageEntry).filter(
+        models.ImageEntry.frame_number == frame_number,
+        models.ImageEntry.project_id == project_id
+    ).first()
 
-    try:
-        project = db.query(models.Project).filter(models.Project.id == project_id).first()
-        if not project:
-            raise HTTPException(status_code=404, detail="Project not found")
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
 
-        images_dir = os.path.join(temp_dir, 'images')
-        labels_dir = os.path.join(temp_dir, 'labels')
-        for split in ['train', 'val', 'predict']:
-            os.makedirs(os.path.join(images_dir, split), exist_ok=True)
-            os.makedirs(os.path.join(labels_dir, split), exist_ok=True)
+    return raw_image_response(image, request, size)
 
-        images_finished = db.query(models.ImageEntry).filter(
-            models.ImageEntry.project_id == project_id,
-            models.ImageEntry.finished == True
-        ).all()
+@app.get("/image/{image_id}/raw")
+def get_raw_image(
+    image_id: int,
+    request: Request,
+    size: str = Query("original", description="original, thumb o preview"),
+    db: Session = Depends(get_db)
+):
+    """
+    Devuelve los bytes de una imagen dado su ID.
+    """
+    image = db.query(models.ImageEntry).filter(models.ImageEntry.id == image_id).first()
 
-        if len(images_finished) < 5:
-            raise HTTPException(status_code=400, detail=f"Not enough finished images, just ({len(images_finished)} provided)")
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
 
-        images_unfinished = db.query(models.ImageEntry).filter(
-            models.ImageEntry.project_id == project_id,
-            models.ImageEntry.finished == False
-        ).all()
+    return raw_image_response(image, request, size)
 
-        train_imgs, val_imgs = train_test_split(images_finished, test_size=0.15, random_state=42)
-
-        def save_images_and_labels(entries, split):
-            for entry in entries:
-                image_filename = entry.image_name
-                image_extension = os.path.splitext(image_filename)[1]
-                image_output_path = os.path.join(images_dir, split, image_filename)
-                with open(image_output_path, 'wb') as img_file:
-                    img_file.write(entry.image)
-
-                if split in ['train', 'val'] and entry.yolo:
-                    labels = entry.yolo
-                    label_filename = image_filename.replace(image_extension, '.txt')
-                    label_output_path = os.path.join(labels_dir, split, label_filename)
-
-                    with open(label_output_path, 'w') as label_file:
-                        label_file.write(f"{labels}\n")
-                        print(f"Guardando etiqueta: {labels} en {label_output_path}")
-                        print(f"Label file saved: {label_file}")
-
-        labels_list = json.loads(project.labels)
-        real_labels = json.loads(labels_list[0])
-
-        save_images_and_labels(train_imgs, 'train')
-        save_images_and_labels(val_imgs, 'val')
-        save_images_and_labels(images_unfinished, 'predict')
-
-        data_yaml = {
-            'path': './',
-            'train': 'images/train',
-            'predict': 'images/predict',
-            'val': 'images/val',
-            'nc': len(real_labels),
-            'names': real_labels
-        }
+@app.get("/project/{project_id}/image_count")
+def get_image_count_by_project(
+    project_id: UUID,
+    db: Session = Depends(get_db)
+):
+    if not db.query(models.Project.id).filter(models.Project.id == project_id).first():
+        return {"project_id": str(project_id), "total_images": 0, "first_image_id": None}
 
-        with open(os.path.join(temp_dir, 'data.yaml'), 'w') as f:
-            yaml.dump(data_yaml, f, sort_keys=False)
-
-        zip_buffer = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
-        with zipfile.ZipFile(zip_buffer.name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for foldername, _, filenames in os.walk(temp_dir):
-                for filename in filenames:
-                    filepath = os.path.join(foldername, filename)
-                    arcname = os.path.relpath(filepath, temp_dir)
-                    zipf.write(filepath, arcname)
-
-        with open(zip_buffer.name, 'rb') as f:
-            files = {'dataset': f}
-            data = {
-                'model': 'yolo12m.pt',
-                'epochs': '40',
-                'imgsz': '640',
-                'batch': '8',
-                'lr': '0.001'
-            }
-            response = requests.post('http://yolo:5001/fsod-train', files=files, data=data)
-            fsod_response = response.json()
+    # El total sale de los contadores y el primer frame, de ix_project_frame: nada recorre las imágenes.
+    first_image_id = db.query(models.ImageEntry.id).filter(
+        models.ImageEntry.project_id == project_id
+    ).order_by(models.ImageEntry.frame_number).limit(1).scalar()
 
-            saved_labels_info = []
+    return {
+        "project_id": str(project_id),
+        "total_images": stats.get(db, project_id).total_images,
+        "first_image_id": first_image_id
+    }
 
-            if "predictions" in fsod_response:
-                for prediction in fsod_response["predictions"]:
-                    image_name = prediction["image"]
-                    labels = prediction["labels"]
+@app.post("/project/{project_id}/generate-dataset", status_code=202)
+def generate_dataset(
+    project_id: UUID,
+    idempotency_key: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Encola el entrenamiento y autoetiquetado del proyecto y devuelve el trabajo creado.
+    Solo puede haber uno activo por proyecto; si se repite la petición con la misma
+    cabecera Idempotency-Key se devuelve el mismo trabajo.
+    """
+    project = db.query(models.Project).filter(models.Project.id == project_id).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
 
-                    label_lines = []
-                    for label in labels:
-                        label_line = " ".join(str(x) for x in label)
-                        label_lines.append(label_line)
+    if idempotency_key:
+        existing = find_job_by_key(db, project_id, idempotency_key)
+        if existing:
+            return jobs.serialize(existing)
 
-                    yolo_text = "\n".join(label_lines)
+    finished_count = auto_label.count_finished(db, project_id)
+    if finished_count < auto_label.MIN_FINISHED_IMAGES:
+        raise HTTPException(status_code=400, detail=f"Not enough finished images, just ({finished_count} provided)")
+
+    job = models.Job(project_id=project_id, kind="generate-dataset", idempotency_key=idempotency_key)
+    db.add(job)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        if idempotency_key:
+            existing = find_job_by_key(db, project_id, idempotency_key)
+            if existing:
+                return jobs.serialize(existing)
+        active = db.query(models.Job).filter(
+            models.Job.project_id == project_id,
+            models.Job.kind == "generate-dataset",
+            models.Job.status.in_(jobs.ACTIVE_STATUSES)
+        ).first()
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "A dataset generation is already active for this project", "job_id": str(active.id) if active else None}
+        )
+
+    jobs.notify()
+    return jobs.serialize(job)
+
+def find_job_by_key(db: Session, project_id: UUID, idempotency_key: str) -> Optional[models.Job]:
+    return db.query(models.Job).filter(
+        models.Job.project_id == project_id,
+        models.Job.idempotency_key == idempotency_key
+    ).first()
 
-                    image_entry = db.query(models.ImageEntry).filter(
-                        models.ImageEntry.project_id == project_id,
-                        models.ImageEntry.image_name == image_name
-                    ).first()
+@app.put("/jobs/{job_id}/progress")
+def update_job_progress(job_id: UUID, payload: JobProgress, db: Session = Depends(get_db)):
+    """
+    Lo llama el servicio YoloFSOD durante el entrenamiento. La respuesta le indica si debe parar.
+    """
+    job = db.query(models.Job).filter(models.Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
 
-                    if image_entry:
-                        image_entry.yolo = yolo_text
+    for field, value in payload.model_dump(exclude_none=True).items():
+        setattr(job, field, value)
+    db.commit()
 
-                db.commit()
+    return {"cancel_requested": job.cancel_requested}
 
-            return "Dataset labeled successfully"
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: UUID, db: Session = Depends(get_db)):
+    """
+    Cancela un trabajo: si aún está en cola no llega a ejecutarse, y si está en marcha se
+    detiene en el siguiente punto de control (fin de época, antes de guardar resultados o, en una
+    subida, antes del siguiente bloque de frames).
+    """
+    job = db.query(models.Job).filter(models.Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if job.status in jobs.FINISHED_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Job already {job.status}")
+
+    cancelled = db.query(models.Job).filter(
+        models.Job.id == job_id,
+        models.Job.status == "queued"
+    ).update({"status": "cancelled", "finished_at": datetime.utcnow()}, synchronize_session=False)
+    if not cancelled:
+        job.cancel_requested = True
+    db.commit()
+    db.refresh(job)
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return jobs.serialize(job)
 
-    finally:
-        shutil.rmtree(temp_dir, ignore_errors=True)
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: UUID):
+    """
+    Server-Sent Events con el estado del trabajo cada vez que cambia, hasta que termina.
+    """
+    def load():
+        db = SessionLocal()
+        try:
+            job = db.query(models.Job).filter(models.Job.id == job_id).first()
+            return jobs.serialize(job) if job else None
+        finally:
+            db.close()
+
+    if await run_in_threadpool(load) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def stream():
+        last = None
+        while True:
+            state = await run_in_threadpool(load)
+            if state != last:
+                yield f"event: progress\ndata: {json.dumps(state)}\n\n"
+                last = state
+            if state is None or state["status"] in jobs.FINISHED_STATUSES:
+                break
+            await asyncio.sleep(JOB_EVENTS_INTERVAL)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @app.get("/download/{project_id}")
 def download_project_data(
@@ -603,44 +1319,19 @@ def download_project_data(
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
-    images = db.query(models.ImageEntry).filter(models.ImageEntry.project_id == project_id).all()
-    if not images:
+    has_images = db.query(
+        db.query(models.ImageEntry).filter(models.ImageEntry.project_id == project_id).exists()
+    ).scalar()
+    if not has_images:
         raise HTTPException(status_code=404, detail="No images found for this project")
 
     try:
-        labels_list = json.loads(project.labels)
-        real_labels = json.loads(labels_list[0])
+        real_labels = annotations.label_names(project.labels)
     except (json.JSONDecodeError, IndexError, TypeError):
         raise HTTPException(status_code=500, detail="Invalid labels format in project")
 
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-        for image_entry in images:
-            base_filename = os.path.splitext(image_entry.image_name)[0]
-
-            annotation_filename = f"labels/{base_filename}.txt"
-            yolo_data = image_entry.yolo or ""
-            zip_file.writestr(annotation_filename, yolo_data)
-
-            if include_images:
-                image_filename = f"images/{image_entry.image_name}"
-                zip_file.writestr(image_filename, image_entry.image)
-
-        yaml_content = "#*Edit the paths with your own and delete this line*#\n"
-        yaml_content += "path: ./\n\n"
-        yaml_content += "train: images/?\n"
-        yaml_content += "test: images/?\n"
-        yaml_content += "val: images/?\n\n"
-        yaml_content += f"nc: {len(real_labels)}\n\n"
-        yaml_content += "names:\n"
-        for label in real_labels:
-            yaml_content += f"- {label}\n"
-
-        zip_file.writestr("data.yaml", yaml_content)
-
-    zip_buffer.seek(0)
     return StreamingResponse(
-        zip_buffer,
+        export.stream_project_zip(project_id, real_labels, include_images),
         media_type="application/x-zip-compressed",
         headers={"Content-Disposition": f"attachment; filename=project_{project_id}.zip"}
     )
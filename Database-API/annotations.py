@@ -0,0 +1,180 @@
+import json
+from collections import defaultdict, Counter
+import numpy as np
+from sqlalchemy import delete, insert
+import models
+import stats
+
+# Tamaño de los lotes de ids en los DELETE ... IN (...), por debajo del límite de parámetros de SQLite.
+ID_BATCH_SIZE = 500
+
+
+def parse_yolo(text: str) -> list:
+    """
+    Cajas (class_id, x_center, y_center, width, height) de un texto en formato YOLO. Las líneas que
+    no son una caja se descartan; para validar lo que envía un cliente está parse_batch.
+    """
+    boxes = []
+    for line in (text or "").splitlines():
+        values = line.split()
+        if not values:
+            continue
+        try:
+            if len(values) != 5:
+                raise ValueError()
+            class_id = int(values[0])
+            coords = [float(value) for value in values[1:]]
+            if class_id < 0:
+                raise ValueError()
+        except ValueError:
+            continue
+        boxes.append((class_id, *coords))
+    return boxes
+
+
+def _to_floats(values: list) -> list:
+    floats = []
+    for value in values:
+        try:
+            floats.append(float(value))
+        except ValueError:
+            floats.append(float("nan"))
+    return floats
+
+
+def _clip(coords: np.ndarray) -> tuple:
+    """
+    Recorta las cajas (x_center, y_center, width, height) a la imagen y devuelve (cajas, máscara
+    de las que conservan área).
+    """
+    centers, sizes = coords[:, :2], np.abs(coords[:, 2:])
+    low = np.clip(centers - sizes / 2, 0, 1)
+    high = np.clip(centers + sizes / 2, 0, 1)
+    clipped = np.hstack([(low + high) / 2, high - low])
+    return clipped, (clipped[:, 2:] > 0).all(axis=1)
+
+
+def parse_batch(frames: list, class_count: int, clip: bool = False) -> tuple:
+    """
+    Valida de una vez las anotaciones de muchos frames (una lista de líneas YOLO por frame). Solo
+    el troceado de las líneas se hace en Python; la conversión y las comprobaciones de clase y
+    coordenadas van vectorizadas sobre una única matriz. Devuelve (cajas, error) por frame: un
+    frame con alguna línea inválida no tiene cajas y sí un mensaje con la primera de ellas.
+    Con clip las coordenadas no se rechazan: las cajas se recortan a [0, 1] y se descartan las
+    que quedan sin área, como las que deja el editor al salirse de la imagen o con dos clics.
+    """
+    errors = [None] * len(frames)
+    owners, tokens = [], []
+    for index, lines in enumerate(frames):
+        for line in lines:
+            values = line.split()
+            if not values:
+                continue
+            if len(values) != 5:
+                errors[index] = errors[index] or f"Invalid annotation line: '{line.strip()}'"
+                continue
+            owners.append(index)
+            tokens.append(values)
+
+    boxes = [[] for _ in frames]
+    if not tokens:
+        return boxes, errors
+
+    try:
+        values = np.array(tokens, dtype=np.float64)
+    except ValueError:
+        values = np.array([_to_floats(line) for line in tokens], dtype=np.float64)
+    classes, coords = values[:, 0], values[:, 1:]
+
+    malformed = ~np.isfinite(values).all(axis=1) | (classes != np.floor(classes))
+    out_of_range = ~malformed & ((classes < 0) | (classes >= class_count))
+    if clip:
+        coords, kept = _clip(coords)
+        bad_coords = np.zeros(len(tokens), dtype=bool)
+    else:
+        kept = np.ones(len(tokens), dtype=bool)
+        bad_coords = ~malformed & ((coords < 0).any(axis=1) | (coords > 1).any(axis=1) | (coords[:, 2:] <= 0).any(axis=1))
+    for row in np.flatnonzero(malformed | out_of_range | bad_coords):
+        index = owners[row]
+        if errors[index] is None:
+            line = " ".join(tokens[row])
+            if malformed[row]:
+                errors[index] = f"Invalid annotation line: '{line}'"
+            elif out_of_range[row]:
+                errors[index] = f"Class {int(classes[row])} out of range, the project has {class_count} classes: '{line}'"
+            else:
+                errors[index] = f"Coordinates must be normalized to [0, 1]: '{line}'"
+
+    class_ids = np.where(malformed, -1, classes).astype(np.int64).tolist()
+    for index, class_id, (x, y, w, h), keep in zip(owners, class_ids, coords.tolist(), kept.tolist()):
+        if errors[index] is None and keep:
+            boxes[index].append((class_id, x, y, w, h))
+    return boxes, errors
+
+
+def format_yolo(boxes: list):
+    """
+    Texto YOLO de las cajas, con 6 decimales como el que envía el editor; None si no hay cajas.
+    """
+    return "\n".join(
+        f"{class_id} {x:.6f} {y:.6f} {w:.6f} {h:.6f}" for class_id, x, y, w, h in boxes
+    ) or None
+
+
+def replace_boxes(db, project_id, boxes_by_image: dict) -> None:
+    """
+    Sustituye en la transacción actual las cajas de cada imagen (image_id -> cajas) y ajusta con
+    la diferencia los frames etiquetados y los contadores por clase del proyecto. Quien la llama
+    guarda también format_yolo(cajas) en images.yolo para que ambas coincidan.
+    """
+    image_ids = list(boxes_by_image)
+    # Las cajas anteriores son las que borra el propio DELETE (RETURNING), no una lectura previa
+    # que una edición concurrente del mismo frame podría dejar desfasada.
+    old_counts = defaultdict(Counter)
+    for start in range(0, len(image_ids), ID_BATCH_SIZE):
+        for image_id, class_id in db.execute(
+            delete(models.Box)
+            .where(models.Box.image_id.in_(image_ids[start:start + ID_BATCH_SIZE]))
+            .returning(models.Box.image_id, models.Box.class_id)
+            .execution_options(synchronize_session=False)
+        ):
+            old_counts[image_id][class_id] += 1
+
+    labeled_delta = 0
+    class_deltas = defaultdict(lambda: [0, 0])
+    for image_id, boxes in boxes_by_image.items():
+        old = old_counts[image_id]
+        new = Counter(box[0] for box in boxes)
+        labeled_delta += bool(new) - bool(old)
+        for class_id in old.keys() | new.keys():
+            class_deltas[class_id][0] += new[class_id] - old[class_id]
+            class_deltas[class_id][1] += bool(new[class_id]) - bool(old[class_id])
+    stats.adjust(db, project_id, labeled_images=labeled_delta)
+    stats.adjust_classes(db, project_id, class_deltas)
+
+    rows = [
+        {
+            "image_id": image_id,
+            "project_id": project_id,
+            "class_id": class_id,
+            "x_center": x,
+            "y_center": y,
+            "width": w,
+            "height": h
+        }
+        for image_id, boxes in boxes_by_image.items()
+        for class_id, x, y, w, h in boxes
+    ]
+    if rows:
+        db.execute(insert(models.Box), rows)
+
+
+def label_names(labels: str) -> list:
+    """
+    Nombres de las clases de Project.labels. El formulario de subida manda la lista ya en JSON
+    dentro de otra lista (['["a", "b"]']), así que se deshace esa doble codificación si la hay.
+    """
+    names = json.loads(labels)
+    if len(names) == 1 and isinstance(names[0], str) and names[0].startswith("["):
+        names = json.loads(names[0])
+    return names
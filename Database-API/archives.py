@@ -0,0 +1,109 @@
+import io
+import os
+import tarfile
+import time
+import zipfile
+
+CHUNK_SIZE = 1024 * 1024
+FLUSH_SIZE = 64 * 1024
+
+
+class _ChunkBuffer:
+    """
+    Destino no "seekable" para ZipFile/TarFile: guarda lo escrito hasta que el generador lo
+    recoge. Al no poder volver atrás, zipfile escribe los tamaños en descriptores de datos.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+def _zip_info(arcname: str, compress_type: int, file_size: int = None) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+    info.compress_type = compress_type
+    info.external_attr = 0o644 << 16
+    if file_size is not None:
+        info.file_size = file_size
+    return info
+
+
+def file_entry(arcname: str, path: str):
+    """
+    Miembro leído de disco por bloques; en ZIP se guarda sin comprimir (ZIP_STORED) porque
+    son imágenes JPEG/PNG, que ya están comprimidas.
+    """
+    return ("file", arcname, path)
+
+
+def text_entry(arcname: str, content: str):
+    """
+    Miembro de texto (etiquetas YOLO, data.yaml); en ZIP se comprime con DEFLATE.
+    """
+    return ("text", arcname, content)
+
+
+def stream_zip(entries):
+    """
+    Genera un ZIP a partir de un iterable de entradas (file_entry/text_entry), devolviendo
+    cada bloque en cuanto está listo. La memoria usada no depende del tamaño del archivo
+    y se usa ZIP64 cuando hace falta (miembros o archivo de más de 4 GiB, más de 65535 entradas).
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, "w", allowZip64=True) as zip_file:
+        for kind, arcname, source in entries:
+            if kind == "file":
+                file_size = os.path.getsize(source)
+                info = _zip_info(arcname, zipfile.ZIP_STORED, file_size)
+                with open(source, "rb") as src, zip_file.open(info, "w", force_zip64=file_size >= zipfile.ZIP64_LIMIT) as dst:
+                    while chunk := src.read(CHUNK_SIZE):
+                        dst.write(chunk)
+                        if buffer.size >= CHUNK_SIZE:
+                            yield buffer.drain()
+            else:
+                zip_file.writestr(_zip_info(arcname, zipfile.ZIP_DEFLATED), source)
+
+            if buffer.size >= FLUSH_SIZE:
+                yield buffer.drain()
+
+    yield buffer.drain()
+
+
+def stream_tar(entries):
+    """
+    Igual que stream_zip pero genera un TAR sin comprimir, que a diferencia del ZIP se puede
+    ir extrayendo según llega (no depende de un directorio central al final).
+    """
+    buffer = _ChunkBuffer()
+    with tarfile.open(fileobj=buffer, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+        for kind, arcname, source in entries:
+            info = tarfile.TarInfo(arcname)
+            info.mtime = int(time.time())
+            info.mode = 0o644
+            if kind == "file":
+                info.size = os.path.getsize(source)
+                with open(source, "rb") as src:
+                    tar.addfile(info, src)
+            else:
+                data = source.encode()
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+            if buffer.size >= FLUSH_SIZE:
+                yield buffer.drain()
+
+    yield buffer.drain()
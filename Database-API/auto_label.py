@@ -0,0 +1,205 @@
+import os
+import json
+import hashlib
+import requests
+from sqlalchemy import update, select, bindparam, or_
+from sklearn.model_selection import train_test_split
+import models
+import annotations
+import frame_cache
+import jobs
+import export
+import dataset_package
+
+YOLO_URL = os.getenv("YOLO_URL", "http://yolo:5001")
+API_CALLBACK_URL = os.getenv("API_CALLBACK_URL", "http://api:8000")
+FSOD_CONNECT_TIMEOUT = float(os.getenv("FSOD_CONNECT_TIMEOUT", 10))
+FSOD_READ_TIMEOUT = float(os.getenv("FSOD_READ_TIMEOUT", 6 * 3600))
+MIN_FINISHED_IMAGES = 5
+
+DATASET_COLUMNS = (
+    models.ImageEntry.id,
+    models.ImageEntry.image_name,
+    models.ImageEntry.frame_number,
+    models.ImageEntry.yolo,
+    models.ImageEntry.image_hash
+)
+
+TRAINING_PARAMS = {
+    'model': 'yolo12m.pt',
+    'epochs': '40',
+    'imgsz': '640',
+    'batch': '8',
+    'lr': '0.001'
+}
+
+
+def model_version(images_finished, labels) -> str:
+    """
+    Identifica el modelo que sale de entrenar con estos frames: huella de las imágenes y
+    anotaciones terminadas, las clases y el modelo base. YoloFSOD la usa como clave de su
+    registro de modelos.
+    """
+    digest = hashlib.sha256(json.dumps([labels, TRAINING_PARAMS['model'], TRAINING_PARAMS['imgsz']]).encode())
+    for row in images_finished:
+        digest.update(f"{row.image_hash}:{row.yolo or ''}\n".encode())
+    return digest.hexdigest()
+
+
+def pending_filters(version: str) -> tuple:
+    """
+    Frames a predecir: los no terminados que no tienen etiquetas de esta versión del modelo.
+    """
+    return (
+        models.ImageEntry.finished == False,
+        or_(models.ImageEntry.label_model_version.is_(None), models.ImageEntry.label_model_version != version)
+    )
+
+
+def count_finished(db, project_id) -> int:
+    return db.query(models.ImageEntry).filter(
+        models.ImageEntry.project_id == project_id,
+        models.ImageEntry.finished == True
+    ).count()
+
+
+@jobs.handler("generate-dataset")
+def generate_dataset(db, job: models.Job) -> None:
+    """
+    Envía el dataset del proyecto al servicio YoloFSOD, que entrena y predice los frames sin
+    terminar, y guarda esas predicciones. El dataset no pasa por disco: se envía como un TAR
+    generado al vuelo o, en modo volumen compartido, como un manifiesto con los hashes de los
+    blobs. El servicio informa del progreso (épocas y frames predichos) llamando a
+    PUT /jobs/{job_id}/progress.
+    Solo se predicen los frames sin etiquetas o etiquetados por otra versión del modelo, y las
+    predicciones se guardan en un único UPDATE que salta los frames editados mientras tanto.
+    """
+    # Solo se usan los ids: la sesión se cierra antes de llamar a YoloFSOD y job queda desasociado.
+    job_id, project_id = job.id, job.project_id
+
+    project = db.query(models.Project).filter(models.Project.id == project_id).first()
+    if not project:
+        raise ValueError("Project not found")
+
+    images_finished = db.query(*DATASET_COLUMNS).filter(
+        models.ImageEntry.project_id == project_id,
+        models.ImageEntry.finished == True
+    ).order_by(models.ImageEntry.frame_number).all()
+
+    if len(images_finished) < MIN_FINISHED_IMAGES:
+        raise ValueError(f"Not enough finished images, just ({len(images_finished)} provided)")
+
+    train_imgs, val_imgs = train_test_split(images_finished, test_size=0.15, random_state=42)
+
+    real_labels = annotations.label_names(project.labels)
+
+    version = model_version(images_finished, real_labels)
+
+    job.epoch = 0
+    job.epochs = int(TRAINING_PARAMS['epochs'])
+    job.predicted_frames = 0
+    job.frames_to_predict = frames_to_predict = db.query(models.ImageEntry).filter(
+        models.ImageEntry.project_id == project_id,
+        *pending_filters(version)
+    ).count()
+    if frames_to_predict == 0:
+        job.epochs = 0
+        job.message = "All frames are already labeled by the current model"
+    db.commit()
+    if frames_to_predict == 0:
+        return
+
+    # El entrenamiento puede durar horas: no se mantiene ninguna transacción abierta (en
+    # PostgreSQL quedaría "idle in transaction") ni una conexión del pool mientras tanto. Tras
+    # close() la sesión se puede seguir usando y pide una conexión nueva.
+    db.close()
+    jobs.check_cancelled(job_id)
+
+    # Id y revisión de cada frame enviado, para aplicar las predicciones sin buscarlos otra vez.
+    sent = {}
+
+    def track(rows):
+        for row in rows:
+            sent[row.image_name] = (row.id, row.revision)
+            yield row
+
+    splits = {
+        'train': train_imgs,
+        'val': val_imgs,
+        'predict': track(export.iter_images(project_id, *pending_filters(version)))
+    }
+    params = {
+        **TRAINING_PARAMS,
+        'job_id': str(job_id),
+        'project_id': str(project_id),
+        'model_version': version,
+        'callback_url': f"{API_CALLBACK_URL}/jobs/{job_id}/progress"
+    }
+
+    if dataset_package.FSOD_HANDOFF == "shared-volume":
+        request_options = {"json": dataset_package.manifest(splits, real_labels)}
+    else:
+        request_options = {
+            "data": dataset_package.stream_dataset(splits, real_labels),
+            "headers": {"Content-Type": "application/x-tar"}
+        }
+
+    response = requests.post(
+        f'{YOLO_URL}/fsod-train',
+        params=params,
+        timeout=(FSOD_CONNECT_TIMEOUT, FSOD_READ_TIMEOUT),
+        **request_options
+    )
+    fsod_response = response.json()
+
+    if fsod_response.get("status") == "cancelled":
+        raise jobs.JobCancelled()
+    if response.status_code != 200 or fsod_response.get("status") == "error":
+        raise RuntimeError(fsod_response.get("message") or fsod_response.get("error") or "Training failed")
+
+    jobs.check_cancelled(job_id)
+
+    predicted_boxes = {
+        sent[prediction["image"]]: [
+            (int(label[0]), *(float(value) for value in label[1:5])) for label in prediction["labels"]
+        ]
+        for prediction in fsod_response.get("predictions", [])
+        if prediction["image"] in sent
+    }
+    updates = [
+        {"b_id": image_id, "b_revision": revision, "b_yolo": annotations.format_yolo(boxes)}
+        for (image_id, revision), boxes in predicted_boxes.items()
+    ]
+
+    labeled = 0
+    if updates:
+        table = models.ImageEntry.__table__
+        result = db.execute(
+            update(table)
+            .where(table.c.id == bindparam("b_id"), table.c.revision == bindparam("b_revision"))
+            .values(yolo=bindparam("b_yolo"), label_model_version=version),
+            updates
+        )
+        labeled = result.rowcount
+
+        # Las filas que conservan la revisión enviada son las que ha actualizado el UPDATE (las
+        # bloquea hasta el commit); solo a esas se les sustituyen las cajas.
+        updated = set()
+        ids = [image_id for image_id, _ in predicted_boxes]
+        for start in range(0, len(ids), annotations.ID_BATCH_SIZE):
+            updated.update(tuple(row) for row in db.execute(
+                select(models.ImageEntry.id, models.ImageEntry.revision)
+                .where(models.ImageEntry.id.in_(ids[start:start + annotations.ID_BATCH_SIZE]))
+            ))
+        annotations.replace_boxes(db, project_id, {
+            image_id: boxes for (image_id, revision), boxes in predicted_boxes.items()
+            if (image_id, revision) in updated
+        })
+
+    training = fsod_response.get("model", {}).get("training")
+    job = db.query(models.Job).filter(models.Job.id == job_id).first()
+    job.message = f"Dataset labeled successfully ({labeled} frames)" + (f", training: {training}" if training else "")
+    if labeled < len(updates):
+        job.message += f", {len(updates) - labeled} edited meanwhile and left untouched"
+    db.commit()
+    frame_cache.invalidate_project(project_id)
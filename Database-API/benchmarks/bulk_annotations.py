@@ -0,0 +1,78 @@
+"""
+Guardar las anotaciones de 10000 frames con PUT /update_annotations/{image_id} (una petición y
+una transacción por frame) frente a PUT /project/{id}/annotations en lotes. La API se arranca
+con uvicorn y cada modo escribe en su propio proyecto las mismas anotaciones aleatorias.
+
+    python benchmarks/bulk_annotations.py [--frames 10000] [--batch-sizes 10000 1000 100]
+"""
+import argparse
+import random
+import time
+
+import common
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-frame vs bulk annotation updates")
+    parser.add_argument("--frames", type=int, default=10_000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[10_000, 1_000, 100])
+    parser.add_argument("--skip-single", action="store_true", help="Only measure the bulk endpoint")
+    args = parser.parse_args()
+
+    work_dir = common.prepare_environment()
+    common.create_schema()
+    import requests
+    from database import SessionLocal
+    import models
+
+    rng = random.Random(22)
+    items = [
+        {
+            "frame_number": frame_number,
+            "annotations": [
+                f"{rng.randrange(2)} {rng.random():.6f} {rng.random():.6f} 0.100000 0.100000"
+                for _ in range(rng.randrange(4))
+            ],
+            "finished": rng.random() < 0.5
+        }
+        for frame_number in range(1, args.frames + 1)
+    ]
+    expected = {
+        "finished_images": sum(item["finished"] for item in items),
+        "labeled_images": sum(bool(item["annotations"]) for item in items)
+    }
+
+    modes = ([] if args.skip_single else ["single"]) + [str(size) for size in args.batch_sizes]
+    projects = {mode: common.seed_project(args.frames) for mode in modes}
+    db = SessionLocal()
+    image_ids = dict(db.query(models.ImageEntry.frame_number, models.ImageEntry.id).filter(
+        models.ImageEntry.project_id == projects.get("single")
+    ))
+    db.close()
+
+    with common.serve(work_dir) as base_url:
+        session = requests.Session()
+        for mode in modes:
+            project_id = projects[mode]
+            started = time.perf_counter()
+            if mode == "single":
+                for item in items:
+                    response = session.put(f"{base_url}/update_annotations/{image_ids[item['frame_number']]}", json={
+                        "annotations": item["annotations"], "finished": item["finished"]
+                    })
+                    assert response.status_code == 200, response.text
+            else:
+                size = int(mode)
+                for start in range(0, len(items), size):
+                    response = session.put(f"{base_url}/project/{project_id}/annotations", json={"items": items[start:start + size]})
+                    assert response.status_code == 200 and response.json()["failed"] == 0, response.text[:300]
+            elapsed = time.perf_counter() - started
+
+            served = session.get(f"{base_url}/project/{project_id}/stats").json()
+            assert {name: served[name] for name in expected} == expected, served
+            label = "per-frame" if mode == "single" else f"bulk, {mode}/request"
+            print(f"{label:22s} {elapsed:7.2f} s {args.frames / elapsed:8.0f} frames/s")
+
+
+if __name__ == "__main__":
+    main()
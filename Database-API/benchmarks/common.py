@@ -0,0 +1,140 @@
+"""
+Utilidades compartidas por los benchmarks. Cada benchmark trabaja en un directorio temporal
+propio (base de datos, blobs y ZIP temporales), así se puede repetir sin tocar data/.
+"""
+import contextlib
+import importlib.util
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def prepare_environment(database_url: str = None) -> str:
+    """
+    Crea el directorio de trabajo y apunta la API a él. Hay que llamarla antes de importar
+    database, blob_store o ingest, que leen el entorno al importarse.
+    """
+    work_dir = tempfile.mkdtemp(prefix="pfg-bench-")
+    os.environ["DATABASE_URL"] = database_url or f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    os.environ["BLOB_STORE_PATH"] = os.path.join(work_dir, "blobs")
+    os.environ["INGEST_TEMP_PATH"] = os.path.join(work_dir, "ingest")
+    if API_DIR not in sys.path:
+        sys.path.insert(0, API_DIR)
+    return work_dir
+
+
+def load_api():
+    # El módulo de la API tiene un guion en el nombre, así que no se puede importar con import.
+    spec = importlib.util.spec_from_file_location("database_api", os.path.join(API_DIR, "Database-API.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def create_schema() -> None:
+    from database import Base, engine
+    import models  # noqa: F401 (registra las tablas)
+
+    Base.metadata.create_all(bind=engine)
+
+
+def seed_project(frames: int, labels: list = None, owner: str = "bench@example.com", finished_every: int = 0):
+    """
+    Inserta un proyecto de frames sin imagen real (image_hash ficticio) con sus contadores, en
+    lotes de 5000 filas y en orden aleatorio, para que el orden físico no coincida con frame_number.
+    """
+    import json
+    import random
+    import uuid
+    from sqlalchemy import insert
+    from database import SessionLocal
+    import models
+    import stats
+
+    labels = labels or ["person", "car"]
+    project_id = uuid.uuid4()
+    numbers = list(range(1, frames + 1))
+    random.Random(0).shuffle(numbers)
+
+    db = SessionLocal()
+    try:
+        if not db.query(models.User).filter(models.User.email == owner).first():
+            db.add(models.User(email=owner, password="bench"))
+        db.add(models.Project(id=project_id, name="bench", owner=owner, labels=json.dumps(labels), colors="[]"))
+        stats.create(db, project_id)
+        for start in range(0, frames, 5000):
+            db.execute(insert(models.ImageEntry), [
+                {
+                    "project_id": project_id,
+                    "image_name": f"frame_{number:06d}.jpg",
+                    "image_hash": f"{number:064x}",
+                    "image_size": 1,
+                    "frame_number": number,
+                    "finished": bool(finished_every) and number % finished_every == 0,
+                    "synthetic": False
+                }
+                for number in numbers[start:start + 5000]
+            ])
+        finished = frames // finished_every if finished_every else 0
+        stats.adjust(db, project_id, total_images=frames, finished_images=finished)
+        db.query(models.ProjectStats).filter(models.ProjectStats.project_id == project_id).update(
+            {"last_frame_number": frames}
+        )
+        db.commit()
+    finally:
+        db.close()
+    return project_id
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def serve(work_dir: str, timeout: float = 30):
+    """
+    Arranca la API con uvicorn en un proceso aparte (con el entorno de prepare_environment) y
+    devuelve su URL cuando ya responde. La salida del servidor va a work_dir/api.log.
+    """
+    import requests
+
+    port = _free_port()
+    log = open(os.path.join(work_dir, "api.log"), "w")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "--app-dir", API_DIR, "Database-API:app",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=work_dir, stdout=log, stderr=subprocess.STDOUT
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                requests.get(f"{base_url}/cache/stats", timeout=1)
+                break
+            except requests.ConnectionError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"The API did not start, see {log.name}")
+                time.sleep(0.2)
+        yield base_url
+    finally:
+        server.terminate()
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        log.close()
@@ -0,0 +1,141 @@
+"""
+Latencia de navegación por frames (GET /project/{id}/image/{n} y su miniatura) mientras otro
+usuario sube un proyecto grande y luego se añaden imágenes sintéticas en ráfaga. La API se
+arranca con uvicorn; se muestra p50/p99/máximo de cada fase, que deberían parecerse a los de
+la fase sin carga si el trabajo pesado no bloquea el bucle de eventos.
+
+    python benchmarks/frame_latency.py [--upload-frames 120] [--readers 4]
+"""
+import argparse
+import io
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import common
+
+
+def _jpeg(index: int, width: int = 1280, height: int = 720) -> bytes:
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(index)
+    image = np.zeros((height, width, 3), np.uint8)
+    image[:] = (index * 7 % 255, 80, 160)
+    image[::4, ::4] = rng.integers(0, 255, (height // 4, width // 4, 3), dtype=np.uint8)
+    return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+
+
+def _png(index: int) -> bytes:
+    import cv2
+    import numpy as np
+
+    image = np.random.default_rng(index).integers(0, 255, (1080, 1920, 3), dtype=np.uint8)
+    return cv2.imencode(".png", image)[1].tobytes()
+
+
+def _archive(frames: int) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        for index in range(frames):
+            zip_file.writestr(f"frames/img{index:04d}.jpg", _jpeg(index))
+            zip_file.writestr(f"frames/img{index:04d}.txt", "0 0.5 0.5 0.2 0.2")
+    return buffer.getvalue()
+
+
+def _upload(session, base_url: str, name: str, archive: bytes) -> dict:
+    return session.post(
+        f"{base_url}/upload",
+        data={"project_name": name, "project_owner": "bench@example.com", "labels": ["object"], "colors": ["#f00"]},
+        files={"folder": (f"{name}.zip", archive, "application/zip")}
+    ).json()
+
+
+def _wait(session, base_url: str, job_id: str) -> dict:
+    while (job := session.get(f"{base_url}/jobs/{job_id}").json())["status"] in ("queued", "running"):
+        time.sleep(0.2)
+    return job
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark frame navigation latency during uploads")
+    parser.add_argument("--upload-frames", type=int, default=120, help="1280x720 JPEG frames in the uploaded ZIP")
+    parser.add_argument("--synthetic", type=int, default=24, help="1920x1080 PNG images in the synthetic burst")
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--idle-seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    work_dir = common.prepare_environment()
+    import requests
+
+    archive = _archive(args.upload_frames)
+    pngs = [_png(index) for index in range(8)]
+    print(f"upload: {args.upload_frames} frames, {len(archive) / 1e6:.0f} MB")
+
+    with common.serve(work_dir) as base_url:
+        session = requests.Session()
+        session.post(f"{base_url}/register", data={"email": "bench@example.com", "password": "bench"})
+        seed = _upload(session, base_url, "navigation", _archive(20))
+        assert _wait(session, base_url, seed["job_id"])["status"] == "succeeded"
+        project_id = seed["project_id"]
+        # Las miniaturas se generan en la primera petición; se piden antes para no medir eso.
+        for frame_number in range(1, 21):
+            session.get(f"{base_url}/project/{project_id}/image/{frame_number}/raw", params={"size": "thumb"})
+
+        stop = threading.Event()
+        samples = []
+
+        def reader(offset: int) -> None:
+            reader_session = requests.Session()
+            count = offset
+            while not stop.is_set():
+                count += 1
+                frame_number = count % 20 + 1
+                started = time.perf_counter()
+                if count % 2:
+                    response = reader_session.get(f"{base_url}/project/{project_id}/image/{frame_number}", params={"image_mode": "url"})
+                else:
+                    response = reader_session.get(f"{base_url}/project/{project_id}/image/{frame_number}/raw", params={"size": "thumb"})
+                assert response.status_code == 200, response.text
+                samples.append((time.monotonic(), (time.perf_counter() - started) * 1000))
+                time.sleep(0.01)
+
+        readers = [threading.Thread(target=reader, args=(offset,)) for offset in range(args.readers)]
+        for thread in readers:
+            thread.start()
+
+        phases = [("idle", time.monotonic())]
+        time.sleep(args.idle_seconds)
+
+        phases.append(("upload request", time.monotonic()))
+        upload = _upload(requests.Session(), base_url, "large", archive)
+        phases.append(("ingest", time.monotonic()))
+        job = _wait(session, base_url, upload["job_id"])
+
+        phases.append(("synthetic burst", time.monotonic()))
+
+        def add_synthetic(index: int) -> int:
+            return requests.post(
+                f"{base_url}/synthetic", params={"project_id": project_id},
+                files={"file": (f"synthetic{index}.png", pngs[index % len(pngs)], "image/png")}
+            ).status_code
+
+        with ThreadPoolExecutor(8) as executor:
+            codes = list(executor.map(add_synthetic, range(args.synthetic)))
+        phases.append(("end", time.monotonic()))
+        stop.set()
+        for thread in readers:
+            thread.join()
+
+    print(f"upload job: {job['status']} ({job.get('message')}), synthetic: {codes.count(200)}/{len(codes)} stored")
+    for (name, start), (_, end) in zip(phases, phases[1:]):
+        latencies = [latency for at, latency in samples if start <= at < end]
+        print(
+            f"{name:16s} {end - start:6.1f} s  n={len(latencies):5d}  p50 {common.percentile(latencies, .5):7.1f}  "
+            f"p99 {common.percentile(latencies, .99):7.1f}  max {max(latencies, default=float('nan')):7.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
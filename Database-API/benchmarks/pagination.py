@@ -0,0 +1,61 @@
+"""
+Listado de frames de un proyecto grande (100000 frames por defecto): paginación por offset
+('skip') frente a cursor ('after'), con y sin el filtro de terminados, y el coste de pedir el
+total. Las peticiones van por la aplicación en el mismo proceso (TestClient), así solo se mide
+la consulta y la serialización.
+
+    python benchmarks/pagination.py [--frames 100000] [--repeat 20]
+"""
+import argparse
+import time
+
+import common
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offset vs cursor pagination of /project/{id}/images")
+    parser.add_argument("--frames", type=int, default=100_000)
+    parser.add_argument("--limit", type=int, default=6)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    common.prepare_environment()
+    api = common.load_api()
+    from fastapi.testclient import TestClient
+
+    common.create_schema()
+    started = time.perf_counter()
+    # Uno de cada 7 frames terminado, para que el filtro tenga que saltar filas.
+    project_id = common.seed_project(args.frames, finished_every=7)
+    print(f"project: {args.frames} frames (seeded in {time.perf_counter() - started:.1f}s)")
+
+    client = TestClient(api.app)
+
+    def measure(params: dict) -> float:
+        params = {"image_mode": "url", "limit": args.limit, **params}
+        response = client.get(f"/project/{project_id}/images", params=params)
+        assert response.status_code == 200, response.text
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            client.get(f"/project/{project_id}/images", params=params)
+        return (time.perf_counter() - started) / args.repeat * 1000
+
+    middle, end = args.frames // 2, args.frames - args.limit - 1
+    finished_end = args.frames // 7 - args.limit - 1
+    cases = [
+        ("offset, first page", {"skip": 0}),
+        ("offset, middle", {"skip": middle}),
+        ("offset, last page", {"skip": end}),
+        ("cursor, middle", {"after": middle}),
+        ("cursor, last page", {"after": end}),
+        ("finished, offset last page", {"finished": True, "skip": finished_end}),
+        ("finished, cursor last page", {"finished": True, "after": args.frames - 7 * (args.limit + 1)}),
+        ("cursor + include_total", {"after": middle, "include_total": True}),
+        ("finished cursor + include_total", {"finished": True, "after": middle, "include_total": True})
+    ]
+    for label, params in cases:
+        print(f"{label:34s} {measure(params):8.2f} ms/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import hashlib
+import io
+import os
+import tempfile
+from PIL import Image
+
+BLOB_ROOT = os.getenv("BLOB_STORE_PATH", "data/blobs")
+CHUNK_SIZE = 1024 * 1024
+
+MIME_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+}
+EXTENSIONS = {mime_type: extension for extension, mime_type in reversed(MIME_TYPES.items())}
+
+
+def blob_path(digest: str) -> str:
+    """
+    Ruta del blob en disco, repartida en dos niveles de subcarpetas (ab/cd/abcd...).
+    """
+    return os.path.join(BLOB_ROOT, digest[:2], digest[2:4], digest)
+
+
+def exists(digest: str) -> bool:
+    return os.path.exists(blob_path(digest))
+
+
+def _new_temp_file():
+    os.makedirs(BLOB_ROOT, exist_ok=True)
+    return tempfile.mkstemp(dir=BLOB_ROOT, prefix=".tmp-")
+
+
+def _commit(temp_path: str, digest: str) -> None:
+    final_path = blob_path(digest)
+    if os.path.exists(final_path):
+        os.remove(temp_path)
+        return
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    os.replace(temp_path, final_path)
+
+
+def put(data: bytes) -> str:
+    """
+    Guarda los bytes si no existen ya y devuelve su SHA-256.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    if not exists(digest):
+        fd, temp_path = _new_temp_file()
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        _commit(temp_path, digest)
+    return digest
+
+
+def put_stream(stream) -> tuple:
+    """
+    Igual que put() pero leyendo de un fichero por bloques. Devuelve (digest, tamaño).
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    fd, temp_path = _new_temp_file()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := stream.read(CHUNK_SIZE):
+                hasher.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    digest = hasher.hexdigest()
+    _commit(temp_path, digest)
+    return digest, size
+
+
+def read(digest: str) -> bytes:
+    with open(blob_path(digest), "rb") as f:
+        return f.read()
+
+
+def open_blob(digest: str):
+    return open(blob_path(digest), "rb")
+
+
+def delete(digest: str) -> None:
+    try:
+        os.remove(blob_path(digest))
+    except FileNotFoundError:
+        pass
+
+
+def iter_blobs():
+    """
+    Recorre todos los blobs guardados devolviendo (digest, ruta).
+    """
+    for root, _, files in os.walk(BLOB_ROOT):
+        for name in files:
+            if not name.startswith(".tmp-"):
+                yield name, os.path.join(root, name)
+
+
+def image_info(data: bytes, filename: str = None) -> dict:
+    """
+    Lee solo la cabecera de la imagen para sacar dimensiones y tipo MIME.
+    """
+    mime_type = MIME_TYPES.get(os.path.splitext(filename)[1].lower()) if filename else None
+    width = height = None
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            width, height = img.size
+            mime_type = Image.MIME.get(img.format, mime_type)
+    except Exception:
+        pass
+    return {"width": width, "height": height, "mime_type": mime_type or "application/octet-stream"}
+
+
+def store_image(data: bytes, filename: str = None, width: int = None, height: int = None, mime_type: str = None) -> dict:
+    """
+    Guarda una imagen en el almacén y devuelve las columnas de ImageEntry que la describen.
+    Si se conocen las dimensiones y el tipo (p. ej. frames de vídeo) no se abre con PIL.
+    """
+    if width is None or height is None or mime_type is None:
+        info = image_info(data, filename)
+    else:
+        info = {"width": width, "height": height, "mime_type": mime_type}
+
+    return {
+        "image_hash": put(data),
+        "image_size": len(data),
+        **info
+    }
@@ -0,0 +1,58 @@
+import os
+import yaml
+import archives
+import blob_store
+
+FSOD_HANDOFF = os.getenv("FSOD_HANDOFF", "stream")
+HANDOFF_MODES = ["stream", "shared-volume"]
+
+
+def data_yaml(labels: list) -> str:
+    return yaml.dump({
+        'path': './',
+        'train': 'images/train',
+        'predict': 'images/predict',
+        'val': 'images/val',
+        'nc': len(labels),
+        'names': labels
+    }, sort_keys=False)
+
+
+def dataset_entries(splits: dict, labels: list):
+    """
+    Estructura images/<split>, labels/<split> y data.yaml que espera YoloFSOD, generada
+    directamente a partir de las filas de la base de datos y de los blobs.
+    """
+    yield archives.text_entry("data.yaml", data_yaml(labels))
+
+    for split, rows in splits.items():
+        for row in rows:
+            yield archives.file_entry(f"images/{split}/{row.image_name}", blob_store.blob_path(row.image_hash))
+
+            if split in ['train', 'val'] and row.yolo:
+                label_filename = os.path.splitext(row.image_name)[0] + '.txt'
+                yield archives.text_entry(f"labels/{split}/{label_filename}", f"{row.yolo}\n")
+
+
+def stream_dataset(splits: dict, labels: list):
+    """
+    Dataset como TAR sin comprimir generado al vuelo, para enviarlo con una subida chunked.
+    """
+    return archives.stream_tar(dataset_entries(splits, labels))
+
+
+def manifest(splits: dict, labels: list) -> dict:
+    """
+    Para el modo de volumen compartido: solo viajan los nombres, los hashes de los blobs
+    y las etiquetas; YoloFSOD enlaza las imágenes desde su copia de solo lectura del almacén.
+    """
+    return {
+        "names": labels,
+        "splits": {
+            split: [
+                {"image": row.image_name, "blob": row.image_hash, "labels": row.yolo if split != "predict" else None}
+                for row in rows
+            ]
+            for split, rows in splits.items()
+        }
+    }
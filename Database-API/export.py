@@ -0,0 +1,67 @@
+import os
+import models
+import blob_store
+import archives
+from database import SessionLocal
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 500))
+
+
+def iter_images(project_id, *filters, batch_size: int = EXPORT_BATCH_SIZE):
+    """
+    Recorre las imágenes del proyecto por orden de frame en lotes con paginación por cursor.
+    Cada lote es una consulta corta con su propia sesión, así no se mantiene abierta una
+    lectura larga que bloquee las escrituras mientras el cliente descarga.
+    Solo se leen las columnas necesarias, nunca los bytes de la imagen.
+    """
+    columns = (
+        models.ImageEntry.id,
+        models.ImageEntry.image_name,
+        models.ImageEntry.frame_number,
+        models.ImageEntry.yolo,
+        models.ImageEntry.image_hash,
+        models.ImageEntry.revision
+    )
+    last_frame = None
+    while True:
+        db = SessionLocal()
+        try:
+            query = db.query(*columns).filter(models.ImageEntry.project_id == project_id, *filters)
+            if last_frame is not None:
+                query = query.filter(models.ImageEntry.frame_number > last_frame)
+            rows = query.order_by(models.ImageEntry.frame_number).limit(batch_size).all()
+        finally:
+            db.close()
+
+        if not rows:
+            return
+        yield from rows
+        last_frame = rows[-1].frame_number
+
+
+def download_yaml(labels: list) -> str:
+    yaml_content = "#*Edit the paths with your own and delete this line*#\n"
+    yaml_content += "path: ./\n\n"
+    yaml_content += "train: images/?\n"
+    yaml_content += "test: images/?\n"
+    yaml_content += "val: images/?\n\n"
+    yaml_content += f"nc: {len(labels)}\n\n"
+    yaml_content += "names:\n"
+    for label in labels:
+        yaml_content += f"- {label}\n"
+    return yaml_content
+
+
+def project_entries(project_id, labels: list, include_images: bool):
+    for image_entry in iter_images(project_id):
+        base_filename = os.path.splitext(image_entry.image_name)[0]
+        yield archives.text_entry(f"labels/{base_filename}.txt", image_entry.yolo or "")
+
+        if include_images:
+            yield archives.file_entry(f"images/{image_entry.image_name}", blob_store.blob_path(image_entry.image_hash))
+
+    yield archives.text_entry("data.yaml", download_yaml(labels))
+
+
+def stream_project_zip(project_id, labels: list, include_images: bool):
+    return archives.stream_zip(project_entries(project_id, labels, include_images))
@@ -0,0 +1,130 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Caché LRU segura entre hilos, limitada por número de entradas y opcionalmente por bytes.
+    Cada invalidación sube la generación de la clave, así una lectura de la base de datos que
+    empezó antes (con token()) no vuelve a guardar el valor anterior al terminar.
+    """
+
+    def __init__(self, name: str, max_entries: int, max_bytes: int = None, sizeof=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Generación de las claves invalidadas, y la de toda la caché para las invalidaciones en bloque.
+        self.generations = {}
+        self.epoch = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def token(self, key) -> tuple:
+        """
+        Se toma antes de leer el valor de la base de datos y se pasa a put().
+        """
+        with self.lock:
+            return self.epoch, self.generations.get(key, 0)
+
+    def put(self, key, value, token: tuple = None) -> None:
+        """
+        Guarda el valor, salvo que la clave se haya invalidado después de tomar token.
+        """
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self.lock:
+            if token is not None and token != (self.epoch, self.generations.get(key, 0)):
+                return
+            if key in self.entries:
+                self.current_bytes -= self.sizeof(self.entries.pop(key))
+            self.entries[key] = value
+            self.current_bytes += size
+            while len(self.entries) > self.max_entries or (
+                self.max_bytes is not None and self.current_bytes > self.max_bytes
+            ):
+                _, evicted = self.entries.popitem(last=False)
+                self.current_bytes -= self.sizeof(evicted)
+                self.evictions += 1
+
+    def _new_epoch(self) -> None:
+        # Invalida todos los tokens pendientes y permite olvidar las generaciones por clave.
+        self.epoch += 1
+        self.generations.clear()
+
+    def invalidate(self, key) -> None:
+        with self.lock:
+            if key in self.entries:
+                self.current_bytes -= self.sizeof(self.entries.pop(key))
+            self.generations[key] = self.generations.get(key, 0) + 1
+            if len(self.generations) > self.max_entries:
+                self._new_epoch()
+
+    def invalidate_where(self, predicate) -> None:
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                self.current_bytes -= self.sizeof(self.entries.pop(key))
+            self._new_epoch()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+            self._new_epoch()
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+# Etiquetas y colores de cada proyecto, por project_id.
+projects = LRUCache("projects", int(os.getenv("PROJECT_CACHE_ENTRIES", 256)))
+
+# Filas de ImageEntry ya serializadas, por (project_id, frame_number).
+frames = LRUCache("frames", int(os.getenv("FRAME_CACHE_ENTRIES", 20000)))
+
+# Bytes de las imágenes por SHA-256: al ser direccionadas por contenido nunca quedan obsoletas.
+images = LRUCache(
+    "images",
+    int(os.getenv("IMAGE_CACHE_ENTRIES", 5000)),
+    max_bytes=int(os.getenv("IMAGE_CACHE_MAX_BYTES", 256 * 1024 * 1024)),
+    sizeof=len
+)
+
+
+def invalidate_frame(project_id, frame_number) -> None:
+    frames.invalidate((project_id, frame_number))
+
+
+def invalidate_project(project_id) -> None:
+    projects.invalidate(project_id)
+    frames.invalidate_where(lambda key: key[0] == project_id)
+
+
+def stats() -> dict:
+    return {cache.name: cache.stats() for cache in (projects, frames, images)}
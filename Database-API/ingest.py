@@ -0,0 +1,212 @@
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import datetime
+from sqlalchemy import insert
+from database import SessionLocal
+from PIL import Image
+import models
+import annotations
+import blob_store
+import jobs
+import renditions
+import stats
+import video_frames
+
+INGEST_DIR = os.getenv("INGEST_TEMP_PATH", os.path.join(tempfile.gettempdir(), "pfg-ingest"))
+BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 500))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+IMAGE_EXTENSIONS = {"jpg", "png"}
+VIDEO_EXTENSIONS = {"mp4", "avi", "mov", "mkv"}
+
+
+def spool_path(name) -> str:
+    os.makedirs(INGEST_DIR, exist_ok=True)
+    return os.path.join(INGEST_DIR, f"{name}.zip")
+
+
+def spool_upload(file, path: str) -> bool:
+    """
+    Copia el fichero subido (UploadFile.file) a disco por bloques sin cargarlo entero en memoria
+    y devuelve si es un ZIP válido. Es bloqueante, los endpoints async la llaman con offload.
+    """
+    file.seek(0)
+    with open(path, "wb") as f:
+        shutil.copyfileobj(file, f, UPLOAD_CHUNK_SIZE)
+    return zipfile.is_zipfile(path)
+
+
+@jobs.cleanup("upload")
+def remove_spool(job) -> None:
+    path = spool_path(job.id)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _extension(name: str) -> str:
+    return name.lower().split('.')[-1]
+
+
+def media_members(zip_ref: zipfile.ZipFile) -> list:
+    """
+    Miembros del ZIP que son imágenes o vídeos, en orden estable por carpeta y nombre.
+    """
+    members = [
+        info for info in zip_ref.infolist()
+        if not info.is_dir() and _extension(info.filename) in IMAGE_EXTENSIONS | VIDEO_EXTENSIONS
+    ]
+    return sorted(members, key=lambda info: os.path.split(info.filename))
+
+
+class FrameWriter:
+    """
+    Acumula filas de ImageEntry y las inserta en bloque, haciendo commit cada BATCH_SIZE frames
+    (el commit incluye también el progreso del job). Los números de frame de cada bloque se
+    reservan al insertarlo, así no chocan con frames sintéticos guardados mientras tanto. Con
+    job_id, antes de cada bloque comprueba si se ha pedido cancelar el trabajo (JobCancelled).
+    """
+
+    def __init__(self, db, project_id, batch_size: int = BATCH_SIZE, job_id=None):
+        self.db = db
+        self.project_id = project_id
+        self.batch_size = batch_size
+        self.job_id = job_id
+        self.pending = []
+        self.written = 0
+
+    def add(self, image_fields: dict, extension: str, yolo: str = None) -> None:
+        self.pending.append((image_fields, extension, yolo))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.job_id is not None:
+            jobs.check_cancelled(self.job_id)
+        if self.pending:
+            first_frame = stats.allocate_frames(self.db, self.project_id, len(self.pending))
+            boxes = [annotations.parse_yolo(yolo) for _, _, yolo in self.pending]
+            rows = [
+                {
+                    "project_id": self.project_id,
+                    "image_name": f"frame_{first_frame + i:06d}{extension}",
+                    "frame_number": first_frame + i,
+                    "yolo": annotations.format_yolo(boxes[i]),
+                    "synthetic": False,
+                    "finished": False,
+                    "source_timestamp": None,
+                    **image_fields
+                }
+                for i, (image_fields, extension, _) in enumerate(self.pending)
+            ]
+            image_ids = self.db.execute(
+                insert(models.ImageEntry).returning(models.ImageEntry.id, sort_by_parameter_order=True),
+                rows
+            ).scalars().all()
+            annotations.replace_boxes(self.db, self.project_id, {
+                image_id: frame_boxes for image_id, frame_boxes in zip(image_ids, boxes) if frame_boxes
+            })
+            stats.adjust(self.db, self.project_id, total_images=len(self.pending))
+            self.written += len(self.pending)
+            self.pending = []
+        self.db.commit()
+
+
+def store_image_with_renditions(data: bytes, filename: str) -> dict:
+    image_fields = blob_store.store_image(data, filename)
+    if renditions.RENDITIONS_AT_INGEST:
+        with Image.open(io.BytesIO(data)) as image:
+            renditions.generate_from_image(image_fields["image_hash"], image.convert("RGB"))
+    return image_fields
+
+
+def _ingest_video(zip_ref: zipfile.ZipFile, info: zipfile.ZipInfo, writer: FrameWriter, sampling: str, report: dict) -> None:
+    # OpenCV necesita una ruta, así que solo este miembro se copia a disco.
+    suffix = os.path.splitext(info.filename)[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix, dir=INGEST_DIR, delete=False) as video_file:
+        with zip_ref.open(info) as member:
+            shutil.copyfileobj(member, video_file, UPLOAD_CHUNK_SIZE)
+        video_path = video_file.name
+
+    try:
+        for image_fields in video_frames.extract_frames(video_path, sampling=sampling, report=report):
+            writer.add(image_fields, ".jpg")
+    finally:
+        os.remove(video_path)
+
+
+def _finish(db, job_id, status: str, message: str) -> None:
+    job = db.query(models.Job).filter(models.Job.id == job_id).first()
+    job.status = status
+    job.message = message
+    job.finished_at = datetime.utcnow()
+    db.commit()
+
+
+def ingest_archive(job_id, project_id, zip_path: str, video_sampling: str = video_frames.VIDEO_SAMPLING) -> None:
+    """
+    Procesa el ZIP subido a /upload recorriendo sus miembros sin extraerlo y
+    actualiza el progreso del job según avanza. Los vídeos se muestrean según video_sampling
+    (uno de video_frames.SAMPLING_MODES). Si se cancela, los bloques ya guardados se conservan.
+    """
+    db = SessionLocal()
+    writer = FrameWriter(db, project_id, job_id=job_id)
+    try:
+        # Una subida cancelada mientras esperaba turno ya no se procesa.
+        claimed = db.query(models.Job).filter(
+            models.Job.id == job_id,
+            models.Job.status == "queued"
+        ).update({"status": "running", "started_at": datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+        if not claimed:
+            return
+        job = db.query(models.Job).filter(models.Job.id == job_id).first()
+
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            names = set(zip_ref.namelist())
+            members = media_members(zip_ref)
+            job.total = len(members)
+            db.commit()
+
+            report = {"dropped": 0}
+            for info in members:
+                if _extension(info.filename) in IMAGE_EXTENSIONS:
+                    yolo_data = None
+                    txt_name = os.path.splitext(info.filename)[0] + ".txt"
+                    if txt_name in names:
+                        yolo_data = zip_ref.read(txt_name).decode()
+
+                    job.progress += 1
+                    writer.add(
+                        store_image_with_renditions(zip_ref.read(info), info.filename),
+                        os.path.splitext(info.filename)[1].lower(),
+                        yolo_data
+                    )
+                else:
+                    _ingest_video(zip_ref, info, writer, video_sampling, report)
+                    job.progress += 1
+                    db.commit()
+
+            writer.flush()
+
+        job.status = "succeeded"
+        job.message = f"{writer.written} frames processed"
+        if report["dropped"]:
+            job.message += f", {report['dropped']} near-duplicate video frames skipped"
+        job.finished_at = datetime.utcnow()
+        db.commit()
+
+    except jobs.JobCancelled:
+        db.rollback()
+        _finish(db, job_id, "cancelled", f"Cancelled after {writer.written} frames")
+
+    except Exception as e:
+        db.rollback()
+        _finish(db, job_id, "failed", str(e))
+
+    finally:
+        db.close()
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
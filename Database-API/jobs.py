@@ -0,0 +1,189 @@
+import os
+import socket
+import threading
+from datetime import datetime
+from sqlalchemy import or_
+from database import SessionLocal
+import models
+
+ACTIVE_STATUSES = ["queued", "running"]
+FINISHED_STATUSES = ["succeeded", "failed", "cancelled"]
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 1))
+POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 2))
+# Identifica a este proceso en Job.owner. Tiene que ser el mismo tras un reinicio y distinto en
+# cada proceso que comparte la base: el nombre del host (el del contenedor) salvo que se fije.
+INSTANCE_ID = os.getenv("API_INSTANCE_ID") or socket.gethostname()
+
+handlers = {}
+cleanups = {}
+_wakeup = threading.Event()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def handler(kind: str):
+    """
+    Registra la función que ejecuta los trabajos de un tipo: handler(db, job).
+    """
+    def register(func):
+        handlers[kind] = func
+        return func
+    return register
+
+
+def cleanup(kind: str):
+    """
+    Registra lo que hay que borrar de un trabajo de ese tipo que no se va a completar tras un
+    reinicio (p. ej. el ZIP temporal de una subida): cleanup(job).
+    """
+    def register(func):
+        cleanups[kind] = func
+        return func
+    return register
+
+
+def notify() -> None:
+    """
+    Despierta a los workers en cuanto se encola un trabajo, sin esperar al siguiente sondeo.
+    """
+    _wakeup.set()
+
+
+def serialize(job: models.Job) -> dict:
+    return {
+        "job_id": str(job.id),
+        "project_id": str(job.project_id),
+        "kind": job.kind,
+        "status": job.status,
+        "progress": job.progress,
+        "total": job.total,
+        "epoch": job.epoch,
+        "epochs": job.epochs,
+        "predicted_frames": job.predicted_frames,
+        "frames_to_predict": job.frames_to_predict,
+        "cancel_requested": job.cancel_requested,
+        "message": job.message,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+def check_cancelled(job_id) -> None:
+    """
+    Lanza JobCancelled si se ha pedido cancelar el trabajo. Usa su propia sesión para ver
+    el valor confirmado aunque la del worker tenga una transacción abierta.
+    """
+    db = SessionLocal()
+    try:
+        cancel = db.query(models.Job.cancel_requested).filter(models.Job.id == job_id).scalar()
+    finally:
+        db.close()
+    if cancel:
+        raise JobCancelled()
+
+
+def _claim(db):
+    job = db.query(models.Job).filter(
+        models.Job.kind.in_(list(handlers)),
+        models.Job.status == "queued"
+    ).order_by(models.Job.created_at).first()
+    if job is None:
+        return None
+
+    claimed = db.query(models.Job).filter(
+        models.Job.id == job.id,
+        models.Job.status == "queued"
+    ).update({"status": "running", "started_at": datetime.utcnow(), "owner": INSTANCE_ID}, synchronize_session=False)
+    db.commit()
+    return job.id if claimed else None
+
+
+def _run(job_id) -> None:
+    db = SessionLocal()
+    try:
+        job = db.query(models.Job).filter(models.Job.id == job_id).first()
+        message = None
+        try:
+            handlers[job.kind](db, job)
+            status = "succeeded"
+        except JobCancelled:
+            db.rollback()
+            status = "cancelled"
+        except Exception as e:
+            db.rollback()
+            status, message = "failed", str(e)
+
+        # El handler puede haber cerrado la sesión para no retener la conexión durante una
+        # petición larga, así que el trabajo se vuelve a leer para guardar el resultado.
+        job = db.query(models.Job).filter(models.Job.id == job_id).first()
+        job.status = status
+        if message is not None:
+            job.message = message
+        job.finished_at = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+
+def _loop(stop: threading.Event) -> None:
+    while not stop.is_set():
+        db = SessionLocal()
+        try:
+            job_id = _claim(db)
+        finally:
+            db.close()
+
+        if job_id is not None:
+            _run(job_id)
+            continue
+
+        _wakeup.wait(POLL_INTERVAL)
+        _wakeup.clear()
+
+
+def recover_interrupted() -> None:
+    """
+    Los trabajos de esta instancia que estaban en marcha o en cola cuando se paró la API se
+    vuelven a encolar si hay un handler que los pueda repetir. El resto (p. ej. subidas, que
+    esperaban turno en el proceso anterior) se marcan como fallidos y se borra lo que dejaron a
+    medias. Los de otras instancias que comparten la base no se tocan; los que no tienen
+    instancia son de versiones anteriores, de cuando solo había una.
+    """
+    db = SessionLocal()
+    try:
+        interrupted = db.query(models.Job).filter(
+            models.Job.status.in_(ACTIVE_STATUSES),
+            or_(models.Job.owner == INSTANCE_ID, models.Job.owner.is_(None))
+        ).all()
+        abandoned = []
+        for job in interrupted:
+            if job.kind in handlers and not job.cancel_requested:
+                job.status = "queued"
+            else:
+                job.status = "failed"
+                job.message = "Interrupted by a restart of the API"
+                job.finished_at = datetime.utcnow()
+                abandoned.append(job)
+        db.commit()
+        for job in abandoned:
+            if job.kind in cleanups:
+                cleanups[job.kind](job)
+    finally:
+        db.close()
+
+
+def start(workers: int = JOB_WORKERS) -> threading.Event:
+    recover_interrupted()
+    stop = threading.Event()
+    for i in range(workers):
+        threading.Thread(target=_loop, args=(stop,), name=f"job-worker-{i}", daemon=True).start()
+    return stop
+
+
+def stop_workers(stop: threading.Event) -> None:
+    stop.set()
+    notify()
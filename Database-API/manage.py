@@ -0,0 +1,279 @@
+import argparse
+import json
+import os
+import time
+import uuid
+from collections import defaultdict
+from sqlalchemy import bindparam, inspect, insert, select, text, update
+from database import engine, Base, SessionLocal
+import models
+import annotations
+import stats
+import blob_store
+import renditions
+
+
+def add_missing_columns():
+    """
+    Añade a las tablas existentes las columnas nuevas de los modelos. Solo admite columnas
+    nulables o con server_default, que son las que se pueden añadir sin reescribir la tabla.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                    if not column.nullable:
+                        ddl += " NOT NULL"
+                conn.execute(text(ddl))
+
+
+def migrate_members() -> int:
+    """
+    Pasa las listas JSON de users.projects a project_members (el dueño de cada proyecto con rol
+    "owner") y vacía la columna. Los ids de proyectos ya borrados se descartan. Si no queda
+    ninguna lista por convertir no hace nada, así que se puede llamar en cada arranque.
+    """
+    with engine.begin() as conn:
+        users = conn.execute(
+            select(models.User.email, models.User.projects).where(models.User.projects.is_not(None))
+        ).all()
+        if not users:
+            return 0
+
+        owners = dict(conn.execute(select(models.Project.id, models.Project.owner)).all())
+        existing = set(conn.execute(select(models.ProjectMember.project_id, models.ProjectMember.user_email)).all())
+
+        members = {(project_id, owner): "owner" for project_id, owner in owners.items()}
+        for email, projects in users:
+            for project_id in json.loads(projects or "[]"):
+                try:
+                    project_id = uuid.UUID(project_id)
+                except ValueError:
+                    continue
+                if project_id in owners:
+                    members.setdefault((project_id, email), "editor")
+
+        new_members = [
+            {"project_id": project_id, "user_email": email, "role": role}
+            for (project_id, email), role in members.items()
+            if (project_id, email) not in existing
+        ]
+        if new_members:
+            conn.execute(insert(models.ProjectMember), new_members)
+        conn.execute(update(models.User).where(models.User.projects.is_not(None)).values(projects=None))
+
+    return len(new_members)
+
+
+def backfill_boxes(batch_size: int = 1000) -> int:
+    """
+    Rellena la tabla boxes con las anotaciones de las imágenes etiquetadas antes de que existiera
+    y deja su texto YOLO en el mismo formato que el resto. Si no falta ninguna no hace nada, así
+    que se puede llamar en cada arranque.
+    """
+    images = models.ImageEntry
+    missing = select(images.id, images.project_id, images.yolo).where(
+        images.yolo.is_not(None),
+        ~select(models.Box.id).where(models.Box.image_id == images.id).exists()
+    ).order_by(images.id).limit(batch_size)
+
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(missing).all()
+            if not rows:
+                break
+
+            boxes_by_project = defaultdict(dict)
+            for row in rows:
+                boxes_by_project[row.project_id][row.id] = annotations.parse_yolo(row.yolo)
+            # Las que no tienen ninguna caja válida se quedan sin texto, así no se vuelven a seleccionar.
+            conn.execute(
+                update(images.__table__).where(images.id == bindparam("b_id")).values(yolo=bindparam("b_yolo")),
+                [
+                    {"b_id": image_id, "b_yolo": annotations.format_yolo(boxes)}
+                    for boxes_by_image in boxes_by_project.values()
+                    for image_id, boxes in boxes_by_image.items()
+                ]
+            )
+            for project_id, boxes_by_image in boxes_by_project.items():
+                annotations.replace_boxes(conn, project_id, boxes_by_image)
+        total += len(rows)
+
+    return total
+
+
+def reconcile_stats(project_id: str = None, only_missing: bool = False) -> int:
+    """
+    Recalcula desde las tablas images y boxes los contadores, las cifras por clase y el estado de
+    los proyectos. Con only_missing solo los que aún no tienen contadores completos, que es lo
+    que se hace en cada arranque.
+    """
+    query = select(models.Project.id)
+    if project_id:
+        query = query.where(models.Project.id == uuid.UUID(project_id))
+    if only_missing:
+        query = query.outerjoin(models.ProjectStats, models.ProjectStats.project_id == models.Project.id).where(
+            models.ProjectStats.labeled_images.is_(None)
+        )
+
+    db = SessionLocal()
+    try:
+        project_ids = db.execute(query).scalars().all()
+        for reconciled_id in project_ids:
+            stats.reconcile(db, reconciled_id)
+            db.commit()
+    finally:
+        db.close()
+    return len(project_ids)
+
+
+def migrate_blobs(batch_size: int):
+    """
+    Mueve los bytes de images.image al almacén de blobs por lotes y elimina la columna.
+    """
+    columns = {column["name"] for column in inspect(engine).get_columns("images")}
+    if "image" not in columns:
+        print("images.image does not exist, nothing to migrate")
+        return
+
+    new_columns = {
+        "image_hash": "VARCHAR(64)",
+        "image_size": "INTEGER",
+        "width": "INTEGER",
+        "height": "INTEGER",
+        "mime_type": "VARCHAR",
+    }
+    with engine.begin() as conn:
+        for name, ddl in new_columns.items():
+            if name not in columns:
+                conn.execute(text(f"ALTER TABLE images ADD COLUMN {name} {ddl}"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_images_image_hash ON images (image_hash)"))
+
+    migrated = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                text("SELECT id, image_name, image FROM images WHERE image_hash IS NULL ORDER BY id LIMIT :limit"),
+                {"limit": batch_size}
+            ).fetchall()
+            if not rows:
+                break
+
+            updates = [
+                {"id": row.id, **blob_store.store_image(bytes(row.image), row.image_name)}
+                for row in rows
+            ]
+            conn.execute(
+                text(
+                    "UPDATE images SET image_hash = :image_hash, image_size = :image_size, "
+                    "width = :width, height = :height, mime_type = :mime_type WHERE id = :id"
+                ),
+                updates
+            )
+        migrated += len(rows)
+        print(f"Migrated {migrated} images")
+
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE images DROP COLUMN image"))
+
+    if engine.dialect.name == "sqlite":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
+
+    print(f"Done, {migrated} images moved to {blob_store.BLOB_ROOT}")
+
+
+def gc_blobs(min_age: int):
+    """
+    Borra los blobs que ya no referencia ninguna imagen ni resultado de inpainting pendiente
+    (p. ej. tras borrar proyectos).
+    Los blobs más recientes que min_age segundos se respetan por si hay una subida en curso.
+    """
+    with engine.connect() as conn:
+        referenced = {row[0] for row in conn.execute(text("SELECT DISTINCT image_hash FROM images"))}
+        referenced |= {
+            row[0] for row in conn.execute(text("SELECT image_hash FROM synthetic_drafts WHERE status = 'pending'"))
+        }
+
+    removed = 0
+    now = time.time()
+    for name, path in blob_store.iter_blobs():
+        # Las versiones reducidas (<sha256>.<size>.<ext>) siguen al original.
+        digest = name.split(".")[0]
+        if digest not in referenced and now - os.path.getmtime(path) > min_age:
+            os.remove(path)
+            removed += 1
+
+    print(f"Removed {removed} unreferenced blobs")
+
+
+def backfill_renditions(project_id: str, workers: int, batch_size: int):
+    """
+    Genera las miniaturas y previsualizaciones que falten, por lotes de hashes distintos.
+    """
+    query = select(models.ImageEntry.image_hash).distinct().order_by(models.ImageEntry.image_hash)
+    if project_id:
+        query = query.where(models.ImageEntry.project_id == uuid.UUID(project_id))
+
+    total = 0
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(query)
+        while batch := [row[0] for row in result.fetchmany(batch_size)]:
+            total += renditions.backfill(batch, workers)
+            print(f"Processed {total} images")
+
+    print(f"Done, renditions available for {total} images")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Database-API maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser("migrate-blobs", help="Move image bytes out of the database")
+    migrate_parser.add_argument("--batch-size", type=int, default=200)
+
+    subparsers.add_parser("migrate-members", help="Move the JSON project lists of users to project_members")
+
+    boxes_parser = subparsers.add_parser("backfill-boxes", help="Fill the boxes table from the YOLO text of existing images")
+    boxes_parser.add_argument("--batch-size", type=int, default=1000)
+
+    reconcile_parser = subparsers.add_parser("reconcile-stats", help="Rebuild the project counters and status from the images")
+    reconcile_parser.add_argument("--project-id", default=None)
+
+    gc_parser = subparsers.add_parser("gc-blobs", help="Delete blobs no longer referenced by any image")
+    gc_parser.add_argument("--min-age", type=int, default=3600)
+
+    backfill_parser = subparsers.add_parser("backfill-renditions", help="Generate thumbnails and previews for existing images")
+    backfill_parser.add_argument("--project-id", default=None)
+    backfill_parser.add_argument("--workers", type=int, default=os.cpu_count())
+    backfill_parser.add_argument("--batch-size", type=int, default=1000)
+
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+
+    if args.command == "migrate-blobs":
+        migrate_blobs(args.batch_size)
+    elif args.command == "migrate-members":
+        print(f"Added {migrate_members()} project memberships")
+    elif args.command == "backfill-boxes":
+        print(f"Indexed the annotations of {backfill_boxes(args.batch_size)} images")
+    elif args.command == "reconcile-stats":
+        print(f"Reconciled {reconcile_stats(args.project_id)} projects")
+    elif args.command == "gc-blobs":
+        gc_blobs(args.min_age)
+    elif args.command == "backfill-renditions":
+        backfill_renditions(args.project_id, args.workers, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
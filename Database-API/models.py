@@ -1,12 +1,12 @@
-from sqlalchemy import Column, String, Boolean, LargeBinary, ForeignKey, Text, Integer, UniqueConstraint, Index
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, Boolean, LargeBinary, ForeignKey, Text, Integer, UniqueConstraint, Index, DateTime, Uuid, REAL, text
 import uuid
+from datetime import datetime
 from database import Base
 
 class Project(Base):
     __tablename__ = "projects"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(Uuid, primary_key=True, default=uuid.uuid4)
     name = Column(String, nullable=False)
     status = Column(String, default="Not Started")
     owner = Column(String, ForeignKey("users.email"), nullable=False)
@@ -19,21 +19,147 @@ class User(Base):
     
     email = Column(String, primary_key=True, unique=True, nullable=False)
     password = Column(String, nullable=False)
+    # Lista JSON de proyectos de versiones anteriores; manage.migrate_members la pasa a project_members.
     projects = Column(Text, nullable=True)
 
+class ProjectMember(Base):
+    """
+    Acceso de un usuario a un proyecto: "owner" para quien lo creó, "editor" si se lo han compartido.
+    La clave primaria sirve para buscar los miembros de un proyecto y el índice, los proyectos de un usuario.
+    """
+    __tablename__ = "project_members"
+
+    project_id = Column(Uuid, ForeignKey("projects.id"), primary_key=True)
+    user_email = Column(String, ForeignKey("users.email"), primary_key=True)
+    role = Column(String, nullable=False, default="editor")
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_project_members_user', 'user_email', 'project_id'),
+    )
+
 class ImageEntry(Base):
     __tablename__ = "images"
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     image_name = Column(String, nullable=False)
-    image = Column(LargeBinary, nullable=False)
+    image_hash = Column(String(64), nullable=False, index=True)
+    image_size = Column(Integer, nullable=False)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    mime_type = Column(String, nullable=True)
     yolo = Column(String, nullable=True)
     synthetic = Column(Boolean, default=False)
     finished = Column(Boolean, default=False)
-    project_id = Column(UUID(as_uuid=True), ForeignKey("projects.id"), nullable=False)
+    project_id = Column(Uuid, ForeignKey("projects.id"), nullable=False)
     frame_number = Column(Integer, nullable=True)
+    # Se incrementa con cada edición manual; el auto-etiquetado no pisa frames editados mientras predecía.
+    revision = Column(Integer, nullable=False, default=0, server_default="0")
+    # Versión del modelo (huella de su conjunto de entrenamiento) que generó las etiquetas actuales.
+    label_model_version = Column(String(64), nullable=True)
+    # Segundo del vídeo de origen del que se extrajo el frame; None en imágenes sueltas y sintéticas.
+    source_timestamp = Column(REAL, nullable=True)
     
     __table_args__ = (
         UniqueConstraint('image_name', 'project_id', name='uix_image_name_project_id'),
-        Index('ix_project_frame', 'project_id', 'frame_number')
+        Index('ix_project_frame', 'project_id', 'frame_number'),
+        Index('ix_project_finished_frame', 'project_id', 'finished', 'frame_number'),
+        Index('ix_project_synthetic_frame', 'project_id', 'synthetic', 'frame_number')
+    )
+
+class Box(Base):
+    """
+    Una caja de las anotaciones de un frame en coordenadas YOLO normalizadas (float32). images.yolo
+    guarda el mismo contenido en texto; las dos se escriben a la vez con annotations.replace_boxes.
+    """
+    __tablename__ = "boxes"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    image_id = Column(Integer, ForeignKey("images.id"), nullable=False, index=True)
+    project_id = Column(Uuid, ForeignKey("projects.id"), nullable=False)
+    class_id = Column(Integer, nullable=False)
+    x_center = Column(REAL, nullable=False)
+    y_center = Column(REAL, nullable=False)
+    width = Column(REAL, nullable=False)
+    height = Column(REAL, nullable=False)
+
+    __table_args__ = (
+        # Responde "qué frames tienen (o no) la clase X" y "cuántas cajas de X" sin leer images.
+        Index('ix_boxes_project_class_image', 'project_id', 'class_id', 'image_id'),
+    )
+
+class ProjectStats(Base):
+    __tablename__ = "project_stats"
+
+    project_id = Column(Uuid, ForeignKey("projects.id"), primary_key=True)
+    total_images = Column(Integer, nullable=False, default=0)
+    finished_images = Column(Integer, nullable=False, default=0)
+    synthetic_images = Column(Integer, nullable=False, default=0)
+    # Frames con al menos una caja; NULL en proyectos anteriores hasta que se reconcilian.
+    labeled_images = Column(Integer, nullable=True)
+    # Último número de frame asignado; NULL en proyectos anteriores (se parte del mayor frame).
+    last_frame_number = Column(Integer, nullable=True)
+
+class ProjectClassStats(Base):
+    """
+    Cajas y frames con alguna caja de cada clase, mantenidos junto con la tabla boxes.
+    """
+    __tablename__ = "project_class_stats"
+
+    project_id = Column(Uuid, ForeignKey("projects.id"), primary_key=True)
+    class_id = Column(Integer, primary_key=True)
+    boxes = Column(Integer, nullable=False, default=0)
+    frames = Column(Integer, nullable=False, default=0)
+
+class SyntheticDraft(Base):
+    """
+    Resultado de inpainting que el servicio guarda directamente, a la espera de que el usuario
+    lo acepte (pasa a ser un frame sintético del proyecto) o lo rechace.
+    """
+    __tablename__ = "synthetic_drafts"
+
+    id = Column(Uuid, primary_key=True, default=uuid.uuid4)
+    project_id = Column(Uuid, ForeignKey("projects.id"), nullable=False, index=True)
+    source_image_id = Column(Integer, ForeignKey("images.id"), nullable=True)
+    image_hash = Column(String(64), nullable=False)
+    image_size = Column(Integer, nullable=False)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    mime_type = Column(String, nullable=True)
+    yolo = Column(String, nullable=True)
+    status = Column(String, nullable=False, default="pending")
+    image_id = Column(Integer, ForeignKey("images.id"), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Uuid, primary_key=True, default=uuid.uuid4)
+    project_id = Column(Uuid, ForeignKey("projects.id"), nullable=False, index=True)
+    kind = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="queued")
+    progress = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=True)
+    message = Column(Text, nullable=True)
+    epoch = Column(Integer, nullable=True)
+    epochs = Column(Integer, nullable=True)
+    predicted_frames = Column(Integer, nullable=True)
+    frames_to_predict = Column(Integer, nullable=True)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    idempotency_key = Column(String, nullable=True)
+    # Instancia de la API (jobs.INSTANCE_ID) que procesa el trabajo; solo ella lo recupera al reiniciarse.
+    owner = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint('project_id', 'idempotency_key', name='uix_job_idempotency_key'),
+        # Como mucho un trabajo activo de cada tipo por proyecto.
+        Index(
+            'uix_job_active_project_kind', 'project_id', 'kind', unique=True,
+            sqlite_where=text("status IN ('queued', 'running')"),
+            postgresql_where=text("status IN ('queued', 'running')")
+        ),
     )
@@ -0,0 +1,48 @@
+import os
+from functools import partial
+from anyio import CapacityLimiter, to_thread
+from database import DB_POOL_SIZE, SessionLocal
+
+# Hilos que puede ocupar a la vez cada tipo de trabajo bloqueante que los endpoints async sacan
+# del bucle de eventos. Cada tipo espera en su propio límite, así una ráfaga de subidas no deja
+# sin hilos a las lecturas de frames (que van por el threadpool general de FastAPI).
+LIMITS = {
+    "db": int(os.getenv("OFFLOAD_DB_THREADS", DB_POOL_SIZE)),
+    "images": int(os.getenv("OFFLOAD_IMAGE_THREADS", max(1, (os.cpu_count() or 1) // 2))),
+    "files": int(os.getenv("OFFLOAD_FILE_THREADS", 4)),
+    "ingest": int(os.getenv("OFFLOAD_INGEST_THREADS", 1))
+}
+
+_limiters = {}
+
+
+def limiter(kind: str) -> CapacityLimiter:
+    # Se crean al primer uso, ya dentro del bucle de eventos.
+    if kind not in _limiters:
+        _limiters[kind] = CapacityLimiter(LIMITS[kind])
+    return _limiters[kind]
+
+
+async def run(kind: str, func, *args, **kwargs):
+    """
+    Ejecuta func(*args, **kwargs) en un hilo sin bloquear el bucle de eventos, esperando turno
+    en el límite de su tipo de trabajo.
+    """
+    return await to_thread.run_sync(partial(func, *args, **kwargs), limiter=limiter(kind))
+
+
+def _with_session(func, *args, **kwargs):
+    db = SessionLocal(expire_on_commit=False)
+    try:
+        return func(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    Como run, pero pasa a func(db, ...) una sesión propia que se cierra al terminar, en lugar de
+    mantener una conexión del pool mientras la petición espera al resto de su trabajo. Lo que
+    devuelve func sigue legible después (la sesión no expira los objetos al confirmar).
+    """
+    return await run("db", _with_session, func, *args, **kwargs)
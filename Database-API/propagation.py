@@ -0,0 +1,173 @@
+import os
+import cv2
+import numpy as np
+import blob_store
+
+# Los frames más anchos se decodifican reducidos (el JPEG a 1/2 o 1/4) para seguir las cajas.
+TRACKING_MAX_WIDTH = int(os.getenv("PROPAGATION_MAX_WIDTH", 960))
+# Correlación mínima para aceptar una caja localizada por template matching.
+MATCH_MIN_SCORE = float(os.getenv("PROPAGATION_MIN_MATCH_SCORE", 0.6))
+
+MAX_POINTS = 40
+MIN_POINTS = 4
+# Distancia máxima (px) entre un punto y el resultado de seguirlo hacia delante y luego hacia atrás.
+MAX_FB_ERROR = 1.0
+# Distancia máxima (px) entre donde acaba un punto y donde lo situaba el template matching.
+MAX_GUESS_ERROR = 3.0
+# Cambio de tamaño máximo de una caja entre dos frames consecutivos.
+MAX_SCALE_STEP = 1.25
+# Margen de búsqueda del template matching, en fracción del tamaño de la caja.
+SEARCH_MARGIN = 0.5
+# Una caja se da por perdida cuando queda dentro de la imagen menos de esta fracción de ella.
+MIN_VISIBLE = 0.5
+LK_PARAMS = {
+    "winSize": (21, 21),
+    "maxLevel": 3,
+    "criteria": (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03)
+}
+
+
+def load_gray(image_hash: str, width: int = None) -> np.ndarray:
+    flags = cv2.IMREAD_GRAYSCALE
+    if width and width > 2 * TRACKING_MAX_WIDTH:
+        flags = cv2.IMREAD_REDUCED_GRAYSCALE_4
+    elif width and width > TRACKING_MAX_WIDTH:
+        flags = cv2.IMREAD_REDUCED_GRAYSCALE_2
+    gray = cv2.imdecode(np.frombuffer(blob_store.read(image_hash), np.uint8), flags)
+    if gray is None:
+        raise ValueError(f"Could not decode image {image_hash}")
+    return gray
+
+
+def _pixel_rect(box: tuple, width: int, height: int) -> tuple:
+    _, x_center, y_center, box_width, box_height = box
+    return (
+        max(int((x_center - box_width / 2) * width), 0),
+        max(int((y_center - box_height / 2) * height), 0),
+        min(int(np.ceil((x_center + box_width / 2) * width)), width),
+        min(int(np.ceil((y_center + box_height / 2) * height)), height)
+    )
+
+
+def _visible(box: tuple):
+    """
+    La parte de la caja que queda dentro de la imagen, o None si es menos de MIN_VISIBLE de ella.
+    """
+    class_id, x_center, y_center, box_width, box_height = box
+    left, top = max(x_center - box_width / 2, 0.0), max(y_center - box_height / 2, 0.0)
+    right, bottom = min(x_center + box_width / 2, 1.0), min(y_center + box_height / 2, 1.0)
+    if right <= left or bottom <= top or (right - left) * (bottom - top) < MIN_VISIBLE * box_width * box_height:
+        return None
+    return (class_id, (left + right) / 2, (top + bottom) / 2, right - left, bottom - top)
+
+
+def _moved_box(box: tuple, start: np.ndarray, end: np.ndarray, width: int, height: int) -> tuple:
+    """
+    Desplaza la caja con la mediana del movimiento de sus puntos y la escala con la mediana del
+    cociente entre las distancias de cada par de puntos antes y después.
+    """
+    class_id, x_center, y_center, box_width, box_height = box
+    shift = np.median(end - start, axis=0)
+    pairs = np.triu_indices(len(start), 1)
+    before = np.linalg.norm(start[:, None] - start[None], axis=2)[pairs]
+    after = np.linalg.norm(end[:, None] - end[None], axis=2)[pairs]
+    valid = before > 1
+    scale = np.clip(np.median(after[valid] / before[valid]), 1 / MAX_SCALE_STEP, MAX_SCALE_STEP) if valid.any() else 1.0
+    return (class_id, x_center + shift[0] / width, y_center + shift[1] / height, box_width * scale, box_height * scale)
+
+
+def _match_shift(previous: np.ndarray, current: np.ndarray, box: tuple):
+    """
+    Desplazamiento (dx, dy) en píxeles del contenido de la caja, buscado alrededor de su
+    posición anterior; None si la mejor coincidencia no es lo bastante buena.
+    """
+    height, width = previous.shape
+    left, top, right, bottom = _pixel_rect(box, width, height)
+    template = previous[top:bottom, left:right]
+    if template.shape[0] < 4 or template.shape[1] < 4 or template.std() < 2:
+        return None
+
+    margin_x = max(int((right - left) * SEARCH_MARGIN), 8)
+    margin_y = max(int((bottom - top) * SEARCH_MARGIN), 8)
+    window_left, window_top = max(left - margin_x, 0), max(top - margin_y, 0)
+    window = current[window_top:min(bottom + margin_y, height), window_left:min(right + margin_x, width)]
+    if window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1]:
+        return None
+
+    _, score, _, (x, y) = cv2.minMaxLoc(cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED))
+    if score < MATCH_MIN_SCORE:
+        return None
+    return (window_left + x - left, window_top + y - top)
+
+
+def track_boxes(previous: np.ndarray, current: np.ndarray, boxes: list) -> list:
+    """
+    Sigue las cajas (class_id, x_center, y_center, width, height normalizadas) de un frame en
+    gris al siguiente. El template matching de cada caja da su desplazamiento aproximado (si no
+    encuentra su contenido, la caja se da por perdida), que sirve de punto de partida a
+    Lucas-Kanade para afinarlo y medir el cambio de tamaño. Los puntos de todas las cajas se
+    siguen con una sola llamada en cada sentido y solo se usan los que vuelven a su sitio al
+    seguirlos hacia atrás y no se alejan de ese desplazamiento.
+    Devuelve, para cada caja, la caja movida (sin recortar a la imagen) o None si se ha perdido.
+    """
+    height, width = previous.shape
+    shifts = [_match_shift(previous, current, box) for box in boxes]
+    points, owners = [], []
+    for index, (box, shift) in enumerate(zip(boxes, shifts)):
+        left, top, right, bottom = _pixel_rect(box, width, height)
+        if shift is None or right - left < 2 or bottom - top < 2:
+            continue
+        corners = cv2.goodFeaturesToTrack(previous[top:bottom, left:right], MAX_POINTS, 0.01, 3)
+        if corners is not None:
+            points.append(corners.reshape(-1, 2) + (left, top))
+            owners.append(np.full(len(corners), index))
+
+    moved = [
+        None if shift is None else (box[0], box[1] + shift[0] / width, box[2] + shift[1] / height, box[3], box[4])
+        for box, shift in zip(boxes, shifts)
+    ]
+    if points:
+        start = np.concatenate(points).astype(np.float32)
+        owner = np.concatenate(owners)
+        guess = start + np.array([shifts[index] for index in owner], np.float32)
+        # nextPts se sobrescribe con el resultado, así que se pasa una copia de la estimación.
+        end, found, _ = cv2.calcOpticalFlowPyrLK(
+            previous, current, start.reshape(-1, 1, 2), guess.reshape(-1, 1, 2).copy(),
+            flags=cv2.OPTFLOW_USE_INITIAL_FLOW, **LK_PARAMS
+        )
+        end = end.reshape(-1, 2)
+        back, found_back, _ = cv2.calcOpticalFlowPyrLK(
+            current, previous, end.reshape(-1, 1, 2), (end - (guess - start)).reshape(-1, 1, 2),
+            flags=cv2.OPTFLOW_USE_INITIAL_FLOW, **LK_PARAMS
+        )
+        reliable = (
+            (found.ravel() == 1) & (found_back.ravel() == 1)
+            & (np.linalg.norm(back.reshape(-1, 2) - start, axis=1) < MAX_FB_ERROR)
+            & (np.linalg.norm(end - guess, axis=1) < MAX_GUESS_ERROR)
+        )
+        for index in np.unique(owner):
+            selected = reliable & (owner == index)
+            if np.count_nonzero(selected) >= MIN_POINTS:
+                moved[index] = _moved_box(boxes[index], start[selected], end[selected], width, height)
+
+    return moved
+
+
+def propagate(source, targets, boxes: list):
+    """
+    Propaga las cajas del frame source a los frames targets (filas con image_hash y width),
+    cada uno a partir del anterior. Devuelve por cada frame las cajas que siguen localizadas,
+    recortadas a la imagen, y se detiene cuando se han perdido todas o cambia el tamaño de
+    imagen (otra secuencia).
+    """
+    previous = load_gray(source.image_hash, source.width)
+    for target in targets:
+        current = load_gray(target.image_hash, target.width)
+        if current.shape != previous.shape:
+            return
+        tracked = [(box, _visible(box)) for box in track_boxes(previous, current, boxes) if box is not None]
+        boxes = [box for box, visible in tracked if visible is not None]
+        if not boxes:
+            return
+        yield [visible for _, visible in tracked if visible is not None]
+        previous = current
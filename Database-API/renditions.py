@@ -0,0 +1,83 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, features
+import blob_store
+
+RENDITION_SIZES = {
+    "thumb": int(os.getenv("RENDITION_THUMB_SIZE", 256)),
+    "preview": int(os.getenv("RENDITION_PREVIEW_SIZE", 1024)),
+}
+SIZES = ["original"] + list(RENDITION_SIZES)
+
+RENDITION_FORMAT = os.getenv("RENDITION_FORMAT", "WEBP" if features.check("webp") else "JPEG").upper()
+RENDITION_QUALITY = int(os.getenv("RENDITION_QUALITY", 80))
+# Generarlas al subir cuesta varias veces más que codificar el propio frame (la vista previa WebP
+# de un frame 1080p, ~100 ms), así que por defecto se crean al pedirlas por primera vez (ensure).
+RENDITIONS_AT_INGEST = os.getenv("RENDITIONS_AT_INGEST", "0") == "1"
+
+EXTENSIONS = {"WEBP": "webp", "JPEG": "jpg"}
+MIME_TYPE = {"WEBP": "image/webp", "JPEG": "image/jpeg"}[RENDITION_FORMAT]
+
+
+def rendition_path(digest: str, size: str) -> str:
+    """
+    Las versiones reducidas se guardan junto al original: <sha256>.<size>.<ext>.
+    """
+    return f"{blob_store.blob_path(digest)}.{size}.{EXTENSIONS[RENDITION_FORMAT]}"
+
+
+def _save(image: Image.Image, digest: str, size: str) -> str:
+    path = rendition_path(digest, size)
+    rendition = image.copy()
+    rendition.thumbnail((RENDITION_SIZES[size], RENDITION_SIZES[size]), Image.LANCZOS)
+    if rendition.mode not in ("RGB", "L"):
+        rendition = rendition.convert("RGB")
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    with os.fdopen(fd, "wb") as f:
+        rendition.save(f, RENDITION_FORMAT, quality=RENDITION_QUALITY)
+    os.replace(temp_path, path)
+    return path
+
+
+def generate_from_image(digest: str, image: Image.Image, sizes=None) -> None:
+    """
+    Genera las versiones que falten a partir de una imagen ya decodificada.
+    """
+    for size in sizes or RENDITION_SIZES:
+        if not os.path.exists(rendition_path(digest, size)):
+            _save(image, digest, size)
+
+
+def generate(digest: str, sizes=None) -> None:
+    sizes = [size for size in (sizes or RENDITION_SIZES) if not os.path.exists(rendition_path(digest, size))]
+    if not sizes:
+        return
+    with Image.open(blob_store.blob_path(digest)) as image:
+        image.draft("RGB", (max(RENDITION_SIZES[size] for size in sizes),) * 2)
+        generate_from_image(digest, image.convert("RGB"), sizes)
+
+
+def ensure(digest: str, size: str) -> str:
+    """
+    Devuelve la ruta de la versión pedida, generándola si todavía no existe.
+    """
+    if size == "original":
+        return blob_store.blob_path(digest)
+    path = rendition_path(digest, size)
+    if not os.path.exists(path):
+        generate(digest, [size])
+    return path
+
+
+def backfill(digests, workers: int = None) -> int:
+    """
+    Genera las versiones de todas las imágenes dadas con un pool de hilos
+    (PIL libera el GIL al decodificar y redimensionar).
+    """
+    generated = 0
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for _ in executor.map(generate, digests):
+            generated += 1
+    return generated
@@ -0,0 +1,150 @@
+from sqlalchemy import update, select, func, case, and_, or_, distinct
+from database import engine
+import models
+
+COUNTERS = ["total_images", "finished_images", "synthetic_images", "labeled_images"]
+# Contadores de los que depende Project.status.
+STATUS_COUNTERS = {"total_images", "finished_images", "labeled_images"}
+
+
+def create(db, project_id) -> models.ProjectStats:
+    stats = models.ProjectStats(project_id=project_id, last_frame_number=0, **{name: 0 for name in COUNTERS})
+    db.add(stats)
+    return stats
+
+
+def adjust(db, project_id, **deltas) -> None:
+    """
+    Suma los incrementos a los contadores con un UPDATE atómico (x = x + delta) dentro de
+    la transacción actual, así no se pierden cambios entre peticiones concurrentes. Si cambia
+    algún contador del que depende el estado del proyecto, lo recalcula en la misma transacción.
+    """
+    values = {
+        name: getattr(models.ProjectStats, name) + delta
+        for name, delta in deltas.items() if delta
+    }
+    if values:
+        db.execute(
+            update(models.ProjectStats)
+            .where(models.ProjectStats.project_id == project_id)
+            .values(**values)
+        )
+        if STATUS_COUNTERS & set(values):
+            refresh_status(db, project_id)
+
+
+def _upsert(table):
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def adjust_classes(db, project_id, deltas: dict) -> None:
+    """
+    Suma (cajas, frames) a los contadores de cada clase (class_id -> (cajas, frames)), creando
+    la fila de la clase si aún no existe, con un único INSERT ... ON CONFLICT DO UPDATE.
+    """
+    rows = [
+        {"project_id": project_id, "class_id": class_id, "boxes": boxes, "frames": frames}
+        for class_id, (boxes, frames) in deltas.items() if boxes or frames
+    ]
+    if rows:
+        table = models.ProjectClassStats
+        statement = _upsert(table).values(rows)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[table.project_id, table.class_id],
+            set_={
+                "boxes": table.boxes + statement.excluded.boxes,
+                "frames": table.frames + statement.excluded.frames
+            }
+        ))
+
+
+def refresh_status(db, project_id) -> None:
+    """
+    Deriva Project.status de los contadores: "Finished" cuando todos los frames están terminados,
+    "In Progress" en cuanto hay alguno terminado o etiquetado y "Not Started" en otro caso.
+    """
+    stats = models.ProjectStats
+    status = select(case(
+        (and_(stats.total_images > 0, stats.finished_images >= stats.total_images), "Finished"),
+        (or_(stats.finished_images > 0, stats.labeled_images > 0), "In Progress"),
+        else_="Not Started"
+    )).where(stats.project_id == project_id).scalar_subquery()
+    db.execute(
+        update(models.Project)
+        .where(models.Project.id == project_id)
+        .values(status=func.coalesce(status, models.Project.status))
+    )
+
+
+def recount(db, project_id) -> dict:
+    images = models.ImageEntry
+    total, finished, synthetic = db.query(
+        func.count(images.id),
+        func.count(images.id).filter(images.finished == True),
+        func.count(images.id).filter(images.synthetic == True)
+    ).filter(images.project_id == project_id).one()
+    labeled = db.query(func.count(distinct(models.Box.image_id))).filter(models.Box.project_id == project_id).scalar()
+    return {"total_images": total, "finished_images": finished, "synthetic_images": synthetic, "labeled_images": labeled}
+
+
+def reconcile(db, project_id) -> models.ProjectStats:
+    """
+    Recalcula desde cero los contadores del proyecto, los de cada clase y su estado, dentro de
+    la transacción actual.
+    """
+    stats = db.query(models.ProjectStats).filter(models.ProjectStats.project_id == project_id).first()
+    counters = recount(db, project_id)
+    if stats is None:
+        stats = models.ProjectStats(project_id=project_id, **counters)
+        db.add(stats)
+    else:
+        for name, value in counters.items():
+            setattr(stats, name, value)
+
+    db.query(models.ProjectClassStats).filter(models.ProjectClassStats.project_id == project_id).delete()
+    db.add_all(
+        models.ProjectClassStats(project_id=project_id, class_id=class_id, boxes=boxes, frames=frames)
+        for class_id, boxes, frames in db.query(
+            models.Box.class_id,
+            func.count(models.Box.id),
+            func.count(distinct(models.Box.image_id))
+        ).filter(models.Box.project_id == project_id).group_by(models.Box.class_id)
+    )
+    db.flush()
+    refresh_status(db, project_id)
+    return stats
+
+
+def get(db, project_id) -> models.ProjectStats:
+    """
+    Devuelve los contadores del proyecto. Los proyectos creados antes de existir la tabla (o
+    alguno de sus contadores) se reconcilian una sola vez y se guardan.
+    """
+    stats = db.query(models.ProjectStats).filter(models.ProjectStats.project_id == project_id).first()
+    if stats is None or stats.labeled_images is None:
+        stats = reconcile(db, project_id)
+        db.commit()
+    return stats
+
+
+def allocate_frames(db, project_id, count: int = 1) -> int:
+    """
+    Reserva count números de frame consecutivos y devuelve el primero. Es un único UPDATE
+    atómico sobre el contador del proyecto, así dos escrituras concurrentes nunca reciben el
+    mismo número. En proyectos sin contador se parte del mayor frame guardado.
+    """
+    get(db, project_id)
+    max_frame = select(func.max(models.ImageEntry.frame_number)).where(
+        models.ImageEntry.project_id == project_id
+    ).scalar_subquery()
+    last_frame = db.execute(
+        update(models.ProjectStats)
+        .where(models.ProjectStats.project_id == project_id)
+        .values(last_frame_number=func.coalesce(models.ProjectStats.last_frame_number, max_frame, 0) + count)
+        .returning(models.ProjectStats.last_frame_number)
+    ).scalar_one()
+    return last_frame - count + 1
@@ -0,0 +1,37 @@
+import importlib.util
+import os
+import sys
+import tempfile
+import pytest
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# La base de datos, los blobs y los ZIP temporales de las pruebas van a un directorio propio.
+# Se fija antes de importar nada de la API porque database y blob_store leen el entorno al importarse.
+WORK_DIR = tempfile.mkdtemp(prefix="pfg-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORK_DIR, 'test.db')}"
+os.environ["BLOB_STORE_PATH"] = os.path.join(WORK_DIR, "blobs")
+os.environ["INGEST_TEMP_PATH"] = os.path.join(WORK_DIR, "ingest")
+sys.path.insert(0, API_DIR)
+
+
+def load_api():
+    # El módulo de la API tiene un guion en el nombre, así que no se puede importar con import.
+    spec = importlib.util.spec_from_file_location("database_api", os.path.join(API_DIR, "Database-API.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def api():
+    return load_api()
+
+
+@pytest.fixture(scope="session")
+def client(api):
+    from fastapi.testclient import TestClient
+
+    with TestClient(api.app) as client:
+        client.post("/register", data={"email": "tests@example.com", "password": "tests"})
+        yield client
@@ -0,0 +1,59 @@
+"""
+El guardado de un frame desde el editor valida las clases, pero recorta las cajas que se salen
+de la imagen y descarta las que no tienen área en lugar de rechazar el frame entero.
+"""
+import json
+import uuid
+
+
+def _frame(project_labels: list) -> int:
+    from database import SessionLocal
+    import models
+    import stats
+
+    project_id = uuid.uuid4()
+    db = SessionLocal()
+    try:
+        db.add(models.Project(id=project_id, name="editor", owner="tests@example.com", labels=json.dumps(project_labels), colors="[]"))
+        stats.create(db, project_id)
+        image = models.ImageEntry(
+            project_id=project_id, image_name="frame_000001.jpg", image_hash="0" * 64, image_size=1, frame_number=1
+        )
+        db.add(image)
+        stats.adjust(db, project_id, total_images=1)
+        db.commit()
+        return image.id
+    finally:
+        db.close()
+
+
+def _saved_yolo(image_id: int) -> str:
+    from database import SessionLocal
+    import models
+
+    db = SessionLocal()
+    try:
+        return db.query(models.ImageEntry.yolo).filter(models.ImageEntry.id == image_id).scalar()
+    finally:
+        db.close()
+
+
+def test_editor_boxes_are_clipped_instead_of_rejected(client):
+    image_id = _frame(["car", "person"])
+    response = client.put(f"/update_annotations/{image_id}", json={"annotations": [
+        "0 0.500000 0.500000 0.000000 0.100000",
+        "1 0.950000 0.500000 0.200000 0.200000",
+        "0 1.200000 0.500000 0.100000 0.100000",
+        "0 0.500000 0.500000 0.200000 0.200000"
+    ], "finished": False})
+
+    assert response.status_code == 200
+    assert _saved_yolo(image_id) == "1 0.925000 0.500000 0.150000 0.200000\n0 0.500000 0.500000 0.200000 0.200000"
+
+
+def test_editor_save_still_checks_classes(client):
+    image_id = _frame(["car", "person"])
+    response = client.put(f"/update_annotations/{image_id}", json={"annotations": ["2 0.5 0.5 0.1 0.1"], "finished": False})
+
+    assert response.status_code == 400
+    assert _saved_yolo(image_id) is None
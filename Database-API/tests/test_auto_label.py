@@ -0,0 +1,64 @@
+"""
+El trabajo de autoetiquetado no retiene ninguna conexión de la base (ni una transacción abierta)
+mientras espera a YoloFSOD, que puede tardar horas entrenando, y guarda después el resultado.
+"""
+import uuid
+
+
+class _Response:
+    status_code = 200
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+def test_training_request_holds_no_database_connection(api, monkeypatch):
+    from database import SessionLocal, engine
+    import auto_label
+    import dataset_package
+    import jobs
+    import models
+    import stats
+
+    project_id = uuid.uuid4()
+    db = SessionLocal()
+    db.add(models.Project(id=project_id, name="auto", owner="tests@example.com", labels='["car"]', colors="[]"))
+    stats.create(db, project_id)
+    for frame_number in range(1, 9):
+        db.add(models.ImageEntry(
+            project_id=project_id, image_name=f"frame_{frame_number:06d}.jpg", image_hash=f"{frame_number:064x}",
+            image_size=1, frame_number=frame_number, finished=frame_number <= 6,
+            yolo="0 0.5 0.5 0.1 0.1" if frame_number <= 6 else None
+        ))
+    job = models.Job(project_id=project_id, kind="generate-dataset", status="running")
+    db.add(job)
+    db.commit()
+    job_id = job.id
+    db.close()
+
+    checked_out = []
+
+    def post(url, params, timeout, json):
+        checked_out.append(engine.pool.checkedout())
+        predict = json["splits"]["predict"]
+        return _Response({
+            "status": "success",
+            "predictions": [{"image": row["image"], "labels": [[0, 0.4, 0.4, 0.2, 0.2]]} for row in predict]
+        })
+
+    # Con el volumen compartido el manifiesto se genera entero antes de la petición.
+    monkeypatch.setattr(dataset_package, "FSOD_HANDOFF", "shared-volume")
+    monkeypatch.setattr(auto_label.requests, "post", post)
+    jobs._run(job_id)
+
+    assert checked_out == [0]
+    db = SessionLocal()
+    job = db.query(models.Job).filter(models.Job.id == job_id).first()
+    assert (job.status, job.message) == ("succeeded", "Dataset labeled successfully (2 frames)")
+    assert db.query(models.ImageEntry.yolo).filter(
+        models.ImageEntry.project_id == project_id, models.ImageEntry.frame_number == 7
+    ).scalar() == "0 0.400000 0.400000 0.200000 0.200000"
+    db.close()
@@ -0,0 +1,136 @@
+"""
+La descarga de /download/{project_id} se genera en streaming: la memoria del proceso no tiene que
+crecer con el tamaño del proyecto. Cada medida se hace en un proceso aparte (este mismo fichero
+ejecutado como script) para que el pico de memoria no dependa de lo que hayan hecho otras pruebas.
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import uuid
+import zipfile
+
+FRAME_SIZE = 256 * 1024
+SMALL_PROJECT_FRAMES = 100
+LARGE_PROJECT_FRAMES = 800
+# Margen para el ruido del asignador y de las cachés de SQLite entre las dos medidas.
+RSS_TOLERANCE = 32 * 1024 * 1024
+
+
+def _rss() -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+async def _download(app, path: str, destination) -> None:
+    # Se llama a la aplicación ASGI directamente: TestClient acumula la respuesta entera en memoria.
+    disconnected = asyncio.Event()
+
+    async def receive():
+        # StreamingResponse espera una desconexión mientras envía; el cliente no se va nunca.
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            assert message["status"] == 200
+        elif message["type"] == "http.response.body":
+            destination.write(message.get("body", b""))
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [], "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80)
+    }
+    await app(scope, receive, send)
+
+
+def measure(frames: int, frame_size: int = FRAME_SIZE) -> dict:
+    """
+    Crea un proyecto de frames aleatorios (incompresibles), lo descarga por /download y devuelve
+    el pico de RSS por encima del que había antes de empezar la descarga.
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import conftest
+
+    api = conftest.load_api()
+    from sqlalchemy import insert
+    from database import SessionLocal
+    import blob_store
+    import models
+
+    project_id = uuid.uuid4()
+    db = SessionLocal()
+    db.add(models.Project(id=project_id, name="export", owner="tests@example.com", labels='["a"]', colors='["#f00"]'))
+    rows = []
+    for frame_number in range(1, frames + 1):
+        rows.append({
+            "project_id": project_id,
+            "image_name": f"frame_{frame_number:06d}.jpg",
+            "frame_number": frame_number,
+            "image_hash": blob_store.put(os.urandom(frame_size)),
+            "image_size": frame_size,
+            "yolo": "0 0.500000 0.500000 0.100000 0.100000"
+        })
+    db.execute(insert(models.ImageEntry), rows)
+    db.commit()
+    db.close()
+    del rows
+
+    baseline = _rss()
+    peak = [baseline]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.005):
+            peak[0] = max(peak[0], _rss())
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    with tempfile.NamedTemporaryFile(suffix=".zip") as archive:
+        try:
+            asyncio.run(_download(api.app, f"/download/{project_id}", archive))
+        finally:
+            done.set()
+            sampler.join()
+        archive.flush()
+        with zipfile.ZipFile(archive.name) as zip_file:
+            return {
+                "archive_bytes": os.path.getsize(archive.name),
+                "entries": len(zip_file.namelist()),
+                "corrupt_member": zip_file.testzip(),
+                "peak_growth": peak[0] - baseline
+            }
+
+
+def _measure_in_subprocess(frames: int) -> dict:
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), str(frames)],
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_download_memory_does_not_grow_with_project_size():
+    small = _measure_in_subprocess(SMALL_PROJECT_FRAMES)
+    large = _measure_in_subprocess(LARGE_PROJECT_FRAMES)
+
+    for result, frames in ((small, SMALL_PROJECT_FRAMES), (large, LARGE_PROJECT_FRAMES)):
+        assert result["corrupt_member"] is None
+        # Una imagen y una etiqueta por frame, más data.yaml.
+        assert result["entries"] == 2 * frames + 1
+        assert result["archive_bytes"] > frames * FRAME_SIZE
+
+    # 8 veces más datos (200 MiB frente a 25 MiB) sin que el pico de memoria crezca con ellos.
+    assert large["peak_growth"] < small["peak_growth"] + RSS_TOLERANCE
+    assert large["peak_growth"] < large["archive_bytes"] / 4
+
+
+if __name__ == "__main__":
+    print(json.dumps(measure(int(sys.argv[1]))))
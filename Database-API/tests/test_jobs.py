@@ -0,0 +1,38 @@
+"""
+Al arrancar, una instancia de la API solo recupera los trabajos que tenía ella (o los de antes de
+existir Job.owner): las subidas que está procesando otra instancia con la misma base siguen en marcha.
+"""
+import os
+import uuid
+
+
+def test_recovery_leaves_other_instances_jobs_alone(api):
+    from database import SessionLocal
+    import ingest
+    import jobs
+    import models
+
+    db = SessionLocal()
+    owners = {"mine": jobs.INSTANCE_ID, "other": "another-api-instance", "legacy": None}
+    job_ids = {}
+    for name, owner in owners.items():
+        # Cada trabajo en su propio proyecto: solo puede haber una subida activa por proyecto.
+        job_project = uuid.uuid4()
+        db.add(models.Project(id=job_project, name=name, owner="tests@example.com", labels="[]", colors="[]"))
+        job = models.Job(project_id=job_project, kind="upload", status="running", owner=owner)
+        db.add(job)
+        db.flush()
+        job_ids[name] = job.id
+        open(ingest.spool_path(job.id), "wb").close()
+    db.commit()
+    db.close()
+
+    jobs.recover_interrupted()
+
+    db = SessionLocal()
+    status = {name: db.query(models.Job.status).filter(models.Job.id == job_id).scalar() for name, job_id in job_ids.items()}
+    db.close()
+    assert status == {"mine": "failed", "other": "running", "legacy": "failed"}
+    assert {name: os.path.exists(ingest.spool_path(job_id)) for name, job_id in job_ids.items()} == {
+        "mine": False, "other": True, "legacy": False
+    }
@@ -0,0 +1,153 @@
+"""
+Los contadores de project_stats y project_class_stats se mantienen de forma incremental en cada
+escritura. Tras una mezcla aleatoria de ediciones (sueltas, por lotes, concurrentes) y frames
+sintéticos, tienen que coincidir con un recuento completo desde images y boxes.
+"""
+import io
+import random
+import threading
+import time
+import zipfile
+from PIL import Image
+
+LABELS = ["car", "person", "bike"]
+FRAMES = 30
+
+
+def _jpeg(color) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def _random_annotations(rng: random.Random) -> list:
+    return [
+        f"{rng.randrange(len(LABELS))} {rng.uniform(0.2, 0.8):.6f} {rng.uniform(0.2, 0.8):.6f} 0.100000 0.100000"
+        for _ in range(rng.randrange(4))
+    ]
+
+
+def _upload_project(client) -> str:
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        for index in range(FRAMES):
+            zip_file.writestr(f"frames/img{index:03d}.jpg", _jpeg((index * 8, 40, 90)))
+            if index % 3 == 0:
+                zip_file.writestr(f"frames/img{index:03d}.txt", f"{index % len(LABELS)} 0.5 0.5 0.2 0.2")
+
+    response = client.post(
+        "/upload",
+        data={"project_name": "stats", "project_owner": "tests@example.com", "labels": LABELS, "colors": ["#f00", "#0f0", "#00f"]},
+        files={"folder": ("stats.zip", archive.getvalue())}
+    )
+    assert response.status_code == 200
+    job_id = response.json()["job_id"]
+    deadline = time.monotonic() + 60
+    while client.get(f"/jobs/{job_id}").json()["status"] in ("queued", "running"):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert client.get(f"/jobs/{job_id}").json()["status"] == "succeeded"
+    return response.json()["project_id"]
+
+
+def _recount(project_id: str) -> tuple:
+    from uuid import UUID
+    from sqlalchemy import func, distinct
+    from database import SessionLocal
+    import models
+    import stats
+
+    db = SessionLocal()
+    try:
+        counters = stats.recount(db, UUID(project_id))
+        classes = {
+            class_id: (boxes, frames)
+            for class_id, boxes, frames in db.query(
+                models.Box.class_id,
+                func.count(models.Box.id),
+                func.count(distinct(models.Box.image_id))
+            ).filter(models.Box.project_id == UUID(project_id)).group_by(models.Box.class_id)
+        }
+    finally:
+        db.close()
+    return counters, classes
+
+
+def _expected_status(counters: dict) -> str:
+    if counters["total_images"] and counters["finished_images"] >= counters["total_images"]:
+        return "Finished"
+    if counters["finished_images"] or counters["labeled_images"]:
+        return "In Progress"
+    return "Not Started"
+
+
+def _assert_matches_recount(client, project_id: str) -> None:
+    served = client.get(f"/project/{project_id}/stats").json()
+    counters, classes = _recount(project_id)
+
+    assert {name: served[name] for name in counters} == counters
+    assert {row["class_id"]: (row["boxes"], row["frames"]) for row in served["classes"]} == classes
+    assert served["status"] == _expected_status(counters)
+
+
+def test_incremental_stats_match_full_recount(client):
+    rng = random.Random(21)
+    project_id = _upload_project(client)
+    _assert_matches_recount(client, project_id)
+
+    images = client.get(f"/project/{project_id}/images", params={"limit": 1000, "image_mode": "url"}).json()["images"]
+    image_ids = [image["id"] for image in images]
+    assert len(image_ids) == FRAMES
+
+    for _ in range(40):
+        response = client.put(f"/update_annotations/{rng.choice(image_ids)}", json={
+            "annotations": _random_annotations(rng), "finished": rng.random() < 0.5
+        })
+        assert response.status_code == 200
+
+    for _ in range(5):
+        items = [
+            {"frame_number": frame_number, "annotations": _random_annotations(rng), "finished": rng.random() < 0.5}
+            for frame_number in rng.sample(range(1, FRAMES + 1), 10)
+        ]
+        assert client.put(f"/project/{project_id}/annotations", json={"items": items}).json()["failed"] == 0
+    _assert_matches_recount(client, project_id)
+
+    # Varios hilos guardando a la vez, a menudo sobre los mismos frames.
+    failures = []
+
+    def edit(seed: int) -> None:
+        thread_rng = random.Random(seed)
+        for _ in range(15):
+            image_id = thread_rng.choice(image_ids[:8])
+            response = client.put(f"/update_annotations/{image_id}", json={
+                "annotations": _random_annotations(thread_rng), "finished": thread_rng.random() < 0.5
+            })
+            if response.status_code != 200:
+                failures.append(response.status_code)
+
+    threads = [threading.Thread(target=edit, args=(seed,)) for seed in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert failures == []
+    _assert_matches_recount(client, project_id)
+
+    for index in range(3):
+        response = client.post("/synthetic", params={"project_id": project_id}, files={"file": (f"s{index}.png", _jpeg((200, 0, index)))})
+        assert response.status_code == 200
+    draft = client.post(
+        f"/project/{project_id}/synthetic-drafts",
+        data={"source_image_id": image_ids[0]},
+        files={"file": ("draft.png", _jpeg((0, 200, 0)))}
+    ).json()
+    assert client.post(f"/synthetic-drafts/{draft['draft_id']}/accept").json()["image_id"] is not None
+    _assert_matches_recount(client, project_id)
+
+    # Terminar todos los frames lleva el proyecto a "Finished".
+    frames = client.get(f"/project/{project_id}/images", params={"limit": 1000, "image_mode": "url"}).json()["images"]
+    items = [{"image_id": image["id"], "annotations": ["0 0.5 0.5 0.1 0.1"], "finished": True} for image in frames]
+    assert client.put(f"/project/{project_id}/annotations", json={"items": items}).json()["failed"] == 0
+    _assert_matches_recount(client, project_id)
+    assert client.get(f"/project/{project_id}/stats").json()["status"] == "Finished"
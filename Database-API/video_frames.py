@@ -0,0 +1,288 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from PIL import Image
+import blob_store
+import renditions
+
+VIDEO_WORKERS = int(os.getenv("VIDEO_WORKERS", os.cpu_count() or 1))
+MIN_SEGMENT_FRAMES = int(os.getenv("VIDEO_MIN_SEGMENT_FRAMES", 600))
+JPEG_QUALITY = int(os.getenv("VIDEO_JPEG_QUALITY", 95))
+
+# "interval" conserva uno de cada fps/10 frames; "scene" solo los que cambian respecto al último conservado.
+SAMPLING_MODES = ("interval", "scene")
+VIDEO_SAMPLING = os.getenv("VIDEO_SAMPLING", "interval")
+# Fracción de bits del hash perceptual que tienen que cambiar para conservar un frame.
+SCENE_THRESHOLD = float(os.getenv("VIDEO_SCENE_THRESHOLD", 0.1))
+SCENE_HASH_SIZE = int(os.getenv("VIDEO_SCENE_HASH_SIZE", 16))
+# Segundos mínimos entre dos frames conservados, y máximos sin conservar ninguno (0 = sin máximo).
+SCENE_MIN_GAP = float(os.getenv("VIDEO_SCENE_MIN_GAP", 0.5))
+SCENE_MAX_GAP = float(os.getenv("VIDEO_SCENE_MAX_GAP", 10))
+# Máximo de frames conservados por vídeo (0 = sin límite).
+SCENE_MAX_FRAMES = int(os.getenv("VIDEO_SCENE_MAX_FRAMES", 2000))
+
+_executor = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    # "spawn" porque el proceso de la API tiene hilos y un fork podría heredar locks cogidos.
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=VIDEO_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+def frame_interval(fps: float) -> int:
+    if not fps or fps <= 0:
+        fps = 30
+    return int(fps / 10) if fps >= 10 else 1
+
+
+def probe(video_path: str) -> tuple:
+    """
+    Devuelve (fps, número de frames) según los metadatos del contenedor. El número
+    de frames puede ser 0 o aproximado.
+    """
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return fps, max(frame_count, 0)
+
+
+def plan_segments(frame_count: int, interval: int, workers: int = VIDEO_WORKERS) -> list:
+    """
+    Divide el vídeo en rangos [inicio, fin) alineados con el intervalo de muestreo para
+    que cada worker conserve exactamente los mismos frames que una lectura secuencial.
+    El último rango queda abierto (fin None) porque el número de frames no es fiable.
+    """
+    segments = min(workers, frame_count // MIN_SEGMENT_FRAMES) if frame_count else 1
+    if segments <= 1:
+        return [(0, None)]
+
+    step = -(-frame_count // segments)
+    step += -step % interval
+    bounds = list(range(0, frame_count, step))
+    return [(start, bounds[i + 1] if i + 1 < len(bounds) else None) for i, start in enumerate(bounds)]
+
+
+def scene_options(fps: float, interval: int, frame_count: int) -> dict:
+    """
+    Parámetros del muestreo por escenas, con los huecos pasados de segundos a frames. Si el vídeo
+    tiene más frames de los que caben en el presupuesto, se separan más los frames conservados.
+    """
+    if not fps or fps <= 0:
+        fps = 30
+    min_gap = max(interval, round(SCENE_MIN_GAP * fps))
+    if SCENE_MAX_FRAMES and frame_count:
+        min_gap = max(min_gap, -(-frame_count // SCENE_MAX_FRAMES))
+    return {
+        "threshold": SCENE_THRESHOLD,
+        "hash_size": SCENE_HASH_SIZE,
+        "min_gap": min_gap,
+        "max_gap": max(min_gap, round(SCENE_MAX_GAP * fps)) if SCENE_MAX_GAP > 0 else None,
+        "max_frames": SCENE_MAX_FRAMES
+    }
+
+
+def perceptual_hash(frame, hash_size: int = SCENE_HASH_SIZE) -> np.ndarray:
+    """
+    dHash del frame: en una versión reducida en grises, si cada píxel es más claro que su vecino
+    de la derecha (hash_size² bits).
+    """
+    small = cv2.resize(frame, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    return (gray[:, 1:] > gray[:, :-1]).ravel()
+
+
+class SceneFilter:
+    """
+    Decide qué frames candidatos se conservan comparando su hash perceptual con el del último
+    conservado, no con el candidato anterior, para que un cambio lento también acabe contando.
+    """
+
+    def __init__(self, threshold: float, hash_size: int, min_gap: int, max_gap, **_):
+        self.threshold = threshold
+        self.hash_size = hash_size
+        self.min_gap = min_gap
+        self.max_gap = max_gap
+        self.last_index = None
+        self.last_hash = None
+
+    def due(self, frame_idx: int) -> bool:
+        """
+        Si el frame está lo bastante lejos del último conservado como para decodificarlo.
+        """
+        return self.last_index is None or frame_idx - self.last_index >= self.min_gap
+
+    def keep(self, frame_idx: int, frame) -> bool:
+        frame_hash = perceptual_hash(frame, self.hash_size)
+        if self.last_index is not None:
+            changed = np.count_nonzero(frame_hash != self.last_hash) >= self.threshold * frame_hash.size
+            stale = self.max_gap is not None and frame_idx - self.last_index >= self.max_gap
+            if not changed and not stale:
+                return False
+        self.last_index = frame_idx
+        self.last_hash = frame_hash
+        return True
+
+
+def _seek(cap, start: int) -> None:
+    if start == 0:
+        return
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    if position != start:
+        # El backend no sabe buscar con precisión: se avanza con grab(), que no convierte los frames.
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        for _ in range(start):
+            if not cap.grab():
+                break
+
+
+def _store_frame(frame, timestamp) -> dict:
+    _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    height, width = frame.shape[:2]
+    image_fields = blob_store.store_image(buffer.tobytes(), width=width, height=height, mime_type="image/jpeg")
+    if renditions.RENDITIONS_AT_INGEST:
+        renditions.generate_from_image(
+            image_fields["image_hash"],
+            Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        )
+    image_fields["source_timestamp"] = timestamp
+    return image_fields
+
+
+def extract_segment(video_path: str, start: int, end: int, interval: int, fps: float = None, scene: dict = None) -> tuple:
+    """
+    Extrae los frames con índice múltiplo de interval en [start, end), los guarda en el
+    almacén de blobs como JPEG y devuelve (columnas de ImageEntry en orden, candidatos
+    descartados). Con scene solo se conservan los candidatos que pasan el SceneFilter; el primer
+    candidato del segmento se conserva siempre.
+    Los frames descartados solo se pasan con grab(), sin retrieve() ni conversión de color.
+    """
+    cap = cv2.VideoCapture(video_path)
+    _seek(cap, start)
+    scene_filter = SceneFilter(**scene) if scene else None
+
+    frames = []
+    dropped = 0
+    frame_idx = start
+    while end is None or frame_idx < end:
+        if not cap.grab():
+            break
+        if frame_idx % interval == 0:
+            if scene_filter and not scene_filter.due(frame_idx):
+                dropped += 1
+            else:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                if scene_filter is None or scene_filter.keep(frame_idx, frame):
+                    frames.append(_store_frame(frame, round(frame_idx / fps, 3) if fps and fps > 0 else None))
+                else:
+                    dropped += 1
+        frame_idx += 1
+
+    cap.release()
+    return frames, dropped
+
+
+def extract_frames(video_path: str, executor=None, sampling: str = "interval", report: dict = None):
+    """
+    Reparte el vídeo en segmentos entre los procesos del pool y va devolviendo los
+    frames conservados en el orden original. Si se pasa report, suma en report["dropped"]
+    los frames candidatos que el muestreo por escenas ha descartado.
+    El muestreo por escenas compara cada frame con el último conservado, que un segmento no
+    conoce hasta que termina el anterior, así que se hace en un único segmento: los frames
+    conservados no dependen de VIDEO_WORKERS.
+    """
+    fps, frame_count = probe(video_path)
+    interval = frame_interval(fps)
+    scene = scene_options(fps, interval, frame_count) if sampling == "scene" else None
+    segments = [(0, None)] if scene else plan_segments(frame_count, interval)
+
+    if len(segments) == 1 and executor is None:
+        results = [extract_segment(video_path, 0, None, interval, fps, scene)]
+    else:
+        executor = executor or get_executor()
+        futures = [executor.submit(extract_segment, video_path, start, end, interval, fps, scene) for start, end in segments]
+        results = (future.result() for future in futures)
+
+    kept = 0
+    for frames, dropped in results:
+        # El presupuesto ya separa los frames al planificar; esto solo corta si el número de
+        # frames del contenedor era incorrecto.
+        if scene and scene["max_frames"] and kept + len(frames) > scene["max_frames"]:
+            dropped += kept + len(frames) - scene["max_frames"]
+            frames = frames[:scene["max_frames"] - kept]
+        kept += len(frames)
+        if report is not None:
+            report["dropped"] = report.get("dropped", 0) + dropped
+        yield from frames
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    import time
+
+    parser = argparse.ArgumentParser(description="Benchmark video frame extraction on a synthetic video")
+    parser.add_argument("--frames", type=int, default=3000)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--sampling", choices=SAMPLING_MODES, default="interval")
+    args = parser.parse_args()
+
+    width, height = map(int, args.size.split("x"))
+    work_dir = tempfile.mkdtemp()
+    video_path = os.path.join(work_dir, "synthetic.mp4")
+
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"mp4v"), args.fps, (width, height))
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    for i in range(args.frames):
+        frame = np.roll(background, i * 4, axis=1)
+        cv2.putText(frame, str(i), (50, 100), cv2.FONT_HERSHEY_SIMPLEX, 3, (255, 255, 255), 5)
+        writer.write(frame)
+    writer.release()
+
+    def sequential():
+        # Guarda cada frame igual que los workers (_store_frame), así solo se compara la lectura.
+        cap = cv2.VideoCapture(video_path)
+        interval = frame_interval(cap.get(cv2.CAP_PROP_FPS))
+        frames, frame_idx = [], 0
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if frame_idx % interval == 0:
+                frames.append(_store_frame(frame, None)["image_hash"])
+            frame_idx += 1
+        return frames
+
+    # Cada pasada escribe en su propio almacén, así ninguna encuentra ya guardados los frames de la otra.
+    blob_store.BLOB_ROOT = os.path.join(work_dir, "blobs-sequential")
+    started = time.perf_counter()
+    baseline = sequential()
+    baseline_time = time.perf_counter() - started
+
+    # Los workers del pool (spawn) importan blob_store de nuevo y leen la ruta del entorno.
+    os.environ["BLOB_STORE_PATH"] = blob_store.BLOB_ROOT = os.path.join(work_dir, "blobs-parallel")
+    get_executor().submit(int).result()
+    started = time.perf_counter()
+    report = {}
+    parallel = list(extract_frames(video_path, get_executor(), args.sampling, report))
+    parallel_time = time.perf_counter() - started
+
+    summary = f"video: {args.frames} frames {width}x{height}@{args.fps}fps, kept {len(parallel)} frames ({args.sampling}, {report['dropped']} dropped)"
+    if args.sampling == "interval":
+        summary += f", identical to sequential: {[frame['image_hash'] for frame in parallel] == baseline}"
+    print(summary)
+    print(f"sequential read(): {args.frames / baseline_time:8.1f} source frames/s ({baseline_time:.2f}s)")
+    print(f"parallel grab():   {args.frames / parallel_time:8.1f} source frames/s ({parallel_time:.2f}s, {VIDEO_WORKERS} workers)")
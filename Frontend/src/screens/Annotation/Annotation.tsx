@@ -787,29 +787,58 @@ export const Annotation = () => {
     }
   };
 
+  const waitForJob = (jobId: string) =>
+    new Promise<any>((resolve, reject) => {
+      const events = new EventSource(`http://localhost:8000/jobs/${jobId}/events`);
+      events.addEventListener("progress", (event) => {
+        const job = JSON.parse((event as MessageEvent).data);
+        if (["succeeded", "failed", "cancelled"].includes(job.status)) {
+          events.close();
+          resolve(job);
+        }
+      });
+      events.onerror = () => {
+        events.close();
+        reject(new Error("Lost connection while waiting for the labeling job"));
+      };
+    });
+
   const handleStart = async () => {
     if (!project_id) return;
 
     setIsLoading(true);
 
     try {
-      const response = await axios.post(`http://localhost:8000/project/${project_id}/generate-dataset`);
+      const response = await axios.post(
+        `http://localhost:8000/project/${project_id}/generate-dataset`,
+        null,
+        { headers: { "Idempotency-Key": crypto.randomUUID() } }
+      );
 
-      if (response.data === "Dataset labeled successfully") {
+      const job = await waitForJob(response.data.job_id);
+
+      if (job.status === "succeeded") {
         window.location.reload();
-      } else if (typeof response.data === "string" && response.data.startsWith("Not enough finished images")) {
-        const match = response.data.match(/just (\d+) provided/);
-        const missingImages = match ? parseInt(match[1]) : 0;
+      } else if (job.status === "failed") {
+        showNotification("An error occurred while generating the dataset.", "error", <Trash className="w-16 h-16" />);
+      }
+    } catch (error: any) {
+      const detail = error.response?.data?.detail;
+      if (error.response?.status === 400 && typeof detail === "string" && detail.startsWith("Not enough finished images")) {
+        const match = detail.match(/just \((\d+) provided\)/);
+        const finishedImages = match ? parseInt(match[1]) : 0;
 
         showNotification(
-          `You have to check as finished at least ${missingImages} more images.`,
+          `You have to check as finished at least ${5 - finishedImages} more images.`,
           "error",
           <Trash className="w-16 h-16" />
         );
+      } else if (error.response?.status === 409) {
+        showNotification("Automatic labeling is already running for this project.", "error", <Trash className="w-16 h-16" />);
+      } else {
+        console.error("Error generating dataset:", error);
+        showNotification("An error occurred while generating the dataset.", "error", <Trash className="w-16 h-16" />);
       }
-    } catch (error) {
-      console.error("Error generating dataset:", error);
-      showNotification("An error occurred while generating the dataset.", "error", <Trash className="w-16 h-16" />);
     } finally {
       setIsLoading(false);
     }
@@ -50,6 +50,8 @@ export const ImageEditor = () => {
   const [isToolboxExpanded, setIsToolboxExpanded] = useState(false);
   const [showPopup, setShowPopup] = useState(false);
   const [popupImage, setPopupImage] = useState<string | null>(null);
+  const [draftId, setDraftId] = useState<string | null>(null);
+  const [currentImageId, setCurrentImageId] = useState<number | null>(null);
   const [isSaving, setIsSaving] = useState(false);
   const [isStarting, setIsStarting] = useState(false);
 
@@ -241,6 +243,7 @@ export const ImageEditor = () => {
     try {
       const response = await axios.get(`http://localhost:8000/project/${project_id}/image/${frameNumber}`);
       const data = response.data as ImageDataResponse;
+      setCurrentImageId(data.image_id);
 
       const imageFormat = data.format || 'jpeg';
       const imageBase64 = data.image;
@@ -305,17 +308,20 @@ export const ImageEditor = () => {
       formData.append('prompt', prompt);
       formData.append('image', imageBlob, 'image.png');
       formData.append('mask', maskBlob, 'mask.png');
+      // El servicio guarda el resultado directamente en el proyecto como borrador.
+      if (project_id) formData.append('project_id', project_id);
+      if (currentImageId !== null) formData.append('source_image_id', String(currentImageId));
 
       const response = await axios.post('http://localhost:5002/inpainting', formData, {
-        headers: { 'Content-Type': 'multipart/form-data' },
-        responseType: 'blob'
+        headers: { 'Content-Type': 'multipart/form-data' }
       });
 
       setShowPopup(true);
 
-      const generatedImage = URL.createObjectURL(response.data as Blob);
-      console.log('Generated Image URL:', generatedImage);
-      setPopupImage(generatedImage);
+      const draft = response.data.draft;
+      setDraftId(draft.draft_id);
+      // image_url es una ruta relativa a la API.
+      setPopupImage(`http://localhost:8000${draft.image_url}`);
     } catch (error) {
       console.error('Error during inpainting:', error);
     } finally {
@@ -354,22 +360,14 @@ export const ImageEditor = () => {
   };
 
   const handleSave = async () => {
-    if (!popupImage || !project_id) return;
+    if (!draftId) return;
 
     setIsSaving(true);
 
     try {
-      const response = await fetch(popupImage);
-      const imageBlob = await response.blob();
-
-      const formData = new FormData();
-      formData.append('file', imageBlob, 'synthetic_image.png');
-
-      await axios.post(`http://localhost:8000/synthetic?project_id=${project_id}`, formData, {
-        headers: { 'Content-Type': 'multipart/form-data' },
-      });
-
+      await axios.post(`http://localhost:8000/synthetic-drafts/${draftId}/accept`);
       setShowPopup(false);
+      setDraftId(null);
     } catch (error) {
       console.error('Error saving synthetic image:', error);
     } finally {
@@ -377,6 +375,19 @@ export const ImageEditor = () => {
     }
   };
 
+  const handleDiscard = async () => {
+    setShowPopup(false);
+    if (!draftId) return;
+
+    try {
+      await axios.post(`http://localhost:8000/synthetic-drafts/${draftId}/reject`);
+    } catch (error) {
+      console.error('Error discarding synthetic image:', error);
+    } finally {
+      setDraftId(null);
+    }
+  };
+
   const transformStyle = {
     transform: `translate(${pan.x}px, ${pan.y}px) scale(${zoom})`,
     transformOrigin: 'top left',
@@ -648,7 +659,7 @@ export const ImageEditor = () => {
               <Button
                 variant="outline"
                 className="bg-red-600 text-white"
-                onClick={() => setShowPopup(false)}
+                onClick={handleDiscard}
               >
                 Delete
               </Button>
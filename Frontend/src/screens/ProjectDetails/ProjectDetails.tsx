@@ -30,7 +30,7 @@ export const ProjectDetails = () => {
   const [tags, setTags] = useState<any[]>([]);
   const [images, setImages] = useState<any[]>([]);
   const [loading, setLoading] = useState(false);
-  const [skip, setSkip] = useState(0);
+  const [cursor, setCursor] = useState<number | null>(null);
   const [hasMore, setHasMore] = useState(true);
   const limit = 6;
   const [showSharePopup, setShowSharePopup] = useState(false);
@@ -123,25 +123,27 @@ export const ProjectDetails = () => {
 
     setLoading(true);
 
-    let localSkip = skip;
+    let localCursor = cursor;
 
     for (let i = 0; i < 3; i++) {
       try {
-        const response = await axios.get<{ images: any[] }>(
+        const response = await axios.get<{ images: any[]; next_cursor: number | null }>(
           `http://localhost:8000/project/${projectId}/images`,
           {
             params: {
-              skip: localSkip,
+              ...(localCursor !== null && { after: localCursor }),
               limit,
+              image_mode: 'url',
+              size: 'thumb',
             },
           }
         );
 
         const newImages = response.data.images ?? [];
         setImages((prev) => [...prev, ...newImages]);
-        localSkip += limit;
+        localCursor = response.data.next_cursor;
 
-        if (newImages.length < limit) {
+        if (localCursor === null) {
           setHasMore(false);
           break;
         }
@@ -155,7 +157,7 @@ export const ProjectDetails = () => {
       }
     }
 
-    setSkip(localSkip);
+    setCursor(localCursor);
     setLoading(false);
   };
 
@@ -492,7 +494,7 @@ export const ProjectDetails = () => {
                 onDoubleClick={() => navigate(`/annotation/${projectId}/${img.frame_number}`)}
               >
                 <img
-                  src={`data:image/jpeg;base64,${img.image}`}
+                  src={img.image_url}
                   alt={img.image_name}
                   className="aspect-square object-cover rounded-lg mb-2 w-full"
                 />
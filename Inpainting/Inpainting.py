@@ -1,51 +1,130 @@
 from flask import Flask, request, jsonify, send_file
 from PIL import Image
-import torch
 import io
-from diffusers import AutoPipelineForInpainting
+import os
+import threading
 from flask_cors import CORS
+from model_manager import ModelManager, DEFAULT_MODEL_ID, ALLOWED_MODEL_IDS
+from inpainting_queue import InpaintingWorker, InpaintingTask, QueueFull
+import inpainting_cache
 
 app = Flask(__name__)
 CORS(app)
 
+# "1": el modelo por defecto se carga y se calienta al arrancar; "0": en la primera petición.
+PRELOAD = os.getenv("INPAINTING_PRELOAD", "1") == "1"
+SYNC_TIMEOUT = float(os.getenv("INPAINTING_SYNC_TIMEOUT", 300))
+
+models = ModelManager()
+worker = InpaintingWorker(models)
+warmed_up = threading.Event()
+
+def preload():
+    try:
+        models.warmup(DEFAULT_MODEL_ID)
+        warmed_up.set()
+    except Exception as e:
+        app.logger.error(f"Could not load {DEFAULT_MODEL_ID}: {e}")
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """
+    Indica si el servicio puede atender peticiones sin esperar a cargar el modelo por defecto.
+    """
+    status = models.status()
+    is_ready = warmed_up.is_set() if PRELOAD else DEFAULT_MODEL_ID not in status["errors"]
+    return jsonify({"ready": is_ready, "model_id": DEFAULT_MODEL_ID, **status}), 200 if is_ready else 503
+
+def png_response(data):
+    return send_file(io.BytesIO(data), mimetype='image/png')
+
 @app.route("/inpainting", methods=["POST"])
 def inpainting():
+    """
+    Encola la petición para el worker del dispositivo. Por defecto espera al resultado (como
+    mucho 'timeout' segundos) y devuelve el PNG; con wait=false responde 202 con el job_id
+    para consultarlo en /jobs/<job_id>. Si la cola está llena responde 429.
+    Una petición idéntica a otra ya calculada se responde desde la caché de resultados.
+    Con 'project_id' (y opcionalmente 'source_image_id') el resultado se guarda directamente en
+    la Database-API como borrador y se devuelve el borrador en lugar del PNG.
+    """
     try:
         prompt = request.form["prompt"]
         image_file = request.files["image"]
         mask_file = request.files["mask"]
 
-        init_image = Image.open(image_file).convert("RGB")
-        mask_image = Image.open(mask_file).convert("L")
+        model_id = request.form.get("model_id", DEFAULT_MODEL_ID)
+        if model_id not in ALLOWED_MODEL_IDS:
+            return jsonify({"error": f"Model {model_id} is not available"}), 400
 
-        model_id = "stabilityai/stable-diffusion-2-inpainting"
+        image_bytes = image_file.read()
+        mask_bytes = mask_file.read()
+        steps = int(request.form.get("steps", 30))
+        persist = {
+            "project_id": request.form.get("project_id"),
+            "source_image_id": request.form.get("source_image_id")
+        }
+        cache_key = inpainting_cache.result_key(model_id, image_bytes, mask_bytes, prompt, steps=steps)
 
-        pipeline = AutoPipelineForInpainting.from_pretrained(
-            model_id,
-            torch_dtype=torch.float16,
-            variant="fp16"
-        ).to("cuda")
+        cached = inpainting_cache.results.get(cache_key)
+        if cached is not None:
+            task = worker.add_finished(
+                InpaintingTask(model_id, prompt, None, None, steps=steps, cache_key=cache_key, **persist),
+                cached
+            )
+        else:
+            task = worker.submit(InpaintingTask(
+                model_id,
+                prompt,
+                Image.open(io.BytesIO(image_bytes)).convert("RGB"),
+                Image.open(io.BytesIO(mask_bytes)).convert("L"),
+                steps=steps,
+                cache_key=cache_key,
+                **persist
+            ))
 
-        generator = torch.Generator("cuda").manual_seed(92)
+    except QueueFull:
+        return jsonify({"error": "Inpainting queue is full, try again later"}), 429, {"Retry-After": "5"}
 
-        result = pipeline(
-            prompt=prompt,
-            num_inference_steps=30,
-            image=init_image,
-            mask_image=mask_image,
-            generator=generator,
-            strength=0.85,
-            guidance_scale=10.0,
-            padding_mask_crop=3
-        ).images[0]
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
 
-        img_io = io.BytesIO()
-        result.save(img_io, 'PNG')
-        img_io.seek(0)
-        return send_file(img_io, mimetype='image/png')
+    if request.form.get("wait", "true").lower() == "false":
+        return jsonify(task.to_dict()), 202
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    if not task.done.wait(float(request.form.get("timeout", SYNC_TIMEOUT))):
+        return jsonify({**task.to_dict(), "error": "Timed out waiting for the result"}), 504
+    if task.status == "failed":
+        return jsonify({"error": task.error}), 500
+    if task.draft:
+        return jsonify(task.to_dict())
+    return png_response(task.result)
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    task = worker.get(job_id)
+    if not task:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(task.to_dict())
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    task = worker.get(job_id)
+    if not task:
+        return jsonify({"error": "Job not found"}), 404
+    if task.status == "failed":
+        return jsonify({"error": task.error}), 500
+    if task.status != "succeeded":
+        return jsonify(task.to_dict()), 202
+    return png_response(task.result)
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return jsonify({**worker.stats(), "caches": inpainting_cache.stats()})
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5002, debug=True)
\ No newline at end of file
+    if PRELOAD:
+        threading.Thread(target=preload, daemon=True).start()
+    worker.start()
+    # Sin el recargador de Flask, que importaría el módulo dos veces y cargaría dos veces el modelo.
+    app.run(host="0.0.0.0", port=5002, debug=True, use_reloader=False)
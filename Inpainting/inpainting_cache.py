@@ -0,0 +1,91 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Caché LRU segura entre hilos, limitada por número de entradas y opcionalmente por bytes.
+    Cada entrada guarda lo que costó calcularla, para informar del tiempo ahorrado con los aciertos.
+    """
+
+    def __init__(self, name: str, max_entries: int, max_bytes: int = None, sizeof=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                value, cost = self.entries[key]
+                self.hits += 1
+                self.saved_seconds += cost
+                return value
+            self.misses += 1
+            return None
+
+    def put(self, key, value, cost: float = 0.0) -> None:
+        size = self.sizeof(value)
+        if self.max_entries <= 0 or (self.max_bytes is not None and size > self.max_bytes):
+            return
+        with self.lock:
+            if key in self.entries:
+                self.current_bytes -= self.sizeof(self.entries.pop(key)[0])
+            self.entries[key] = (value, cost)
+            self.current_bytes += size
+            while len(self.entries) > self.max_entries or (
+                self.max_bytes is not None and self.current_bytes > self.max_bytes
+            ):
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.current_bytes -= self.sizeof(evicted)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "saved_ms": round(self.saved_seconds * 1000, 1),
+            }
+
+
+# Embeddings del codificador de texto (positivo y negativo) por (model_id, prompt).
+embeddings = LRUCache("embeddings", int(os.getenv("INPAINTING_EMBEDDING_CACHE_ENTRIES", 256)))
+
+# PNG resultantes por huella de la petición: con la semilla fija, la misma entrada da la misma imagen.
+results = LRUCache(
+    "results",
+    int(os.getenv("INPAINTING_RESULT_CACHE_ENTRIES", 512)),
+    max_bytes=int(os.getenv("INPAINTING_RESULT_CACHE_MAX_BYTES", 256 * 1024 * 1024)),
+    sizeof=len
+)
+
+
+def result_key(model_id: str, image_bytes: bytes, mask_bytes: bytes, prompt: str, **params) -> str:
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(image_bytes).digest())
+    digest.update(hashlib.sha256(mask_bytes).digest())
+    digest.update(json.dumps([model_id, prompt, params], sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def stats() -> dict:
+    return {cache.name: cache.stats() for cache in (embeddings, results)}
@@ -0,0 +1,328 @@
+import io
+import os
+import time
+import uuid
+import threading
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import torch
+import inpainting_cache
+
+QUEUE_SIZE = int(os.getenv("INPAINTING_QUEUE_SIZE", 16))
+MAX_BATCH_SIZE = int(os.getenv("INPAINTING_MAX_BATCH", 4))
+# Tiempo que el worker espera a que lleguen peticiones compatibles antes de lanzar un lote.
+BATCH_WAIT = float(os.getenv("INPAINTING_BATCH_WAIT", 0.05))
+RESULT_TTL = float(os.getenv("INPAINTING_RESULT_TTL", 600))
+PADDING_MASK_CROP = 3
+DATABASE_API_URL = os.getenv("DATABASE_API_URL", "http://api:8000")
+PERSIST_TIMEOUT = float(os.getenv("INPAINTING_PERSIST_TIMEOUT", 30))
+
+
+class QueueFull(Exception):
+    pass
+
+
+class InpaintingTask:
+    """
+    Una petición de inpainting. Solo se agrupan en el mismo lote las que comparten modelo,
+    resolución y parámetros de difusión.
+    """
+
+    def __init__(self, model_id, prompt, image, mask, steps=30, strength=0.85, guidance_scale=10.0, seed=92,
+                 cache_key=None, project_id=None, source_image_id=None):
+        self.id = uuid.uuid4().hex
+        self.cache_key = cache_key
+        # Si hay project_id, el resultado se guarda directamente en la Database-API como borrador.
+        self.project_id = project_id
+        self.source_image_id = source_image_id
+        self.draft = None
+        self.model_id = model_id
+        self.prompt = prompt
+        self.image = image
+        self.mask = mask
+        self.steps = steps
+        self.strength = strength
+        self.guidance_scale = guidance_scale
+        self.seed = seed
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.batch_size = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.done = threading.Event()
+
+    @property
+    def batch_key(self):
+        return (self.model_id, self.image.size, self.steps, self.strength, self.guidance_scale)
+
+    @property
+    def inflight_key(self):
+        return (self.cache_key, self.project_id, self.source_image_id) if self.cache_key else None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "model_id": self.model_id,
+            "batch_size": self.batch_size,
+            "draft": self.draft,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+
+class InpaintingWorker:
+    """
+    Único hilo que usa el dispositivo: saca peticiones de una cola acotada y ejecuta las
+    compatibles en una sola llamada al pipeline, en lugar de que cada hilo de Flask compita
+    por la memoria de la GPU.
+    """
+
+    def __init__(self, models, queue_size: int = QUEUE_SIZE, max_batch_size: int = MAX_BATCH_SIZE, batch_wait: float = BATCH_WAIT):
+        self.models = models
+        self.queue_size = queue_size
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait
+        self.pending = deque()
+        self.tasks = {}
+        # Peticiones idénticas (misma cache_key) en cola o en marcha comparten la misma tarea.
+        self.inflight = {}
+        self.condition = threading.Condition()
+        self.thread = None
+        self.persister = ThreadPoolExecutor(max_workers=2)
+        self.metrics = {
+            "submitted": 0,
+            "deduplicated": 0,
+            "rejected": 0,
+            "completed": 0,
+            "failed": 0,
+            "batches": 0,
+            "batch_sizes": Counter(),
+            "steps": 0,
+            "step_seconds": 0.0,
+            "last_step_seconds": None
+        }
+
+    def start(self) -> None:
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, daemon=True)
+                self.thread.start()
+
+    def submit(self, task: InpaintingTask) -> InpaintingTask:
+        """
+        Encola la tarea y la devuelve; si ya hay una idéntica pendiente devuelve esa otra.
+        """
+        self.start()
+        with self.condition:
+            self._forget_old_tasks()
+            if task.inflight_key in self.inflight:
+                self.metrics["deduplicated"] += 1
+                return self.inflight[task.inflight_key]
+            if len(self.pending) >= self.queue_size:
+                self.metrics["rejected"] += 1
+                raise QueueFull()
+            self.pending.append(task)
+            self.tasks[task.id] = task
+            if task.inflight_key:
+                self.inflight[task.inflight_key] = task
+            self.metrics["submitted"] += 1
+            self.condition.notify()
+        return task
+
+    def get(self, task_id: str):
+        with self.condition:
+            return self.tasks.get(task_id)
+
+    def add_finished(self, task: InpaintingTask, result: bytes) -> InpaintingTask:
+        """
+        Registra como terminada una tarea cuyo resultado ya estaba en la caché.
+        """
+        task.result = result
+        task.status = "succeeded"
+        with self.condition:
+            self._forget_old_tasks()
+            self.tasks[task.id] = task
+        self._finish(task)
+        return task
+
+    def _finish(self, task: InpaintingTask) -> None:
+        """
+        Da la tarea por terminada; si hay que guardarla en el proyecto, lo hace antes en otro
+        hilo para que el worker del dispositivo no espere a la red.
+        """
+        if task.status == "succeeded" and task.project_id:
+            self.persister.submit(self._persist, task)
+        else:
+            task.finished_at = time.time()
+            task.done.set()
+
+    def _persist(self, task: InpaintingTask) -> None:
+        try:
+            response = requests.post(
+                f"{DATABASE_API_URL}/project/{task.project_id}/synthetic-drafts",
+                files={"file": ("inpainting.png", task.result, "image/png")},
+                data={"source_image_id": task.source_image_id} if task.source_image_id else {},
+                timeout=PERSIST_TIMEOUT
+            )
+            response.raise_for_status()
+            task.draft = response.json()
+        except Exception as e:
+            task.error = f"Could not save the result in the project: {e}"
+            task.status = "failed"
+        finally:
+            task.finished_at = time.time()
+            task.done.set()
+
+    def _forget_old_tasks(self) -> None:
+        now = time.time()
+        for task_id in [
+            task_id for task_id, task in self.tasks.items()
+            if task.finished_at and now - task.finished_at > RESULT_TTL
+        ]:
+            del self.tasks[task_id]
+
+    def _next_batch(self) -> list:
+        """
+        Toma la petición más antigua y, durante batch_wait, las compatibles que vayan llegando.
+        """
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+
+            key = self.pending[0].batch_key
+            deadline = time.monotonic() + self.batch_wait
+            while True:
+                batch = [task for task in self.pending if task.batch_key == key][:self.max_batch_size]
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.max_batch_size or remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            for task in batch:
+                self.pending.remove(task)
+                task.status = "running"
+                task.batch_size = len(batch)
+            return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._next_batch()
+            try:
+                results, seconds = self._run(batch)
+                cost = seconds / len(batch)
+                for task, result in zip(batch, results):
+                    img_io = io.BytesIO()
+                    result.save(img_io, 'PNG')
+                    task.result = img_io.getvalue()
+                    task.status = "succeeded"
+                    if task.cache_key:
+                        inpainting_cache.results.put(task.cache_key, task.result, cost)
+                self.metrics["completed"] += len(batch)
+            except Exception as e:
+                for task in batch:
+                    task.error = str(e)
+                    task.status = "failed"
+                self.metrics["failed"] += len(batch)
+            finally:
+                self.metrics["batches"] += 1
+                self.metrics["batch_sizes"][len(batch)] += 1
+                with self.condition:
+                    for task in batch:
+                        self.inflight.pop(task.inflight_key, None)
+                for task in batch:
+                    self._finish(task)
+
+    def _run(self, batch: list) -> tuple:
+        """
+        Ejecuta el lote en una sola llamada. El pipeline solo admite padding_mask_crop con una
+        imagen, así que el recorte alrededor de la máscara y el pegado del resultado sobre el
+        original se hacen aquí para cada petición. Devuelve (imágenes, segundos de la llamada al
+        pipeline), sin contar la carga del modelo ni la espera por su lock.
+        """
+        first = batch[0]
+        pipeline, pipeline_lock = self.models.get(first.model_id)
+        # Como hace el pipeline con una sola imagen: tamaño del original redondeado a múltiplo de 8.
+        height, width = pipeline.image_processor.get_default_height_width(first.image)
+
+        crops = [
+            pipeline.mask_processor.get_crop_region(task.mask, width, height, pad=PADDING_MASK_CROP)
+            for task in batch
+        ]
+        last_step = [None]
+
+        def on_step_end(pipe, step, timestep, callback_kwargs):
+            # Se mide entre pasos consecutivos para no contar la codificación del prompt y las imágenes.
+            now = time.perf_counter()
+            if last_step[0] is not None:
+                self.metrics["steps"] += 1
+                self.metrics["step_seconds"] += now - last_step[0]
+                self.metrics["last_step_seconds"] = now - last_step[0]
+            last_step[0] = now
+            return callback_kwargs
+
+        with pipeline_lock:
+            started = time.perf_counter()
+            images = pipeline(
+                **self._prompt_inputs(pipeline, first.model_id, [task.prompt for task in batch]),
+                image=[task.image.crop(crop) for task, crop in zip(batch, crops)],
+                mask_image=[task.mask.crop(crop) for task, crop in zip(batch, crops)],
+                height=height,
+                width=width,
+                num_inference_steps=first.steps,
+                strength=first.strength,
+                guidance_scale=first.guidance_scale,
+                generator=[torch.Generator(self.models.device).manual_seed(task.seed) for task in batch],
+                callback_on_step_end=on_step_end
+            ).images
+            seconds = time.perf_counter() - started
+
+        return [
+            pipeline.image_processor.apply_overlay(task.mask, task.image, image, crop)
+            for task, image, crop in zip(batch, images, crops)
+        ], seconds
+
+    def _prompt_inputs(self, pipeline, model_id: str, prompts: list) -> dict:
+        """
+        Embeddings de los prompts sacados de la caché, codificando solo los que falten. Solo para
+        pipelines de Stable Diffusion; con otros se pasan los prompts tal cual.
+        """
+        from diffusers import StableDiffusionInpaintPipeline
+
+        if not isinstance(pipeline, StableDiffusionInpaintPipeline):
+            return {"prompt": prompts}
+
+        positives, negatives = [], []
+        for prompt in prompts:
+            cached = inpainting_cache.embeddings.get((model_id, prompt))
+            if cached is None:
+                started = time.perf_counter()
+                cached = pipeline.encode_prompt(prompt, pipeline.device, 1, True)
+                inpainting_cache.embeddings.put((model_id, prompt), cached, time.perf_counter() - started)
+            positives.append(cached[0])
+            negatives.append(cached[1])
+        return {"prompt_embeds": torch.cat(positives), "negative_prompt_embeds": torch.cat(negatives)}
+
+    def stats(self) -> dict:
+        with self.condition:
+            metrics = dict(self.metrics)
+            queue_depth = len(self.pending)
+        batches = metrics["batches"]
+        return {
+            "queue_depth": queue_depth,
+            "queue_size": self.queue_size,
+            "max_batch_size": self.max_batch_size,
+            "submitted": metrics["submitted"],
+            "deduplicated": metrics["deduplicated"],
+            "rejected": metrics["rejected"],
+            "completed": metrics["completed"],
+            "failed": metrics["failed"],
+            "batches": batches,
+            "batch_sizes": {str(size): count for size, count in sorted(metrics["batch_sizes"].items())},
+            "mean_batch_size": sum(size * count for size, count in metrics["batch_sizes"].items()) / batches if batches else 0.0,
+            "mean_step_seconds": metrics["step_seconds"] / metrics["steps"] if metrics["steps"] else None,
+            "last_step_seconds": metrics["last_step_seconds"]
+        }
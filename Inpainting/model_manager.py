@@ -0,0 +1,193 @@
+import os
+import json
+import tempfile
+import threading
+from collections import OrderedDict
+import torch
+from PIL import Image
+
+DEFAULT_MODEL_ID = os.getenv("INPAINTING_MODEL_ID", "stabilityai/stable-diffusion-2-inpainting")
+# Modelos que se pueden pedir en el campo 'model_id'; "tiny" es un pipeline local con pesos aleatorios.
+ALLOWED_MODEL_IDS = [
+    model_id.strip()
+    for model_id in os.getenv("INPAINTING_MODELS", DEFAULT_MODEL_ID).split(",")
+    if model_id.strip()
+]
+MAX_LOADED_MODELS = int(os.getenv("INPAINTING_MAX_MODELS", 1))
+WARMUP_SIZE = int(os.getenv("INPAINTING_WARMUP_SIZE", 512))
+TINY_MODEL_ID = "tiny"
+
+
+def select_device() -> str:
+    """
+    INPAINTING_DEVICE si está definido; si no, CUDA cuando hay GPU y CPU en otro caso.
+    """
+    if os.getenv("INPAINTING_DEVICE"):
+        return os.getenv("INPAINTING_DEVICE")
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def _byte_characters() -> list:
+    """
+    Los 256 caracteres con los que el BPE de CLIP representa cada byte (como en GPT-2).
+    """
+    printable = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) + list(range(ord("®"), ord("ÿ") + 1))
+    characters = {byte: chr(byte) for byte in printable}
+    for byte in range(256):
+        if byte not in characters:
+            characters[byte] = chr(256 + len(characters) - len(printable))
+    return [characters[byte] for byte in range(256)]
+
+
+def tiny_pipeline():
+    """
+    Pipeline de inpainting diminuto con pesos aleatorios, construido en local (sin red ni GPU).
+    Sirve para probar el servicio; las imágenes que genera son ruido.
+    """
+    from diffusers import StableDiffusionInpaintPipeline, UNet2DConditionModel, AutoencoderKL, PNDMScheduler
+    from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+
+    torch.manual_seed(0)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=2,
+        sample_size=32,
+        in_channels=9,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=32
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[32, 64],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D", "DownEncoderBlock2D"],
+        up_block_types=["UpDecoderBlock2D", "UpDecoderBlock2D"],
+        latent_channels=4
+    )
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        bos_token_id=0,
+        eos_token_id=1,
+        pad_token_id=1,
+        hidden_size=32,
+        intermediate_size=37,
+        num_attention_heads=4,
+        num_hidden_layers=5,
+        vocab_size=1000,
+        projection_dim=32
+    ))
+
+    # Vocabulario BPE mínimo: los tokens especiales y un token por byte, sin reglas de unión.
+    characters = _byte_characters()
+    vocab = ["<|startoftext|>", "<|endoftext|>"] + characters + [f"{c}</w>" for c in characters]
+    tokenizer_dir = tempfile.mkdtemp(prefix="tiny-tokenizer-")
+    with open(os.path.join(tokenizer_dir, "vocab.json"), "w") as f:
+        json.dump({token: i for i, token in enumerate(vocab)}, f)
+    with open(os.path.join(tokenizer_dir, "merges.txt"), "w") as f:
+        f.write("#version: 0.2\n")
+    tokenizer = CLIPTokenizer(
+        os.path.join(tokenizer_dir, "vocab.json"),
+        os.path.join(tokenizer_dir, "merges.txt"),
+        model_max_length=77
+    )
+
+    return StableDiffusionInpaintPipeline(
+        unet=unet,
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=tokenizer,
+        scheduler=PNDMScheduler(skip_prk_steps=True, steps_offset=1),
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False
+    )
+
+
+def load_pipeline(model_id: str, device: str):
+    if model_id == TINY_MODEL_ID:
+        pipeline = tiny_pipeline()
+    else:
+        from diffusers import AutoPipelineForInpainting
+
+        # En CPU no hay kernels de float16: se cargan los pesos completos en float32.
+        options = {"torch_dtype": torch.float16, "variant": "fp16"} if device.startswith("cuda") else {}
+        pipeline = AutoPipelineForInpainting.from_pretrained(model_id, **options)
+
+    pipeline = pipeline.to(device)
+    pipeline.set_progress_bar_config(disable=True)
+    return pipeline
+
+
+class ModelManager:
+    """
+    Mantiene cargados en memoria los pipelines de inpainting (LRU de max_models), de modo que
+    cada petición no vuelva a leer los pesos del disco ni a moverlos al dispositivo. Cada
+    pipeline lleva su propio lock porque no se puede usar desde dos hilos a la vez.
+    """
+
+    def __init__(self, max_models: int = MAX_LOADED_MODELS, device: str = None, loader=load_pipeline):
+        self.max_models = max_models
+        self.device = device or select_device()
+        self.loader = loader
+        self.models = OrderedDict()
+        self.loading = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def get(self, model_id: str):
+        """
+        Devuelve (pipeline, lock) del modelo, cargándolo si hace falta. Si dos peticiones piden
+        a la vez un modelo que no está cargado, solo una lo carga y la otra espera.
+        """
+        with self.lock:
+            if model_id in self.models:
+                self.models.move_to_end(model_id)
+                return self.models[model_id]
+            load_lock = self.loading.setdefault(model_id, threading.Lock())
+
+        with load_lock:
+            with self.lock:
+                if model_id in self.models:
+                    self.models.move_to_end(model_id)
+                    return self.models[model_id]
+            try:
+                pipeline = self.loader(model_id, self.device)
+            except Exception as e:
+                with self.lock:
+                    self.errors[model_id] = str(e)
+                    self.loading.pop(model_id, None)
+                raise
+            self.errors.pop(model_id, None)
+
+            with self.lock:
+                self.models[model_id] = (pipeline, threading.Lock())
+                self.loading.pop(model_id, None)
+                while len(self.models) > self.max_models:
+                    self.models.popitem(last=False)
+                    if self.device.startswith("cuda"):
+                        torch.cuda.empty_cache()
+                return self.models[model_id]
+
+    def warmup(self, model_id: str, size: int = WARMUP_SIZE) -> None:
+        """
+        Carga el modelo y hace una inferencia de un paso para inicializar kernels y memoria.
+        """
+        pipeline, pipeline_lock = self.get(model_id)
+        with pipeline_lock:
+            pipeline(
+                prompt="",
+                image=Image.new("RGB", (size, size)),
+                mask_image=Image.new("L", (size, size), 255),
+                num_inference_steps=1
+            )
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                "device": self.device,
+                "loaded": list(self.models),
+                "loading": list(self.loading),
+                "errors": dict(self.errors),
+                "max_models": self.max_models
+            }
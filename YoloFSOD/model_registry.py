@@ -0,0 +1,184 @@
+import os, re, json, time, uuid, shutil, hashlib, tempfile, threading
+
+REGISTRY_ROOT = os.getenv('FSOD_MODEL_REGISTRY', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models'))
+MAX_CHECKPOINTS_PER_PROJECT = int(os.getenv('FSOD_MAX_CHECKPOINTS_PER_PROJECT', 3))
+MAX_REGISTRY_BYTES = int(os.getenv('FSOD_MAX_REGISTRY_BYTES', 20 * 1024 ** 3))
+
+FINGERPRINT_SPLITS = ('train', 'val')
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Las versiones son huellas SHA-256 en hexadecimal (de la Database-API o de dataset_fingerprint).
+FINGERPRINT_PATTERN = re.compile(r'[0-9a-f]{64}')
+# Checkpoints base que se pueden pedir por nombre ('model'); YOLO() carga cualquier ruta local o
+# descarga lo que se le pase, así que no se acepta nada fuera de esta lista.
+BASE_MODELS = set(filter(None, os.getenv('FSOD_BASE_MODELS', ','.join(
+    f'{family}{size}.pt' for family in ('yolov8', 'yolo11', 'yolo12') for size in 'nsmlx'
+)).split(',')))
+
+_lock = threading.Lock()
+
+class InvalidKey(ValueError):
+    pass
+
+def check_key(project_id, fingerprint=None):
+    """
+    Ambos valores llegan en la petición y forman rutas del registro: el proyecto tiene que ser
+    un UUID y la versión una huella en hexadecimal. Devuelve el project_id normalizado.
+    """
+    try:
+        project_id = str(uuid.UUID(str(project_id)))
+    except ValueError:
+        raise InvalidKey(f'Invalid project_id: {project_id}')
+    if fingerprint is not None and not FINGERPRINT_PATTERN.fullmatch(fingerprint):
+        raise InvalidKey(f'Invalid model_version: {fingerprint}')
+    return project_id
+
+def check_base_model(name):
+    if name not in BASE_MODELS:
+        raise InvalidKey(f'Unknown base model: {name}')
+    return name
+
+def _registry_path(*parts):
+    root = os.path.realpath(REGISTRY_ROOT)
+    path = os.path.realpath(os.path.join(root, *parts))
+    if not path.startswith(root + os.sep):
+        raise InvalidKey(f'Path outside the model registry: {path}')
+    return path
+
+def _index_path():
+    return os.path.join(REGISTRY_ROOT, 'index.json')
+
+def _load_index():
+    try:
+        with open(_index_path()) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _save_index(index):
+    os.makedirs(REGISTRY_ROOT, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=REGISTRY_ROOT, prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(temp_path, _index_path())
+
+def _file_digest(path):
+    # En modo volumen compartido las imágenes son enlaces a blobs cuyo nombre ya es su SHA-256.
+    if os.path.islink(path):
+        return os.path.basename(os.readlink(path))
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def dataset_fingerprint(dataset_dir, names, base_model, imgsz):
+    """
+    Huella del conjunto de entrenamiento: contenido de las imágenes y etiquetas de train/val,
+    clases, modelo base y tamaño de entrada. Las imágenes a predecir no cuentan.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([names, base_model, int(imgsz)]).encode())
+    for split in FINGERPRINT_SPLITS:
+        for kind in ('images', 'labels'):
+            split_dir = os.path.join(dataset_dir, kind, split)
+            if not os.path.isdir(split_dir):
+                continue
+            for name in sorted(os.listdir(split_dir)):
+                digest.update(f'{kind}/{split}/{name}:{_file_digest(os.path.join(split_dir, name))}\n'.encode())
+    return digest.hexdigest()
+
+def find(project_id, fingerprint):
+    """
+    Devuelve el checkpoint entrenado con exactamente este dataset, si sigue en el registro.
+    """
+    project_id = check_key(project_id, fingerprint)
+    with _lock:
+        index = _load_index()
+        for entry in index.get(project_id, []):
+            if entry['fingerprint'] == fingerprint and os.path.exists(entry['path']):
+                entry['last_used'] = time.time()
+                _save_index(index)
+                return entry
+    return None
+
+def latest(project_id, names=None):
+    """
+    Último checkpoint del proyecto (con las mismas clases, si se indican), para continuar el
+    ajuste desde él o para predecir.
+    """
+    project_id = check_key(project_id)
+    with _lock:
+        entries = [
+            entry for entry in _load_index().get(project_id, [])
+            if (names is None or entry['names'] == names) and os.path.exists(entry['path'])
+        ]
+    return max(entries, key=lambda entry: entry['created_at'], default=None)
+
+def save(project_id, fingerprint, checkpoint, **metadata):
+    """
+    Copia el mejor checkpoint de un entrenamiento al registro y aplica los límites LRU.
+    """
+    project_id = check_key(project_id, fingerprint)
+    project_dir = _registry_path(project_id)
+    os.makedirs(project_dir, exist_ok=True)
+    path = _registry_path(project_id, f'{fingerprint}.pt')
+
+    fd, temp_path = tempfile.mkstemp(dir=project_dir, prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as dst, open(checkpoint, 'rb') as src:
+        shutil.copyfileobj(src, dst)
+    os.replace(temp_path, path)
+
+    now = time.time()
+    entry = {
+        'fingerprint': fingerprint,
+        'path': path,
+        'size': os.path.getsize(path),
+        'created_at': now,
+        'last_used': now,
+        **metadata
+    }
+    with _lock:
+        index = _load_index()
+        entries = [e for e in index.get(project_id, []) if e['fingerprint'] != fingerprint]
+        index[project_id] = entries + [entry]
+        _evict(index)
+        _save_index(index)
+    return entry
+
+def _evict(index):
+    """
+    Deja como mucho MAX_CHECKPOINTS_PER_PROJECT por proyecto y MAX_REGISTRY_BYTES en total,
+    borrando primero los menos usados.
+    """
+    removed = []
+    for project_id, entries in index.items():
+        entries.sort(key=lambda entry: entry['last_used'], reverse=True)
+        removed += entries[MAX_CHECKPOINTS_PER_PROJECT:]
+        index[project_id] = entries[:MAX_CHECKPOINTS_PER_PROJECT]
+
+    remaining = sorted(
+        ((entry['last_used'], project_id, entry) for project_id, entries in index.items() for entry in entries),
+        key=lambda item: item[0]
+    )
+    total = sum(entry['size'] for _, _, entry in remaining)
+    # El checkpoint recién guardado (el más reciente) nunca se expulsa.
+    for _, project_id, entry in remaining[:-1]:
+        if total <= MAX_REGISTRY_BYTES:
+            break
+        index[project_id].remove(entry)
+        removed.append(entry)
+        total -= entry['size']
+
+    # Solo se borra dentro del registro, aunque el índice tenga entradas escritas a mano o antiguas.
+    for entry in removed:
+        try:
+            os.remove(_registry_path(entry['path']))
+        except (FileNotFoundError, InvalidKey):
+            pass
+    for project_id in [project_id for project_id, entries in index.items() if not entries]:
+        del index[project_id]
+        try:
+            shutil.rmtree(_registry_path(check_key(project_id)), ignore_errors=True)
+        except InvalidKey:
+            pass
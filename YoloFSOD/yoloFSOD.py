@@ -1,45 +1,163 @@
 from flask import Flask, request, jsonify
-import os, tempfile, shutil, zipfile, json, yaml
-from pathlib import Path
+import os, io, tempfile, shutil, zipfile, tarfile, yaml, threading
+import requests
+from collections import OrderedDict
+from itertools import islice
+from PIL import Image
 from ultralytics import YOLO
+import model_registry
 
 app = Flask(__name__)
 
-def read_predictions_from_txt(pred_dir, img_dir):
-    result_data = []
+PROGRESS_EVERY_FRAMES = 20
+WARM_START_EPOCHS = int(os.getenv('FSOD_WARM_START_EPOCHS', 10))
+PREDICT_BATCH_SIZE = int(os.getenv('FSOD_PREDICT_BATCH_SIZE', 16))
+MODEL_CACHE_SIZE = int(os.getenv('FSOD_MODEL_CACHE_SIZE', 2))
+DEVICE = os.getenv('FSOD_DEVICE') or None
+BLOB_ROOT = os.getenv('FSOD_BLOB_ROOT', '/blobs')
 
-    for txt_file in Path(pred_dir).rglob("*.txt"):
-        img_name = txt_file.stem 
-        corresponding_image = next(Path(img_dir).rglob(f"{img_name}.*"), None)
+class TrainingCancelled(Exception):
+    pass
 
-        if corresponding_image:
-            labels = []
-            with open(txt_file, 'r') as f:
-                for line in f:
-                    parts = line.strip().split()
-                    class_id, x_center, y_center, width, height = map(float, parts)
-                    labels.append([int(class_id), x_center, y_center, width, height])
+def report_progress(callback_url, **progress):
+    """
+    Envía el progreso a la Database-API y devuelve True si el trabajo se ha cancelado.
+    Si la API no responde se sigue entrenando.
+    """
+    if not callback_url:
+        return False
+    try:
+        response = requests.put(callback_url, json=progress, timeout=5)
+        return bool(response.json().get('cancel_requested'))
+    except (requests.RequestException, ValueError):
+        return False
+
+def result_labels(result):
+    """
+    Cajas de un resultado de YOLO en formato YOLO normalizado: [clase, x, y, ancho, alto].
+    """
+    boxes = result.boxes
+    return [[int(class_id), *xywhn] for class_id, xywhn in zip(boxes.cls.tolist(), boxes.xywhn.tolist())]
+
+_models = OrderedDict()
+_models_lock = threading.Lock()
+
+def load_model(path):
+    """
+    Modelos ya cargados por checkpoint (LRU de MODEL_CACHE_SIZE). Cada uno va con su propio
+    lock porque una instancia de YOLO no puede predecir desde dos hilos a la vez.
+    """
+    with _models_lock:
+        if path in _models:
+            _models.move_to_end(path)
+            return _models[path]
+        _models[path] = (YOLO(path), threading.Lock())
+        while len(_models) > MODEL_CACHE_SIZE:
+            _models.popitem(last=False)
+        return _models[path]
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def iter_request_images(params):
+    """
+    Imágenes de la petición como (nombre, bytes): un TAR en streaming (application/x-tar) o
+    varios ficheros en el campo 'images' de un formulario.
+    """
+    if request.mimetype == 'application/x-tar':
+        with tarfile.open(fileobj=request.stream, mode='r|') as tar:
+            for member in tar:
+                if member.isfile():
+                    with tar.extractfile(member) as f:
+                        yield os.path.basename(member.name), f.read()
+    else:
+        for upload in request.files.getlist('images'):
+            yield upload.filename, upload.read()
+
+def safe_member_path(base_dir, name):
+    path = os.path.realpath(os.path.join(base_dir, name))
+    if not path.startswith(os.path.realpath(base_dir) + os.sep):
+        raise ValueError(f'Invalid path in dataset: {name}')
+    return path
+
+def dataset_from_tar_stream(stream, dataset_dir):
+    """
+    Extrae el TAR según va llegando en la petición (subida chunked), sin guardar el archivo.
+    """
+    with tarfile.open(fileobj=stream, mode='r|') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            path = safe_member_path(dataset_dir, member.name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with tar.extractfile(member) as src, open(path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
 
-            result_data.append({'image': corresponding_image.name, 'labels': labels})
+def blob_path(digest):
+    return os.path.join(BLOB_ROOT, digest[:2], digest[2:4], digest)
 
-    return result_data
+def dataset_from_manifest(manifest, dataset_dir):
+    """
+    Modo volumen compartido: las imágenes se enlazan desde el almacén de blobs de la
+    Database-API (montado en BLOB_ROOT) y solo se escriben las etiquetas y data.yaml.
+    """
+    for split, entries in manifest['splits'].items():
+        images_dir = os.path.join(dataset_dir, 'images', split)
+        labels_dir = os.path.join(dataset_dir, 'labels', split)
+        os.makedirs(images_dir, exist_ok=True)
+        os.makedirs(labels_dir, exist_ok=True)
+
+        for entry in entries:
+            source = blob_path(entry['blob'])
+            if not os.path.exists(source):
+                raise FileNotFoundError(f"Blob for {entry['image']} not found in {BLOB_ROOT}")
+            os.symlink(source, safe_member_path(images_dir, entry['image']))
+
+            if entry.get('labels'):
+                label_name = os.path.splitext(entry['image'])[0] + '.txt'
+                with open(safe_member_path(labels_dir, label_name), 'w') as f:
+                    f.write(f"{entry['labels']}\n")
+
+    with open(os.path.join(dataset_dir, 'data.yaml'), 'w') as f:
+        yaml.dump({
+            'path': './',
+            'train': 'images/train',
+            'predict': 'images/predict',
+            'val': 'images/val',
+            'nc': len(manifest['names']),
+            'names': manifest['names']
+        }, f, sort_keys=False)
 
 @app.route('/fsod-train', methods=['POST'])
 def fsod_train():
+    """
+    Entrena con el dataset recibido y predice las imágenes de images/predict. El dataset puede
+    llegar como TAR en streaming (application/x-tar), como manifiesto de blobs de un volumen
+    compartido (application/json) o como ZIP en un formulario (campo 'dataset').
+    """
     temp_dir = tempfile.mkdtemp()
 
     try:
-        if 'dataset' not in request.files:
-            return jsonify({'error': 'Dataset ZIP is required'}), 400
+        dataset_dir = os.path.join(temp_dir, 'dataset')
 
-        dataset_zip = request.files['dataset']
-        model_name = request.form.get('model', 'yolo11m.pt')
-        zip_path = os.path.join(temp_dir, 'dataset.zip')
-        dataset_zip.save(zip_path)
+        if request.mimetype == 'application/x-tar':
+            params = request.args
+            dataset_from_tar_stream(request.stream, dataset_dir)
+        elif request.mimetype == 'application/json':
+            params = request.args
+            dataset_from_manifest(request.get_json(), dataset_dir)
+        else:
+            params = request.form
+            if 'dataset' not in request.files:
+                return jsonify({'error': 'Dataset ZIP is required'}), 400
+            zip_path = os.path.join(temp_dir, 'dataset.zip')
+            request.files['dataset'].save(zip_path)
+            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                zip_ref.extractall(dataset_dir)
 
-        dataset_dir = os.path.join(temp_dir, 'dataset')
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(dataset_dir)
+        model_name = model_registry.check_base_model(params.get('model', 'yolo11m.pt'))
 
         yaml_path = os.path.join(dataset_dir, 'data.yaml')
         if not os.path.exists(yaml_path):
@@ -56,40 +174,98 @@ def fsod_train():
         with open(yaml_path, 'w') as f:
             yaml.dump(yaml_data, f)
 
-        model = YOLO(model_name)
+        callback_url = params.get('callback_url')
+        project_id = params.get('project_id')
+        imgsz = int(params.get('imgsz', 640))
+        epochs = int(params.get('epochs', 30))
 
-        model.train(
-            data=yaml_path,
-            epochs=int(request.form.get('epochs', 30)),
-            imgsz=int(request.form.get('imgsz', 640)),
-            batch=int(request.form.get('batch', 16)),
-            lr0=float(request.form.get('lr', 0.001)),
-            freeze=10,
-            verbose=False
-        )
+        # Registro de modelos por proyecto: si el conjunto de entrenamiento no ha cambiado se
+        # reutiliza su checkpoint, y si ha cambiado se continúa desde el último con menos épocas.
+        # La clave es la versión que envía la Database-API o, si no llega, la huella del dataset.
+        fingerprint = None
+        registered = None
+        warm_start = None
+        if project_id:
+            fingerprint = params.get('model_version') or model_registry.dataset_fingerprint(
+                dataset_dir, yaml_data.get('names'), model_name, imgsz
+            )
+            registered = model_registry.find(project_id, fingerprint)
+            if not registered:
+                warm_start = model_registry.latest(project_id, yaml_data.get('names'))
+
+        def on_fit_epoch_end(trainer):
+            if report_progress(callback_url, epoch=trainer.epoch + 1, epochs=trainer.epochs):
+                raise TrainingCancelled()
+
+        if registered:
+            training = 'skipped'
+            model = YOLO(registered['path'])
+            report_progress(callback_url, epoch=0, epochs=0)
+        else:
+            if warm_start:
+                training = 'warm-start'
+                model = YOLO(warm_start['path'])
+                epochs = min(epochs, WARM_START_EPOCHS)
+            else:
+                training = 'full'
+                model = YOLO(model_name)
+            model.add_callback('on_fit_epoch_end', on_fit_epoch_end)
+
+            model.train(
+                data=yaml_path,
+                epochs=epochs,
+                imgsz=imgsz,
+                batch=int(params.get('batch', 16)),
+                lr0=float(params.get('lr', 0.001)),
+                freeze=10,
+                project=os.path.join(temp_dir, 'runs'),
+                name='train',
+                verbose=False
+            )
+
+            if project_id:
+                best = model.trainer.best if os.path.exists(model.trainer.best) else model.trainer.last
+                model_registry.save(
+                    project_id,
+                    fingerprint,
+                    best,
+                    names=yaml_data.get('names'),
+                    base_model=model_name,
+                    epochs=epochs,
+                    warm_start_from=warm_start['fingerprint'] if warm_start else None
+                )
 
         predict_images_path = os.path.join(dataset_dir, 'images', 'predict')
         if not os.path.exists(predict_images_path):
             return jsonify({'error': 'predict folder not found in dataset'}), 400
 
-        predict_save_dir = os.path.join(temp_dir, 'predict_results')
-
-        model.predict(
+        results = model.predict(
             source=predict_images_path,
-            save=True,
-            save_txt=True,
-            project=predict_save_dir,
-            name='preds',
-            imgsz=int(request.form.get('imgsz', 640)),
+            imgsz=imgsz,
             conf=0.4,
-            verbose=False
+            device=DEVICE,
+            verbose=False,
+            stream=True
         )
 
-        preds_folder = os.path.join(predict_save_dir, 'preds', 'labels')
+        predictions = []
+        for result in results:
+            predictions.append({'image': os.path.basename(result.path), 'labels': result_labels(result)})
+            if len(predictions) % PROGRESS_EVERY_FRAMES == 0 and report_progress(callback_url, predicted_frames=len(predictions)):
+                raise TrainingCancelled()
+        report_progress(callback_url, predicted_frames=len(predictions))
 
-        predictions = read_predictions_from_txt(preds_folder, predict_images_path)
+        return jsonify({
+            'status': 'success',
+            'predictions': predictions,
+            'model': {'version': fingerprint, 'training': training}
+        })
 
-        return jsonify({'status': 'success', 'predictions': predictions})
+    except TrainingCancelled:
+        return jsonify({'status': 'cancelled'}), 409
+
+    except model_registry.InvalidKey as e:
+        return jsonify({'error': str(e)}), 400
 
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -97,5 +273,55 @@ def fsod_train():
     finally:
         shutil.rmtree(temp_dir, ignore_errors=True)
 
+@app.route('/predict', methods=['POST'])
+def predict():
+    """
+    Predice sin entrenar, por lotes y sin escribir nada en disco. El modelo es el último del
+    registro del proyecto ('project_id', o una versión concreta con 'model_version') o un
+    checkpoint base ('model'). Las imágenes llegan como TAR en streaming o como formulario, y
+    los frames sin detecciones se devuelven con la lista de etiquetas vacía.
+    """
+    params = request.args if request.mimetype == 'application/x-tar' else request.form
+
+    try:
+        project_id = params.get('project_id')
+        version = params.get('model_version')
+        if project_id:
+            entry = model_registry.find(project_id, version) if version else model_registry.latest(project_id)
+            if not entry:
+                return jsonify({'error': 'No trained model for this project'}), 404
+            model_path, version = entry['path'], entry['fingerprint']
+        else:
+            model_path = model_registry.check_base_model(params.get('model', 'yolo11m.pt'))
+
+        model, model_lock = load_model(model_path)
+        batch_size = int(params.get('batch', PREDICT_BATCH_SIZE))
+        predict_args = {
+            'imgsz': int(params.get('imgsz', 640)),
+            'conf': float(params.get('conf', 0.4)),
+            'device': params.get('device') or DEVICE,
+            'verbose': False
+        }
+
+        predictions = []
+        for batch in batched(iter_request_images(params), batch_size):
+            frames = [Image.open(io.BytesIO(data)).convert('RGB') for _, data in batch]
+            with model_lock:
+                results = model.predict(source=frames, **predict_args)
+            for (name, _), result in zip(batch, results):
+                predictions.append({'image': name, 'labels': result_labels(result)})
+
+        return jsonify({
+            'status': 'success',
+            'predictions': predictions,
+            'model': {'version': version, 'path': os.path.basename(model_path)}
+        })
+
+    except model_registry.InvalidKey as e:
+        return jsonify({'error': str(e)}), 400
+
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file